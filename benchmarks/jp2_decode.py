@@ -0,0 +1,118 @@
+""" EWoC Sen2Cor JP2 decoding benchmark
+
+Decode the 10m and 20m JP2 of a Sen2Cor L2A product with the GDAL defaults
+(single thread) and with the ewoc_s2c GDAL profile, each in a fresh process.
+
+    python benchmarks/jp2_decode.py /work/SEN2TEST/OUT/.../S2A_MSIL2A_...SAFE
+    python benchmarks/jp2_decode.py --synthetic 2048
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import Dict, List
+
+SINGLE_THREAD = {
+    "GDAL_NUM_THREADS": "1",
+    "OPJ_NUM_THREADS": "1",
+    "GDAL_CACHEMAX": "2048",
+}
+
+
+def make_synthetic_l2a(root: Path, size10: int) -> Path:
+    """
+    Write random JP2 bands with the Sen2Cor L2A layout and tiling
+    :param root: Output directory
+    :param size10: Size in pixels of the 10m bands
+    :return: Path to the synthetic L2A product
+    """
+    import numpy as np
+    import rasterio
+    from rasterio.transform import from_origin
+
+    rng = np.random.default_rng(0)
+    img_data = root / "S2_SYNTHETIC_L2A.SAFE" / "GRANULE" / "L2A" / "IMG_DATA"
+    for res, bands in ((10, ["B02", "B03", "B04", "B08"]), (20, ["B05", "B11"])):
+        size = size10 * 10 // res
+        (img_data / f"R{res}m").mkdir(parents=True, exist_ok=True)
+        # Smooth reflectance-like values, random noise does not compress
+        base = rng.integers(0, 4000, (size // 16 + 1, size // 16 + 1))
+        band = np.kron(base, np.ones((16, 16)))[:size, :size].astype("uint16")
+        for band_num in bands:
+            with rasterio.open(
+                img_data / f"R{res}m" / f"T00XXX_{band_num}_{res}m.jp2",
+                "w",
+                driver="JP2OpenJPEG",
+                width=size,
+                height=size,
+                count=1,
+                dtype="uint16",
+                crs="EPSG:32631",
+                transform=from_origin(500000, 5000000, res, res),
+                blockxsize=1024,
+                blockysize=1024,
+                quality=100,
+                reversible=True,
+            ) as dst:
+                dst.write(band + rng.integers(0, 50, band.shape, dtype="uint16"), 1)
+    return root / "S2_SYNTHETIC_L2A.SAFE"
+
+
+def decode(paths: List[str], profile: str) -> Dict[str, float]:
+    """
+    Read JP2 files in the current (fresh) process
+    :param paths: JP2 files
+    :param profile: single or ewoc
+    :return: Decoded megapixels and seconds
+    """
+    if profile == "ewoc":
+        from ewoc_s2c.gdal_env import apply_gdal_profile
+
+        apply_gdal_profile()
+    else:
+        os.environ.update(SINGLE_THREAD)
+    import rasterio
+
+    pixels = 0
+    start = time.perf_counter()
+    for path in paths:
+        with rasterio.open(path) as src:
+            pixels += src.read(1).size
+    return {"mpix": pixels / 1e6, "seconds": time.perf_counter() - start}
+
+
+def main() -> None:
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("l2a_folder", nargs="?", type=Path)
+    parser.add_argument("--synthetic", type=int, help="Size of synthetic 10m bands")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        l2a_folder = args.l2a_folder
+        if l2a_folder is None:
+            l2a_folder = make_synthetic_l2a(Path(tmp_dir), args.synthetic or 2048)
+        ctx = multiprocessing.get_context("spawn")
+        for res in (10, 20):
+            paths = sorted(str(path) for path in l2a_folder.rglob(f"*_{res}m.jp2"))
+            if not paths:
+                continue
+            for profile in ("single", "ewoc"):
+                runs = []
+                for _ in range(args.repeat):
+                    with ProcessPoolExecutor(1, mp_context=ctx) as executor:
+                        runs.append(executor.submit(decode, paths, profile).result())
+                best = min(runs, key=lambda run: run["seconds"])
+                print(
+                    f"{res}m {profile:>6}: {len(paths)} files, "
+                    f"{best['mpix']:.1f} Mpix in {best['seconds']:.2f}s "
+                    f"({best['mpix'] / best['seconds']:.1f} Mpix/s)"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+""" EWoC Sen2Cor end-to-end pipeline harness
+
+Time the s2c_id command offline for the L1C flow and the three L2A source
+branches, to measure the orchestration cost of a change:
+
+- Sen2Cor is replaced by the L2A_Process stub (stub_l2a_process.py)
+- ewoc_dag get_s2_product/get_dem_data are replaced by local stand-ins
+  serving synthetic products
+- a local HTTP server serves a flat DEM for every SRTM and Copernicus DEM
+  tile, downloaded through the DEM cache
+- a local S3 (moto server) serves the Creodias EODATA (L1C and L2A, by
+  ranged downloads) and Sinergise L2A buckets and receives the ARD uploads
+  (ewoc_dag EWOCARDBucket is replaced by a local stand-in)
+
+    pip install "moto[server]"
+    python benchmarks/pipeline_harness.py --size 1098 --repeat 3
+
+Other options are passed to s2c_id (ex: --only_scl, --ard_layout stacked).
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+import stub_l2a_process as stub
+
+L1C_PID = "S2B_MSIL1C_20220322T105629_N0400_R094_T30SWF_20220322T131655.SAFE"
+L2A_PID = "S2B_MSIL2A_20220322T105629_N0400_R094_T30SWF_20220322T131655.SAFE"
+SNG_TILE_PATH = "tiles/30/S/WF/2022/3/22/0"
+ARD_BUCKET = "ewoc-ard-bench"
+# Case name: (product id, data source)
+CASES = {
+    "l1c_creodias": (L1C_PID, "creodias"),
+    "l2a_creodias": (L2A_PID, "creodias"),
+    "l2a_aws_sng": (L2A_PID, "aws_sng"),
+    "l2a_aws": (L2A_PID, "aws"),
+    "l2a_auto": (L2A_PID, "auto"),
+}
+REPO_DIR = Path(__file__).resolve().parents[1]
+
+
+def write_flat_dem(dem_file: Path) -> None:
+    """Write a flat DEM tile on the tile grid"""
+    import numpy as np
+
+    stub.write_band(dem_file, np.full((600, 600), 120, dtype="int16"), 90, "GTiff")
+
+
+class LocalDag:
+    """Stand-in for the ewoc_dag download functions, copies local products"""
+
+    def __init__(self, archive: Path) -> None:
+        self.archive = archive
+
+    def get_s2_product(
+        self,
+        prd_id: str,
+        out_root_dirpath: Path,
+        aws_l2a_cogs: bool = False,
+        **_kwargs: Any,
+    ) -> Path:
+        """Copy the L1C SAFE or the L2A COGs of the archive"""
+        if aws_l2a_cogs:
+            prd_name = prd_id.replace(".SAFE", "")
+            return Path(
+                shutil.copytree(
+                    self.archive / "cogs" / prd_name, out_root_dirpath / prd_name
+                )
+            )
+        if not (self.archive / prd_id).exists():
+            raise ValueError(f"{prd_id} not in the local archive")
+        return Path(shutil.copytree(self.archive / prd_id, out_root_dirpath / prd_id))
+
+    def get_dem_data(
+        self, tile_id: str, out_dir: Path, dem_type: str = "srtm", **_kwargs: Any
+    ) -> None:
+        """Write a flat DEM tile"""
+        dem_file = out_dir / "srtm3s" / "srtm_37_04.tif"
+        if dem_type == "copdem":
+            dem_file = out_dir / f"Copernicus_DSM_COG_10_{tile_id}_DEM.tif"
+        write_flat_dem(dem_file)
+
+
+class LocalARDBucket:
+    """Stand-in for ewoc_dag EWOCARDBucket, the ARD bucket of the local S3"""
+
+    def __init__(self) -> None:
+        import boto3
+
+        self._bucket_name = ARD_BUCKET
+        self._s3_client = boto3.client("s3")
+
+
+class DemHandler(BaseHTTPRequestHandler):
+    """Stand-in for the DEM tile servers, the same flat DEM for every tile"""
+
+    dem_file: Path
+    requests = 0
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Send the flat DEM"""
+        DemHandler.requests += 1
+        body = self.dem_file.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args: Any) -> None:
+        """Quiet"""
+
+
+def setup_env(root: Path, endpoint: str, dem_url: str) -> None:
+    """
+    Point ewoc_s2c and boto3 to the harness folders, local S3 and DEM
+    server, has to be done before importing ewoc_s2c
+    """
+    cfg_dir = root / "sen2cor" / "cfg"
+    cfg_dir.mkdir(parents=True)
+    shutil.copy(REPO_DIR / "L2A_GIPP.xml", cfg_dir)
+    stub_bin = root / "L2A_Process"
+    stub_bin.write_text(
+        f'#!/bin/sh\nexec {sys.executable} {Path(stub.__file__).resolve()} "$@"\n',
+        encoding="utf-8",
+    )
+    stub_bin.chmod(0o755)
+    os.environ.update(
+        {
+            "EWOC_S2C_SEN2COR_ROOT": str(root / "sen2cor"),
+            "EWOC_S2C_L2A_PROCESS": str(stub_bin),
+            "EWOC_S2C_WORK_ROOT": str(root / "work"),
+            "EWOC_S2C_PID_CACHE": str(root / "pid_cache.json"),
+            "EWOC_S2C_DEM_CACHE": str(root / "dem_cache"),
+            "EWOC_S2C_SRTM_URL": f"{dem_url}/srtm/{{tile}}.tif",
+            "EWOC_S2C_COPDEM_URL": f"{dem_url}/copdem/{{tile}}.tif",
+            "AWS_ENDPOINT_URL": endpoint,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "CREODIAS_EODATA_ENDPOINT": endpoint,
+            "CREODIAS_EODATA_ACCESS_KEY_ID": "bench",
+            "CREODIAS_EODATA_SECRET_ACCESS_KEY": "bench",
+        }
+    )
+
+
+def make_archive(
+    archive: Path, size10: int, valid_fraction: float = 1.0, cloud_cover: float = 0.0
+) -> None:
+    """
+    Write the synthetic products and fill the local S3 buckets
+    :param archive: Folder of the local products
+    :param size10: Size in pixels of the 10m bands
+    :param valid_fraction: Fraction of the tile with data (swath edge tiles)
+    :param cloud_cover: Cloud cover of the product metadata (%)
+    """
+    import boto3
+
+    from ewoc_s2c.fetch import (
+        AWS_SNG_L2A_BUCKET,
+        CREODIAS_EODATA_BUCKET,
+        aws_sng_prd_prefix,
+        creodias_prd_prefix,
+    )
+    from ewoc_s2c.utils import get_ard_bands
+
+    b02 = stub.synthetic_band(size10, valid_fraction=valid_fraction)
+    l1c_safe = stub.make_l1c_safe(archive, L1C_PID, size10, valid_fraction, cloud_cover)
+    l2a_safe = stub.make_l2a_safe(archive, L2A_PID, b02, boa_offset=-1000)
+    l2a_granule = next(l2a_safe.glob("GRANULE/*"))
+    stub.write_tile_metadata(l2a_granule, cloud_cover, (1 - valid_fraction) * 100)
+    cog_dir = archive / "cogs" / L2A_PID.replace(".SAFE", "")
+    for band, res in get_ard_bands().items():
+        stub.write_band(
+            cog_dir / f"{band}.tif", stub.l2a_bands(b02, res, False)[band], res, "GTiff"
+        )
+
+    s3_client = boto3.client("s3")
+    for bucket in (CREODIAS_EODATA_BUCKET, AWS_SNG_L2A_BUCKET, ARD_BUCKET):
+        s3_client.create_bucket(Bucket=bucket)
+    for pid, safe in ((L1C_PID, l1c_safe), (L2A_PID, l2a_safe)):
+        for path in safe.rglob("*"):
+            if path.is_file():
+                key = f"{creodias_prd_prefix(pid)}/{path.relative_to(safe)}"
+                s3_client.upload_file(str(path), CREODIAS_EODATA_BUCKET, key)
+    for path in l2a_safe.rglob("IMG_DATA/R*m/*.jp2"):
+        band = path.stem.split("_")[2]
+        key = f"{SNG_TILE_PATH}/{path.parent.name}/{band}.jp2"
+        s3_client.upload_file(str(path), AWS_SNG_L2A_BUCKET, key)
+    prd_prefix = aws_sng_prd_prefix(L2A_PID)
+    s3_client.put_object(
+        Bucket=AWS_SNG_L2A_BUCKET,
+        Key=f"{prd_prefix}/productInfo.json",
+        Body=json.dumps({"tiles": [{"path": SNG_TILE_PATH}]}).encode(),
+    )
+    s3_client.upload_file(
+        str(l2a_safe / "MTD_MSIL2A.xml"),
+        AWS_SNG_L2A_BUCKET,
+        f"{prd_prefix}/metadata.xml",
+    )
+    s3_client.upload_file(
+        str(l2a_granule / "MTD_TL.xml"),
+        AWS_SNG_L2A_BUCKET,
+        f"{SNG_TILE_PATH}/metadata.xml",
+    )
+
+
+def run_case(
+    case: str, options: List[str], production_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Run s2c_id for a case
+    :param case: Case name (see CASES)
+    :param options: Extra s2c_id options
+    :param production_id: ARD prefix, unique for each run if None
+    :return: Duration, number of ARD files in the bucket and upload summary
+    """
+    import boto3
+    from click.testing import CliRunner
+
+    from ewoc_s2c.run_s2c import cli
+
+    pid, data_source = CASES[case]
+    production_id = f"{case}_{production_id or time.time_ns()}"
+    start = time.perf_counter()
+    result = CliRunner().invoke(
+        cli,
+        ["s2c_id", "-p", pid, "-ds", data_source, "--production_id", production_id]
+        + options,
+    )
+    duration = time.perf_counter() - start
+    if result.exit_code != 0:
+        raise RuntimeError(f"{case} failed:\n{result.output}") from result.exception
+    listing = boto3.client("s3").list_objects_v2(
+        Bucket=ARD_BUCKET, Prefix=f"{production_id}/"
+    )
+    upload = [line for line in result.output.splitlines() if "Uploaded" in line]
+    return {
+        "seconds": duration,
+        "ard_files": listing.get("KeyCount", 0),
+        "upload": upload[0] if upload else "",
+    }
+
+
+def main() -> None:
+    """Run the harness"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1098, help="10m band size")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--valid_fraction",
+        type=float,
+        default=1.0,
+        help="Fraction of the tile with data, lower for a swath edge tile",
+    )
+    parser.add_argument(
+        "--cloud_cover", type=float, default=0.0, help="Cloud cover of the metadata"
+    )
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--json", type=Path, help="Write the results to a file")
+    parser.add_argument(
+        "--production_id", help="Same ARD prefix for all the runs of a case"
+    )
+    args, options = parser.parse_known_args()
+
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    dem_server = ThreadingHTTPServer(("127.0.0.1", 0), DemHandler)
+    threading.Thread(target=dem_server.serve_forever, daemon=True).start()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        setup_env(
+            root,
+            f"http://{host}:{port}",
+            f"http://127.0.0.1:{dem_server.server_address[1]}",
+        )
+        make_archive(root / "archive", args.size, args.valid_fraction, args.cloud_cover)
+        local_dag = LocalDag(root / "archive")
+        DemHandler.dem_file = root / "archive" / "dem.tif"
+        write_flat_dem(DemHandler.dem_file)
+        with mock.patch(
+            "ewoc_dag.s2_dag.get_s2_product", local_dag.get_s2_product
+        ), mock.patch(
+            "ewoc_dag.cli_dem.get_dem_data", local_dag.get_dem_data
+        ), mock.patch(
+            "ewoc_dag.bucket.ewoc.EWOCARDBucket", LocalARDBucket
+        ):
+            for case in args.cases:
+                runs = [
+                    run_case(case, options, args.production_id)
+                    for _ in range(args.repeat)
+                ]
+                seconds = [run["seconds"] for run in runs]
+                results[case] = {
+                    "min": min(seconds),
+                    "median": statistics.median(seconds),
+                    "ard_files": runs[-1]["ard_files"],
+                }
+                print(
+                    f"{case:>13}: min {min(seconds):.2f}s "
+                    f"median {statistics.median(seconds):.2f}s "
+                    f"({runs[-1]['ard_files']} ARD files)\n"
+                    f"{'':>15}last run: {runs[-1]['upload']}"
+                )
+    print(f"DEM tiles served: {DemHandler.requests}")
+    dem_server.shutdown()
+    server.stop()
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=1), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+""" Stub of Sen2Cor L2A_Process for the pipeline harness
+
+Writes a L2A SAFE with the Sen2Cor 2.9 layout from a L1C SAFE, the bands
+are derived from the L1C B02:
+
+    <L2A>.SAFE/GRANULE/L2A_<tile>_.../IMG_DATA/R<res>m/<tile>_<date>_<band>_<res>m.jp2
+
+    stub_l2a_process.py <L1C>.SAFE --output_dir <dir> [--resolution 10] [--sc_only]
+
+STUB_L2A_SECONDS adds a delay to emulate the Sen2Cor processing time,
+STUB_L2A_BAND_SECONDS a delay before each band file, written by resolution
+from 60m to 10m as Sen2Cor does.
+"""
+import argparse
+from datetime import datetime
+import hashlib
+import os
+from pathlib import Path
+import time
+from typing import Dict, List
+
+L1C_BANDS = {
+    10: ["B02", "B03", "B04", "B08"],
+    20: ["B05", "B06", "B07", "B8A", "B11", "B12"],
+    60: ["B01", "B09", "B10"],
+}
+L2A_BANDS = {
+    10: ["AOT", "B02", "B03", "B04", "B08", "WVP"],
+    20: ["AOT", "B02", "B03", "B04", "B05", "B06", "B07"]
+    + ["B8A", "B11", "B12", "SCL", "WVP"],
+    60: ["AOT", "B01", "B02", "B09", "SCL", "WVP"],
+}
+SC_ONLY_BANDS: Dict[int, List[str]] = {20: ["SCL"], 60: ["SCL"]}
+UTM_ORIGIN = (600000, 4000020)
+
+
+def synthetic_band(size: int, seed: int = 0, valid_fraction: float = 1.0):
+    """
+    Reflectance-like band: smooth field with noise, compresses like a real one
+    :param size: Size in pixels
+    :param seed: Random seed
+    :param valid_fraction: Fraction of the columns with data, the others are
+     nodata (0) as on the swath edge tiles
+    :return: uint16 array
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    base = rng.integers(500, 4000, (size // 32 + 1, size // 32 + 1))
+    band = np.kron(base, np.ones((32, 32), dtype=np.int64))[:size, :size]
+    band = band + rng.integers(0, 100, band.shape)
+    band[:, int(size * valid_fraction) :] = 0
+    return band.astype("uint16")
+
+
+def write_band(path: Path, array, res: int, driver: str = "JP2OpenJPEG") -> None:
+    """
+    Write a single band raster on the tile grid
+    :param path: Output file
+    :param array: 2D array
+    :param res: Resolution in meters
+    :param driver: JP2OpenJPEG for SAFE products, GTiff for COGs
+    """
+    import rasterio
+    from rasterio.transform import from_origin
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    options = {"reversible": True, "quality": 100} if driver == "JP2OpenJPEG" else {}
+    with rasterio.open(
+        path,
+        "w",
+        driver=driver,
+        width=array.shape[1],
+        height=array.shape[0],
+        count=1,
+        dtype=array.dtype,
+        crs="EPSG:32630",
+        transform=from_origin(*UTM_ORIGIN, res, res),
+        nodata=0,
+        **options,
+    ) as dst:
+        dst.write(array, 1)
+
+
+def scl_from_band(band):
+    """
+    Scene classification from reflectance thresholds (vegetation, bare soil,
+    clouds...)
+    :param band: Reflectance band
+    :return: uint8 SCL array
+    """
+    import numpy as np
+
+    classes = np.array([4, 5, 6, 7, 8, 9, 10, 3], dtype="uint8")
+    return classes[np.minimum(band // 500, len(classes) - 1)].astype("uint8")
+
+
+def l2a_bands(b02, res: int, sc_only: bool, boa_offset: int = 0) -> Dict[str, object]:
+    """
+    Derive the L2A bands of one resolution from the 10m B02
+    :param b02: 10m L1C B02
+    :param res: Resolution in meters
+    :param sc_only: True to write the SCL only
+    :param boa_offset: BOA_ADD_OFFSET of the product (baseline 04.00 and later)
+    :return: Band id to array
+    """
+    import numpy as np
+
+    step = res // 10
+    band = b02[::step, ::step]
+    bands = {}
+    band_ids = (SC_ONLY_BANDS if sc_only else L2A_BANDS).get(res, [])
+    for idx, band_id in enumerate(band_ids):
+        if band_id == "SCL":
+            bands[band_id] = scl_from_band(band)
+        elif band_id in ("AOT", "WVP"):
+            bands[band_id] = np.full(band.shape, 100 + idx, dtype="uint16")
+        else:
+            # DN = reflectance * 1e4 - offset
+            bands[band_id] = (band + 20 * idx - boa_offset).astype("uint16")
+        # Nodata (0) outside of the swath for every band
+        bands[band_id][band == 0] = 0
+    return bands
+
+
+def write_tile_metadata(granule: Path, cloud_cover: float, nodata: float) -> None:
+    """
+    Write the quality indicators of the tile metadata (MTD_TL.xml)
+    :param granule: Granule folder
+    :param cloud_cover: Cloudy pixels in percent
+    :param nodata: Nodata pixels in percent
+    """
+    granule.mkdir(parents=True, exist_ok=True)
+    (granule / "MTD_TL.xml").write_text(
+        '<n1:Level-1C_Tile_ID xmlns:n1="https://psd-14.sentinel2.eo.esa.int">'
+        "<n1:Quality_Indicators_Info><Image_Content_QI>"
+        f"<CLOUDY_PIXEL_PERCENTAGE>{cloud_cover}</CLOUDY_PIXEL_PERCENTAGE>"
+        f"<NODATA_PIXEL_PERCENTAGE>{nodata}</NODATA_PIXEL_PERCENTAGE>"
+        "</Image_Content_QI></n1:Quality_Indicators_Info></n1:Level-1C_Tile_ID>",
+        encoding="utf-8",
+    )
+
+
+def write_manifest(safe_dir: Path) -> None:
+    """
+    Write the manifest.safe of a SAFE folder: size and MD5 of each file
+    :param safe_dir: SAFE folder
+    """
+    objects = []
+    for path in sorted(safe_dir.rglob("*")):
+        if not path.is_file() or path.name == "manifest.safe":
+            continue
+        href = "./" + path.relative_to(safe_dir).as_posix()
+        md5 = hashlib.md5(path.read_bytes()).hexdigest()
+        objects.append(
+            f'<dataObject ID="{path.stem}"><byteStream mimeType="application/octet-stream" '
+            f'size="{path.stat().st_size}"><fileLocation locatorType="URL" href="{href}"/>'
+            f'<checksum checksumName="MD5">{md5}</checksum></byteStream></dataObject>'
+        )
+    (safe_dir / "manifest.safe").write_text(
+        '<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1"><dataObjectSection>'
+        + "".join(objects)
+        + "</dataObjectSection></xfdu:XFDU>",
+        encoding="utf-8",
+    )
+
+
+def make_l1c_safe(
+    out_dir: Path,
+    pid: str,
+    size10: int,
+    valid_fraction: float = 1.0,
+    cloud_cover: float = 0.0,
+) -> Path:
+    """
+    Write a synthetic L1C SAFE with the ESA layout
+    :param out_dir: Output directory
+    :param pid: L1C product id (with .SAFE)
+    :param size10: Size in pixels of the 10m bands
+    :param valid_fraction: Fraction of the columns with data
+    :param cloud_cover: Cloud cover written in the metadata (%)
+    :return: L1C SAFE folder
+    """
+    parts = pid.replace(".SAFE", "").split("_")
+    tile, date = parts[5], parts[2]
+    img_data = out_dir / pid / "GRANULE" / f"L1C_{tile}_A000000_{date}" / "IMG_DATA"
+    b02 = synthetic_band(size10, valid_fraction=valid_fraction)
+    for res, band_ids in L1C_BANDS.items():
+        for idx, band_id in enumerate(band_ids):
+            step = res // 10
+            band = b02[::step, ::step]
+            write_band(
+                img_data / f"{tile}_{date}_{band_id}.jp2",
+                ((band + 10 * idx) * (band > 0)).astype("uint16"),
+                res,
+            )
+    (out_dir / pid / "MTD_MSIL1C.xml").write_text(
+        f"<Level-1C_User_Product><PRODUCT_URI>{pid}</PRODUCT_URI>"
+        f"<PROCESSING_BASELINE>{parts[3][1:3]}.{parts[3][3:]}</PROCESSING_BASELINE>"
+        f"<Cloud_Coverage_Assessment>{cloud_cover}</Cloud_Coverage_Assessment>"
+        "</Level-1C_User_Product>",
+        encoding="utf-8",
+    )
+    write_tile_metadata(img_data.parent, cloud_cover, (1 - valid_fraction) * 100)
+    write_manifest(out_dir / pid)
+    return out_dir / pid
+
+
+def make_l2a_safe(
+    out_dir: Path,
+    l2a_name: str,
+    b02,
+    sc_only: bool = False,
+    boa_offset: int = 0,
+    band_seconds: float = 0.0,
+) -> Path:
+    """
+    Write a synthetic L2A SAFE with the Sen2Cor 2.9 layout
+    :param out_dir: Output directory
+    :param l2a_name: L2A product id (with .SAFE)
+    :param b02: 10m B02 used to derive the L2A bands
+    :param sc_only: True to write the SCL only
+    :param boa_offset: BOA_ADD_OFFSET written in the metadata and the bands
+    :param band_seconds: Delay before each band file
+    :return: L2A SAFE folder
+    """
+    parts = l2a_name.replace(".SAFE", "").split("_")
+    tile, date = parts[5], parts[2]
+    img_data = out_dir / l2a_name / "GRANULE" / f"L2A_{tile}_A000000_{date}"
+    img_data = img_data / "IMG_DATA"
+    for res in (60, 20, 10):
+        for band_id, array in l2a_bands(b02, res, sc_only, boa_offset).items():
+            time.sleep(band_seconds)
+            write_band(
+                img_data / f"R{res}m" / f"{tile}_{date}_{band_id}_{res}m.jp2",
+                array,
+                res,
+            )
+    offsets = "".join(
+        f'<BOA_ADD_OFFSET band_id="{band_id}">{boa_offset}</BOA_ADD_OFFSET>'
+        for band_id in range(13)
+    )
+    (out_dir / l2a_name / "MTD_MSIL2A.xml").write_text(
+        f"<Level-2A_User_Product><BOA_ADD_OFFSET_VALUES_LIST>{offsets}"
+        "</BOA_ADD_OFFSET_VALUES_LIST></Level-2A_User_Product>",
+        encoding="utf-8",
+    )
+    return out_dir / l2a_name
+
+
+def main() -> None:
+    """Run the stub"""
+    import rasterio
+
+    parser = argparse.ArgumentParser(description="Sen2Cor L2A_Process stub")
+    parser.add_argument("l1c_safe", type=Path)
+    parser.add_argument("--output_dir", type=Path, required=True)
+    parser.add_argument("--resolution", type=int, default=None)
+    parser.add_argument("--sc_only", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    time.sleep(float(os.getenv("STUB_L2A_SECONDS", "0")))
+    parts = args.l1c_safe.name.replace(".SAFE", "").split("_")
+    parts[1] = "MSIL2A"
+    # Products processed locally by Sen2Cor have the 99.99 baseline
+    parts[3] = "N9999"
+    parts[6] = datetime.now().strftime("%Y%m%dT%H%M%S")
+    b02_path = next(args.l1c_safe.rglob("IMG_DATA/*_B02.jp2"))
+    with rasterio.open(b02_path) as src:
+        b02 = src.read(1)
+    make_l2a_safe(
+        args.output_dir,
+        "_".join(parts) + ".SAFE",
+        b02,
+        args.sc_only,
+        band_seconds=float(os.getenv("STUB_L2A_BAND_SECONDS", "0")),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+""" EWoC Sen2Cor automatic data source selection module"""
+import logging
+import os
+from pathlib import Path
+import queue
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ewoc_s2c.ranged import use_cancel_event
+from ewoc_s2c.resolver import record_source_fetch, source_health
+from ewoc_s2c.sources import DataSource, get_source
+
+logger = logging.getLogger(__name__)
+
+# Sources raced by the auto source, in the order of preference for the
+# sources without statistics
+AUTO_SOURCES = os.getenv("EWOC_S2C_AUTO_SOURCES", "creodias,aws_sng,aws").split(",")
+# Seconds before a second source is started next to a slow one, unset to
+# wait for each source
+_HEDGE_DELAY = os.getenv("EWOC_S2C_AUTO_HEDGE")
+AUTO_HEDGE_DELAY = float(_HEDGE_DELAY) if _HEDGE_DELAY else None
+# A source failing MAX_FAILURES times in a row is tried last for
+# FAILURE_COOLDOWN seconds
+MAX_FAILURES = 3
+FAILURE_COOLDOWN = 600
+
+
+def rank_sources(names: List[str], level: str) -> List[str]:
+    """
+    Order sources by health and rolling latency
+    :param names: Source names
+    :param level: Product type (MSIL1C or MSIL2A)
+    :return: Healthy sources first, fastest first; the sources without
+     latency rank as the mean latency of the others, in the given order
+    """
+    health = source_health()
+    now = time.time()
+    latencies = {
+        name: health.get(f"{name}:{level}", {}).get("latency") for name in names
+    }
+    known = [latency for latency in latencies.values() if latency is not None]
+    # Neutral prior: a new source is neither preferred nor avoided
+    prior = sum(known) / len(known) if known else 0.0
+
+    def _key(name: str) -> Tuple[bool, float]:
+        stats = health.get(f"{name}:{level}", {})
+        failing = (
+            stats.get("failures", 0) >= MAX_FAILURES
+            and now - stats.get("failed_at", 0) < FAILURE_COOLDOWN
+        )
+        latency = latencies[name]
+        return failing, prior if latency is None else latency
+
+    return sorted(names, key=_key)
+
+
+class AutoSource(DataSource):
+    """
+    Fastest healthy source among several: the product is downloaded from
+    the best ranked source, the next one is tried when it fails and, with a
+    hedge delay, started next to it when it is slow; the first complete
+    download wins. The ARD conversion follows the source of the product.
+    """
+
+    supports_l2a = True
+
+    def __init__(
+        self,
+        name: str,
+        sources: Optional[List[str]] = None,
+        hedge_delay: Optional[float] = AUTO_HEDGE_DELAY,
+    ) -> None:
+        """
+        :param name: Data source name
+        :param sources: Names of the raced sources, default AUTO_SOURCES
+        :param hedge_delay: Seconds before a second source is started, None
+         to start it only if the first one fails
+        """
+        super().__init__(name)
+        self.sources = AUTO_SOURCES if sources is None else sources
+        self.hedge_delay = hedge_delay
+        # Product folder to the source which provided it
+        self._providers: Dict[Path, DataSource] = {}
+
+    def _race(
+        self,
+        pid: str,
+        out_dir: Path,
+        candidates: List[DataSource],
+        fetch: Callable[[DataSource, Path], Path],
+    ) -> Path:
+        """
+        Download a product from the first source which completes. It is
+        returned right away: the other downloads are cancelled (the ranged
+        ones stop, the others complete in the background) and their threads
+        remove their folders when they end.
+        :param pid: Sentinel-2 product id
+        :param out_dir: Output directory, each source downloads in a subfolder
+        :param candidates: Sources
+        :param fetch: Function downloading the product from a source to a
+         folder, returns the product path
+        :return: Path to the product folder
+        """
+        level = pid.split("_")[1]
+        names = rank_sources([source.name for source in candidates], level)
+        pending = [get_source(name) for name in names]
+        results: "queue.Queue[Tuple[DataSource, Optional[Path], str]]" = queue.Queue()
+        # Set by the winner, or when the race is left
+        cancel = threading.Event()
+        cancel_lock = threading.Lock()
+
+        def _fetch(source: DataSource) -> None:
+            race_dir = out_dir / f"auto_{source.name}"
+            race_dir.mkdir(parents=True, exist_ok=True)
+            start = time.perf_counter()
+            won = False
+            try:
+                with use_cancel_event(cancel):
+                    prd_path = fetch(source, race_dir)
+            except Exception as err:  # pylint: disable=broad-except
+                # The cancelled downloads say nothing of the source
+                if not cancel.is_set():
+                    record_source_fetch(
+                        f"{source.name}:{level}", time.perf_counter() - start, False
+                    )
+                results.put((source, None, repr(err)))
+                return
+            else:
+                record_source_fetch(
+                    f"{source.name}:{level}", time.perf_counter() - start, True
+                )
+                # The first complete download wins and cancels the others
+                with cancel_lock:
+                    won = not cancel.is_set()
+                    cancel.set()
+                if won:
+                    results.put((source, prd_path, ""))
+            finally:
+                # Downloads of the losing or failed sources
+                if not won:
+                    shutil.rmtree(race_dir, ignore_errors=True)
+
+        def _start() -> None:
+            source = pending.pop(0)
+            logger.info("Downloading %s from %s", pid, source.name)
+            threading.Thread(
+                target=_fetch, args=(source,), name=f"auto-{source.name}", daemon=True
+            ).start()
+
+        _start()
+        running = 1
+        errors = []
+        try:
+            while running:
+                hedge = self.hedge_delay if pending else None
+                try:
+                    source, prd_path, error = results.get(timeout=hedge)
+                except queue.Empty:
+                    logger.warning(
+                        "%s is slow after %.1fs, also downloading from %s",
+                        pid,
+                        hedge,
+                        pending[0].name,
+                    )
+                    _start()
+                    running += 1
+                    continue
+                running -= 1
+                if prd_path is not None:
+                    logger.info("%s downloaded from %s", pid, source.name)
+                    self._providers[prd_path] = source
+                    return prd_path
+                logger.warning("%s failed on %s: %s", pid, source.name, error)
+                errors.append(f"{source.name}: {error}")
+                if pending:
+                    _start()
+                    running += 1
+        finally:
+            with cancel_lock:
+                cancel.set()
+        raise ValueError(f"The product {pid} is not found: {'; '.join(errors)}")
+
+    def provider(self, prd_folder: Path) -> DataSource:
+        """
+        Get the source which provided a product
+        :param prd_folder: Product folder returned by the race
+        :return: Data source
+        """
+        source = self._providers.get(prd_folder)
+        if source is not None:
+            return source
+        # Product downloaded by another process: auto_<source>/ folder
+        for parent in (prd_folder, *prd_folder.parents):
+            if parent.name.startswith("auto_"):
+                return get_source(parent.name[len("auto_") :])
+        raise ValueError(f"The source of {prd_folder} is unknown")
+
+    def get_l1c(self, pid: str, out_dir: Path) -> Path:
+        """
+        Download a L1C product from the fastest healthy source
+        :param pid: Sentinel-2 product id
+        :param out_dir: Output directory
+        :return: Path to the SAFE folder
+        """
+        candidates = [get_source(name) for name in self.sources]
+        return self._race(
+            pid,
+            out_dir,
+            candidates,
+            lambda source, race_dir: source.get_l1c(pid, race_dir),
+        )
+
+    def get_l2a(self, pid: str, out_dir: Path, only_scl: bool = False) -> Path:
+        """
+        Download a L2A product from the fastest healthy source supporting
+        the L2A products
+        :param pid: Sentinel-2 product id
+        :param out_dir: Output directory
+        :param only_scl: True to process scl only
+        :return: Path to the product folder
+        """
+        candidates = [
+            source
+            for source in (get_source(name) for name in self.sources)
+            if source.supports_l2a
+        ]
+        return self._race(
+            pid,
+            out_dir,
+            candidates,
+            lambda source, race_dir: source.get_l2a(pid, race_dir, only_scl),
+        )
+
+    def fetch_l1c(self, pid: str, out_dir: Path) -> Path:
+        """
+        Download a L1C product, the raced sources resolve the id variants
+        themselves
+        :param pid: Sentinel-2 product id
+        :param out_dir: Output directory
+        :return: Path to the SAFE folder
+        """
+        return self.get_l1c(pid, out_dir)
+
+    def fetch_l2a(self, pid: str, out_dir: Path, only_scl: bool = False) -> Path:
+        """
+        Download a L2A product, the raced sources resolve the id variants
+        themselves
+        :param pid: Sentinel-2 product id
+        :param out_dir: Output directory
+        :param only_scl: True to process scl only
+        :return: Path to the product folder
+        """
+        return self.get_l2a(pid, out_dir, only_scl)
+
+    def fetch_metadata(self, pid: str) -> Dict[str, bytes]:
+        """
+        Download the metadata files of a product from the first source,
+        by rank, which has them
+        :param pid: Sentinel-2 product id
+        :return: Object key to file content, empty if no source has them
+        """
+        for name in rank_sources(self.sources, pid.split("_")[1]):
+            try:
+                xml_files = get_source(name).fetch_metadata(pid)
+            except Exception as err:  # pylint: disable=broad-except
+                logger.info("No metadata of %s on %s: %s", pid, name, err)
+                continue
+            if xml_files:
+                return xml_files
+        return {}
+
+    def to_ard(
+        self,
+        l2a_folder: Path,
+        work_dir: Path,
+        pid: str,
+        only_scl: bool = False,
+        layout: str = "band",
+        interleave: str = "pixel",
+        min_valid_fraction: float = 0.0,
+    ) -> Optional[Path]:
+        """
+        Convert a L2A product with the band layout and offset rules of the
+        source which provided it
+        :param l2a_folder: L2A product folder returned by get_l2a
+        :param work_dir: Output directory
+        :param pid: Sentinel-2 product id
+        :param only_scl: True to process scl only
+        :param layout: band for one file per band, stacked for one file per
+         resolution
+        :param interleave: pixel or band interleaving of the stacked files
+        :param min_valid_fraction: Minimum fraction of valid pixels to write
+         the ARD
+        :return: ARD product folder, None if the product has too few valid
+         pixels
+        """
+        source = self.provider(l2a_folder)
+        self._providers.pop(l2a_folder, None)
+        logger.info("Converting %s with the %s rules", pid, source.name)
+        return source.to_ard(
+            l2a_folder,
+            work_dir,
+            pid,
+            only_scl,
+            layout,
+            interleave,
+            min_valid_fraction,
+        )
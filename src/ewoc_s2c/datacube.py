@@ -0,0 +1,167 @@
+""" EWoC Sen2Cor per-tile time series datacube module"""
+from contextlib import contextmanager
+import fcntl
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+import rasterio
+
+logger = logging.getLogger(__name__)
+
+# Chunks are long in time and small in space: a pixel time series is read
+# from a few chunks whereas a single date write touches a full time chunk
+TIME_CHUNK = 32
+SPATIAL_CHUNK = 256
+ARD_BAND_GROUPS = {
+    "10m": ["B02", "B03", "B04", "B08"],
+    "20m": ["B05", "B06", "B07", "B11", "B12"],
+}
+
+
+def _import_zarr() -> Any:
+    """
+    Import the optional zarr dependency
+    :return: zarr module
+    """
+    try:
+        import zarr
+    except ImportError as err:
+        raise ImportError(
+            "The datacube output needs zarr: pip install ewoc_s2c[datacube]"
+        ) from err
+    return zarr
+
+
+@contextmanager
+def _tile_lock(cube_path: Path) -> Iterator[None]:
+    """
+    Lock a tile datacube for the time of an append
+    :param cube_path: Path to the tile datacube
+    """
+    cube_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(cube_path.with_suffix(".lock"), "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def ard_product_info(ard_folder: Path) -> Tuple[str, str]:
+    """
+    Get tile id and acquisition date from an ARD folder name
+    :param ard_folder: ARD product folder (ex S2B_MSIL2A_20220322T105629_...)
+    :return: Tile id and acquisition date
+    """
+    prd_name = ard_folder.name
+    return prd_name.split("_")[-1], prd_name.split("_")[2]
+
+
+def find_ard_bands(ard_folder: Path) -> Dict[str, Tuple[Path, int]]:
+    """
+    Find the bands of an ARD product, single band or stacked files
+    :param ard_folder: ARD product folder
+    :return: Band id (or MASK) to file path and band index
+    """
+    ard_bands = {}
+    for ard_file in ard_folder.glob("*.tif"):
+        suffix = ard_file.stem.split("_")[-1]
+        if suffix in ["10M", "20M"]:
+            with rasterio.open(ard_file) as src:
+                for bidx, band in enumerate(src.descriptions, start=1):
+                    ard_bands[band] = (ard_file, bidx)
+        else:
+            ard_bands[suffix] = (ard_file, 1)
+    return ard_bands
+
+
+def _time_index(group: Any, date: str) -> int:
+    """
+    Get the time index of a date, a new date is put at the end
+    :param group: Zarr group of the tile
+    :param date: Acquisition date
+    :return: Time index
+    """
+    dates: List[str] = list(group.attrs.get("dates", []))
+    if date not in dates:
+        dates.append(date)
+        group.attrs["dates"] = dates
+    return dates.index(date)
+
+
+def _write_date(
+    group: Any,
+    name: str,
+    date_idx: int,
+    ard_bands: List[Tuple[Path, int]],
+    dtype: str,
+    fill_value: int,
+    time_chunk: int,
+) -> None:
+    """
+    Write the bands of one date in a (time, band, y, x) array
+    :param group: Zarr group of the resolution
+    :param name: Array name
+    :param date_idx: Time index
+    :param ard_bands: ARD file and band index of each band
+    :param dtype: Array data type
+    :param fill_value: Array nodata value
+    :param time_chunk: Chunk size along time
+    """
+    with rasterio.open(ard_bands[0][0]) as src:
+        height, width = src.height, src.width
+        group.attrs.update(crs=src.crs.to_string(), transform=list(src.transform)[:6])
+    if name in group:
+        cube = group[name]
+    else:
+        cube = group.create_dataset(
+            name,
+            shape=(0, len(ard_bands), height, width),
+            chunks=(time_chunk, 1, SPATIAL_CHUNK, SPATIAL_CHUNK),
+            dtype=dtype,
+            fill_value=fill_value,
+        )
+    if cube.shape[0] <= date_idx:
+        cube.resize(date_idx + 1, *cube.shape[1:])
+    for band_idx, (ard_file, bidx) in enumerate(ard_bands):
+        with rasterio.open(ard_file) as src:
+            cube[date_idx, band_idx] = src.read(bidx).astype(dtype)
+
+
+def append_ard_to_datacube(
+    ard_folder: Path, cube_dir: Path, time_chunk: int = TIME_CHUNK
+) -> Path:
+    """
+    Append an ARD product to the time series datacube of its tile.
+    Appends of different dates of a tile are serialized with a file lock,
+    an existing date is overwritten.
+    :param ard_folder: ARD product folder
+    :param cube_dir: Datacubes root directory
+    :param time_chunk: Chunk size along time
+    :return: Path to the tile datacube
+    """
+    zarr = _import_zarr()
+    tile_id, date = ard_product_info(ard_folder)
+    ard_bands = find_ard_bands(ard_folder)
+    cube_path = cube_dir / f"{tile_id}.zarr"
+    with _tile_lock(cube_path):
+        root = zarr.open_group(str(cube_path), mode="a")
+        date_idx = _time_index(root, date)
+        for res, bands in ARD_BAND_GROUPS.items():
+            if all(band in ard_bands for band in bands):
+                group = root.require_group(res)
+                group.attrs["bands"] = bands
+                _write_date(
+                    group,
+                    "data",
+                    date_idx,
+                    [ard_bands[band] for band in bands],
+                    "uint16",
+                    0,
+                    time_chunk,
+                )
+        if "MASK" in ard_bands:
+            group = root.require_group("20m")
+            _write_date(
+                group, "mask", date_idx, [ard_bands["MASK"]], "uint8", 255, time_chunk
+            )
+    logger.info("Appended %s to %s at time index %s", date, cube_path, date_idx)
+    return cube_path
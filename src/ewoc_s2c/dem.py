@@ -0,0 +1,329 @@
+""" EWoC Sen2Cor DEM tile acquisition module"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import fcntl
+import logging
+import math
+import os
+from pathlib import Path
+import shutil
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import urlopen
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEM_CACHE_DIR = Path(
+    os.getenv("EWOC_S2C_DEM_CACHE", Path.home() / ".cache/ewoc_s2c/dem")
+)
+# URL of a DEM tile ({tile}: DEM tile id), http(s)://, s3:// or a local path.
+# Without URL, the DEM of a Sentinel-2 tile is downloaded by ewoc_dag.
+DEM_URLS: Dict[str, Optional[str]] = {
+    "srtm": os.getenv("EWOC_S2C_SRTM_URL"),
+    "copdem": os.getenv("EWOC_S2C_COPDEM_URL"),
+}
+# Parallel downloads of the DEM tiles of a Sentinel-2 tile
+DEM_FETCH_WORKERS = 4
+# Sentinel-2 tiles: 109.8 km from the north-west corner of a MGRS 100 km square
+S2_TILE_SIZE = 109800
+MGRS_BANDS = "CDEFGHJKLMNPQRSTUVWX"
+MGRS_COLUMNS = ("STUVWXYZ", "ABCDEFGH", "JKLMNPQR")
+MGRS_ROWS = "ABCDEFGHJKLMNPQRSTUV"
+
+
+def s2_tile_bounds(tile_id: str) -> Tuple[float, float, float, float]:
+    """
+    Compute the geographic extent of a Sentinel-2 tile from its MGRS id
+    :param tile_id: MGRS tile id (ex 31TCJ)
+    :return: lon_min, lat_min, lon_max, lat_max, lon_min > lon_max across the
+     antimeridian
+    """
+    from rasterio.warp import transform, transform_bounds
+
+    zone, band, column, row = int(tile_id[:2]), tile_id[2], tile_id[3], tile_id[4]
+    crs = f"EPSG:{(32600 if band >= 'N' else 32700) + zone}"
+    xmin = (MGRS_COLUMNS[zone % 3].index(column) + 1) * 100000
+    # Row letters repeat every 2000 km, shifted by 5 letters in even zones
+    row_northing = (MGRS_ROWS.index(row) - 5 * (zone % 2 == 0)) % 20 * 100000
+    band_lat = -80 + 8 * MGRS_BANDS.index(band)
+    band_top = band_lat + (12 if band == "X" else 8)
+    # Latitude band in the UTM zone, at the central meridian
+    lon = -183 + 6 * zone
+    _, (band_south, band_north) = transform(
+        "EPSG:4326", crs, [lon, lon], [band_lat, band_top]
+    )
+    band_center = (band_south + band_north) / 2
+    square_south = min(
+        (row_northing + cycle * 2000000 for cycle in range(5)),
+        key=lambda northing: abs(northing + 50000 - band_center),
+    )
+    ymax = square_south + 100000 + 20
+    return transform_bounds(
+        crs, "EPSG:4326", xmin, ymax - S2_TILE_SIZE, xmin + S2_TILE_SIZE, ymax
+    )
+
+
+def copdem_tile_ids(tile_id: str) -> List[str]:
+    """
+    Get the Copernicus DEM 90m tiles (1°) covering a Sentinel-2 tile
+    :param tile_id: MGRS tile id
+    :return: Copernicus DEM tile ids
+    """
+    lon_min, lat_min, lon_max, lat_max = s2_tile_bounds(tile_id)
+    lons = list(range(math.floor(lon_min), math.floor(lon_max) + 1))
+    if lon_min > lon_max:
+        # Across the antimeridian
+        lons = list(range(math.floor(lon_min), 180)) + list(
+            range(-180, math.floor(lon_max) + 1)
+        )
+    ids = []
+    for lat in range(math.floor(lat_min), math.floor(lat_max) + 1):
+        for lon in lons:
+            lat_str = f"{'N' if lat >= 0 else 'S'}{abs(lat):02d}"
+            lon_str = f"{'E' if lon >= 0 else 'W'}{abs(lon):03d}"
+            ids.append(f"Copernicus_DSM_COG_30_{lat_str}_00_{lon_str}_00_DEM")
+    return ids
+
+
+def dem_tile_ids(dem_type: str, tile_id: str) -> List[str]:
+    """
+    Get the DEM tiles covering a Sentinel-2 tile
+    :param dem_type: DEM type (srtm or copdem)
+    :param tile_id: MGRS tile id
+    :return: DEM tile ids
+    """
+    if dem_type == "srtm":
+        from ewoc_dag.srtm_dag import get_srtm3s_ids
+
+        return list(get_srtm3s_ids(tile_id))
+    if dem_type == "copdem":
+        return copdem_tile_ids(tile_id)
+    raise AttributeError("Attribute dem_type must be srtm or copdem")
+
+
+def ewoc_dag_dem(dem_type: str, tile_id: str, out_dir: Path) -> List[Path]:
+    """
+    Download the DEM files covering a Sentinel-2 tile with ewoc_dag
+    :param dem_type: DEM type (srtm or copdem)
+    :param tile_id: MGRS tile id
+    :param out_dir: Output directory
+    :return: DEM files
+    """
+    from ewoc_dag.cli_dem import get_dem_data
+
+    if dem_type == "srtm":
+        get_dem_data(
+            tile_id,
+            out_dir,
+            dem_source="ewoc",
+            dem_type=dem_type,
+            dem_resolution="3s",
+        )
+        return sorted((out_dir / "srtm3s").glob("*.tif"))
+    if dem_type == "copdem":
+        get_dem_data(
+            tile_id,
+            out_dir,
+            dem_source="aws",
+            dem_type=dem_type,
+            dem_resolution="3s",
+        )
+        return sorted(out_dir.glob("*.tif"))
+    raise AttributeError("Attribute dem_type must be srtm or copdem")
+
+
+def download_url(url: str, out_file: Path) -> bool:
+    """
+    Download a file
+    :param url: http(s)://, s3:// URL or local path
+    :param out_file: Output file
+    :return: False if the file does not exist (DEM tile over the sea)
+    """
+    parsed = urlparse(url)
+    if parsed.scheme in ("http", "https"):
+        try:
+            with urlopen(url, timeout=60) as response, open(out_file, "wb") as out:
+                shutil.copyfileobj(response, out, 1024 * 1024)
+        except HTTPError as err:
+            if err.code == 404:
+                return False
+            raise
+    elif parsed.scheme == "s3":
+        import boto3
+        from botocore.exceptions import ClientError
+
+        try:
+            boto3.client("s3").download_file(
+                parsed.netloc, parsed.path.lstrip("/"), str(out_file)
+            )
+        except ClientError as err:
+            if err.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+    else:
+        local_path = Path(parsed.path if parsed.scheme == "file" else url)
+        if not local_path.exists():
+            return False
+        shutil.copyfile(local_path, out_file)
+    return True
+
+
+class DemCache:
+    """
+    DEM tiles shared by the runs of a host (or of a shared file system).
+    Each tile is downloaded once: the download holds the lock of the tile,
+    the other processes wait for it, and is published by an atomic rename.
+    Tiles which do not exist (sea) are recorded so that they are not
+    requested again. The DEM downloaded for a whole Sentinel-2 tile (ewoc_dag)
+    is cached the same way, under the lock of the Sentinel-2 tile.
+    """
+
+    def __init__(self, cache_dir: Path = DEM_CACHE_DIR) -> None:
+        """
+        :param cache_dir: Cache folder
+        """
+        self.cache_dir = Path(cache_dir)
+        (self.cache_dir / ".locks").mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _lock(self, name: str) -> Iterator[None]:
+        """
+        Hold a lock of the cache
+        :param name: Lock name
+        """
+        with open(self.cache_dir / ".locks" / name, "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _cached(self, dem_type: str, dem_id: str) -> Tuple[Path, bool]:
+        """
+        Get the cache file of a DEM tile
+        :param dem_type: DEM type
+        :param dem_id: DEM tile id
+        :return: Tile file and True if the tile is known (downloaded or absent)
+        """
+        tile_file = self.cache_dir / dem_type / f"{dem_id}.tif"
+        known = tile_file.exists() or tile_file.with_suffix(".absent").exists()
+        return tile_file, known
+
+    def _fetch(
+        self, dem_type: str, dem_id: str, download: Callable[[str, Path], bool]
+    ) -> None:
+        """
+        Download a DEM tile in the cache, unless another process did it
+        :param dem_type: DEM type
+        :param dem_id: DEM tile id
+        :param download: Function downloading a tile to a file, returns False
+         if the tile does not exist
+        """
+        with self._lock(f"{dem_type}_{dem_id}.lock"):
+            tile_file, known = self._cached(dem_type, dem_id)
+            if known:
+                return
+            tile_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = tile_file.with_name(f".tmp-{uuid.uuid4().hex}.tif")
+            try:
+                if download(dem_id, tmp_file):
+                    tmp_file.rename(tile_file)
+                    logger.info("DEM tile %s downloaded", dem_id)
+                else:
+                    tile_file.with_suffix(".absent").touch()
+                    logger.info("No DEM tile %s", dem_id)
+            finally:
+                tmp_file.unlink(missing_ok=True)
+
+    def get_s2_tile(
+        self, dem_type: str, tile_id: str, download: Callable[[Path], List[Path]]
+    ) -> List[Path]:
+        """
+        Get the DEM files of a Sentinel-2 tile downloaded together, unless
+        another process did it
+        :param dem_type: DEM type
+        :param tile_id: MGRS tile id
+        :param download: Function downloading the DEM of the tile in a folder,
+         returns the DEM files
+        :return: DEM files
+        """
+        tile_dir = self.cache_dir / dem_type / "s2_tiles" / tile_id
+        with self._lock(f"{dem_type}_s2_{tile_id}.lock"):
+            if not tile_dir.exists():
+                tmp_dir = tile_dir.with_name(f".tmp-{uuid.uuid4().hex}")
+                try:
+                    for folder in ("download", "files"):
+                        (tmp_dir / folder).mkdir(parents=True)
+                    for dem_file in download(tmp_dir / "download"):
+                        dem_file.rename(tmp_dir / "files" / dem_file.name)
+                    # Published with its DEM files only, by an atomic rename
+                    (tmp_dir / "files").rename(tile_dir)
+                    logger.info("%s DEM of %s downloaded", dem_type, tile_id)
+                finally:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+            else:
+                logger.info("%s DEM of %s cached", dem_type, tile_id)
+        return sorted(tile_dir.glob("*.tif"))
+
+    def get(
+        self,
+        dem_type: str,
+        dem_ids: List[str],
+        download: Callable[[str, Path], bool],
+        max_workers: int = DEM_FETCH_WORKERS,
+    ) -> List[Path]:
+        """
+        Get DEM tiles, the missing ones are downloaded concurrently
+        :param dem_type: DEM type
+        :param dem_ids: DEM tile ids
+        :param download: Function downloading a tile to a file, returns False
+         if the tile does not exist
+        :param max_workers: Number of parallel downloads
+        :return: Files of the tiles which exist
+        """
+        missing = [
+            dem_id for dem_id in dem_ids if not self._cached(dem_type, dem_id)[1]
+        ]
+        logger.info(
+            "%s DEM tiles: %s cached, %s to download",
+            dem_type,
+            len(dem_ids) - len(missing),
+            len(missing),
+        )
+        if missing:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Raise the first download error
+                list(
+                    executor.map(
+                        lambda dem_id: self._fetch(dem_type, dem_id, download),
+                        missing,
+                    )
+                )
+        tile_files = [self._cached(dem_type, dem_id)[0] for dem_id in dem_ids]
+        return [tile_file for tile_file in tile_files if tile_file.exists()]
+
+
+def get_dem_tiles(
+    dem_type: str, tile_id: str, cache_dir: Path = DEM_CACHE_DIR
+) -> List[Path]:
+    """
+    Get the DEM tiles covering a Sentinel-2 tile through the DEM cache
+    :param dem_type: DEM type (srtm or copdem)
+    :param tile_id: MGRS tile id
+    :param cache_dir: DEM cache folder
+    :return: DEM tile files, the DEM of the whole tile is downloaded by
+     ewoc_dag if no URL is set for this DEM type
+    """
+    if dem_type not in DEM_URLS:
+        raise AttributeError("Attribute dem_type must be srtm or copdem")
+    url = DEM_URLS[dem_type]
+    if url is None:
+        return DemCache(cache_dir).get_s2_tile(
+            dem_type,
+            tile_id,
+            lambda out_dir: ewoc_dag_dem(dem_type, tile_id, out_dir),
+        )
+    return DemCache(cache_dir).get(
+        dem_type,
+        dem_tile_ids(dem_type, tile_id),
+        lambda dem_id, out_file: download_url(url.format(tile=dem_id), out_file),
+    )
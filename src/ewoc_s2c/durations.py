@@ -0,0 +1,154 @@
+""" EWoC Sen2Cor product duration model module"""
+import heapq
+import logging
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Tuple, TypeVar
+
+from ewoc_s2c.report import read_run_report
+
+logger = logging.getLogger(__name__)
+
+# Durations before any history: Sen2Cor for the L1C products
+DEFAULT_SECONDS = {"MSIL1C": 900.0, "MSIL2A": 120.0}
+ONLY_SCL_FACTOR = 0.3
+# Pseudo-count of the tile factors: a tile seen once moves halfway
+TILE_PRIOR = 1.0
+# Outcomes whose duration is the cost of the product
+TIMED_STATUS = ("done", "empty")
+
+Job = TypeVar("Job", bound=Hashable)
+
+
+def _group_keys(pid: str, only_scl: bool, data_source: str) -> List[Tuple[Any, ...]]:
+    """
+    Get the groups of a product, most specific first
+    :param pid: Sentinel-2 product id
+    :param only_scl: True to process scl only
+    :param data_source: Sentinel-2 product data source
+    :return: (level, only_scl, source) and (level, only_scl)
+    """
+    level = pid.split("_")[1]
+    return [(level, only_scl, data_source), (level, only_scl)]
+
+
+class DurationModel:
+    """
+    Processing time of a product predicted from its id: mean duration of
+    the past runs of its group (level, only_scl and data source, or level
+    and only_scl without history of the source), times the factor of its
+    tile (nodata, land cover...) learnt from the past runs of the tile in
+    any group
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        :param records: Run report records (pid, data_source, only_scl,
+         status, seconds)
+        """
+        timed = [
+            record
+            for record in records
+            if record.get("status") in TIMED_STATUS and record.get("seconds")
+        ]
+        sums: Dict[Tuple[Any, ...], List[float]] = {}
+        for record in timed:
+            for key in _group_keys(
+                record["pid"],
+                bool(record.get("only_scl")),
+                record.get("data_source", ""),
+            ):
+                total = sums.setdefault(key, [0.0, 0])
+                total[0] += record["seconds"]
+                total[1] += 1
+        self.means = {key: total / count for key, (total, count) in sums.items()}
+        ratios: Dict[str, List[float]] = {}
+        for record in timed:
+            tile = record["pid"].split("_")[5]
+            ratio = record["seconds"] / self._base(
+                record["pid"],
+                bool(record.get("only_scl")),
+                record.get("data_source", ""),
+            )
+            ratios.setdefault(tile, []).append(ratio)
+        self.tile_factors = {
+            tile: (sum(values) + TILE_PRIOR) / (len(values) + TILE_PRIOR)
+            for tile, values in ratios.items()
+        }
+        logger.info(
+            "Duration model: %s runs, %s groups, %s tiles",
+            len(timed),
+            len(self.means),
+            len(self.tile_factors),
+        )
+
+    @classmethod
+    def from_reports(cls, report_files: Iterable[Path]) -> "DurationModel":
+        """
+        Learn the durations of the run reports of past campaigns
+        :param report_files: Run report files, the missing ones are ignored
+        :return: Duration model
+        """
+        records: List[Dict[str, Any]] = []
+        for report_file in report_files:
+            if report_file.exists():
+                records += read_run_report(report_file)
+        return cls(records)
+
+    def _base(self, pid: str, only_scl: bool, data_source: str) -> float:
+        """
+        Get the duration of the group of a product
+        :param pid: Sentinel-2 product id
+        :param only_scl: True to process scl only
+        :param data_source: Sentinel-2 product data source
+        :return: Mean duration of the most specific group with history
+        """
+        for key in _group_keys(pid, only_scl, data_source):
+            if key in self.means:
+                return self.means[key]
+        level = pid.split("_")[1]
+        # Scaled history of the level with the other scl option
+        other = self.means.get((level, not only_scl))
+        if other is not None:
+            return other * ONLY_SCL_FACTOR if only_scl else other / ONLY_SCL_FACTOR
+        seconds = DEFAULT_SECONDS.get(level, DEFAULT_SECONDS["MSIL2A"])
+        return seconds * ONLY_SCL_FACTOR if only_scl else seconds
+
+    def predict(
+        self, pid: str, only_scl: bool = False, data_source: str = "creodias"
+    ) -> float:
+        """
+        Predict the processing time of a product
+        :param pid: Sentinel-2 product id
+        :param only_scl: True to process scl only
+        :param data_source: Sentinel-2 product data source
+        :return: Seconds
+        """
+        tile_factor = self.tile_factors.get(pid.split("_")[5], 1.0)
+        return self._base(pid, only_scl, data_source) * tile_factor
+
+
+def pack(jobs: List[Tuple[Job, float]], workers: int) -> Tuple[List[List[Job]], float]:
+    """
+    Assign jobs in order to the first free worker, as the workers pulling
+    from a queue do; longest first (LPT) bounds the makespan to 4/3 of the
+    optimum
+    :param jobs: Jobs and durations, in claim order
+    :param workers: Number of workers
+    :return: Jobs of each worker and makespan
+    """
+    loads = [(0.0, worker) for worker in range(max(workers, 1))]
+    assignment: List[List[Job]] = [[] for _ in loads]
+    for job, seconds in jobs:
+        load, worker = heapq.heappop(loads)
+        assignment[worker].append(job)
+        heapq.heappush(loads, (load + seconds, worker))
+    return assignment, max(load for load, _ in loads)
+
+
+def longest_first(jobs: List[Tuple[Job, float]]) -> List[Tuple[Job, float]]:
+    """
+    Order jobs longest first
+    :param jobs: Jobs and durations
+    :return: Jobs by decreasing duration
+    """
+    return sorted(jobs, key=lambda job: -job[1])
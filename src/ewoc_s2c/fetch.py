@@ -0,0 +1,326 @@
+""" EWoC Sen2Cor band-selective L2A fetch module"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import boto3
+from botocore.config import Config
+
+from ewoc_s2c.ranged import DOWNLOAD_WORKERS, RangedDownloader
+from ewoc_s2c.resolver import ProductNotFoundError
+from ewoc_s2c.utils import get_ard_bands, needs_boa_offset
+
+logger = logging.getLogger(__name__)
+
+CREODIAS_EODATA_BUCKET = "EODATA"
+CREODIAS_EODATA_ENDPOINT = "https://eodata.cloudferro.com"
+AWS_SNG_L1C_BUCKET = "sentinel-s2-l1c"
+AWS_SNG_L2A_BUCKET = "sentinel-s2-l2a"
+AWS_SNG_REGION = "eu-central-1"
+# Local sub-folders used for the Sinergise layout: bands are looked up by
+# find_l2a_band_sng in R<res>m folders and the offsets are read from
+# <band>.parents[2]/product/metadata.xml in raster_to_ard
+AWS_SNG_TILE_DIR = "tile"
+AWS_SNG_PRODUCT_DIR = "product"
+# Product and tile metadata files of the SAFE products
+SAFE_METADATA_FILES = ("MTD_MSIL1C.xml", "MTD_MSIL2A.xml", "MTD_TL.xml")
+
+
+class FetchItem(NamedTuple):
+    """Object to download and its local destination"""
+
+    bucket: str
+    key: str
+    out_path: Path
+
+
+class FetchPlan(NamedTuple):
+    """Objects needed to build the ARD and the local product folder"""
+
+    l2a_folder: Path
+    items: List[FetchItem]
+    extra_args: Dict[str, str]
+
+
+def _s2_date_prefix(pid: str, zero_pad: bool = True) -> str:
+    """
+    Get the year/month/day prefix of a product from its acquisition date
+    :param pid: Sentinel-2 product id
+    :param zero_pad: False to remove the leading zeros of month and day
+    :return: Date prefix (ex: 2022/01/25)
+    """
+    date = pid.split("_")[2][:8]
+    year, month, day = date[:4], date[4:6], date[6:]
+    if not zero_pad:
+        month, day = str(int(month)), str(int(day))
+    return f"{year}/{month}/{day}"
+
+
+def plan_creodias_fetch(
+    pid: str, out_dir: Path, keys: List[str], only_scl: bool = False
+) -> FetchPlan:
+    """
+    Select in a Creodias L2A SAFE listing the band files needed for the ARD
+    :param pid: Sentinel-2 product id (with .SAFE)
+    :param out_dir: Output directory
+    :param keys: Object keys of the SAFE product
+    :param only_scl: True to process scl only
+    :return: Fetch plan
+    """
+    if not keys:
+        raise ProductNotFoundError(f"The product {pid} is not found on creodias")
+    bands = get_ard_bands(only_scl)
+    suffixes = tuple(f"_{band}_{res}m.jp2" for band, res in bands.items())
+    prefix = creodias_prd_prefix(pid)
+    items = [
+        FetchItem(
+            CREODIAS_EODATA_BUCKET,
+            key,
+            out_dir / pid / key[len(prefix) :].lstrip("/"),
+        )
+        for key in keys
+        if "/IMG_DATA/" in key and key.endswith(suffixes)
+    ]
+    if len(items) != len(bands):
+        raise ValueError(
+            f"Found {len(items)} band files for {len(bands)} ARD bands in {pid}"
+        )
+    return FetchPlan(out_dir / pid, items, {})
+
+
+def plan_aws_sng_fetch(
+    pid: str, out_dir: Path, tile_path: str, only_scl: bool = False
+) -> FetchPlan:
+    """
+    Build the list of Sinergise L2A objects needed for the ARD
+    :param pid: Sentinel-2 product id (with .SAFE)
+    :param out_dir: Output directory
+    :param tile_path: Tile prefix of the product (from productInfo.json)
+    :param only_scl: True to process scl only
+    :return: Fetch plan
+    """
+    l2a_folder = out_dir / pid
+    items = [
+        FetchItem(
+            AWS_SNG_L2A_BUCKET,
+            f"{tile_path}/R{res}m/{band}.jp2",
+            l2a_folder / AWS_SNG_TILE_DIR / f"R{res}m" / f"{band}.jp2",
+        )
+        for band, res in get_ard_bands(only_scl).items()
+    ]
+    if not only_scl and needs_boa_offset(pid, "aws_sng"):
+        items.append(
+            FetchItem(
+                AWS_SNG_L2A_BUCKET,
+                f"{aws_sng_prd_prefix(pid)}/metadata.xml",
+                l2a_folder / AWS_SNG_PRODUCT_DIR / "metadata.xml",
+            )
+        )
+    return FetchPlan(l2a_folder, items, {"RequestPayer": "requester"})
+
+
+def creodias_prd_prefix(pid: str) -> str:
+    """
+    Get the Creodias EODATA prefix of a L1C or L2A product
+    :param pid: Sentinel-2 product id (with .SAFE)
+    :return: Product prefix
+    """
+    level = pid.split("_")[1][3:]
+    return f"Sentinel-2/MSI/{level}/{_s2_date_prefix(pid)}/{pid}"
+
+
+def aws_sng_prd_prefix(pid: str) -> str:
+    """
+    Get the Sinergise prefix of a L2A product
+    :param pid: Sentinel-2 product id
+    :return: Product prefix
+    """
+    prd_name = pid.replace(".SAFE", "")
+    return f"products/{_s2_date_prefix(prd_name, zero_pad=False)}/{prd_name}"
+
+
+def creodias_s3_client() -> Any:
+    """
+    Create a S3 client for the Creodias EODATA bucket
+    :return: boto3 S3 client
+    """
+    return boto3.client(
+        "s3",
+        endpoint_url=os.getenv("CREODIAS_EODATA_ENDPOINT", CREODIAS_EODATA_ENDPOINT),
+        aws_access_key_id=os.getenv("CREODIAS_EODATA_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("CREODIAS_EODATA_SECRET_ACCESS_KEY"),
+        config=Config(max_pool_connections=2 * DOWNLOAD_WORKERS),
+    )
+
+
+def creodias_eodata_configured() -> bool:
+    """
+    Check if the Creodias EODATA credentials are set
+    :return: True if CREODIAS_EODATA_ACCESS_KEY_ID and
+     CREODIAS_EODATA_SECRET_ACCESS_KEY are set
+    """
+    return bool(
+        os.getenv("CREODIAS_EODATA_ACCESS_KEY_ID")
+        and os.getenv("CREODIAS_EODATA_SECRET_ACCESS_KEY")
+    )
+
+
+def aws_sng_s3_client() -> Any:
+    """
+    Create a S3 client for the Sinergise L2A bucket (requester pays)
+    :return: boto3 S3 client
+    """
+    return boto3.client(
+        "s3",
+        region_name=AWS_SNG_REGION,
+        config=Config(max_pool_connections=2 * DOWNLOAD_WORKERS),
+    )
+
+
+def list_keys(s3_client: Any, bucket: str, prefix: str) -> List[str]:
+    """
+    List the object keys under a prefix
+    :param s3_client: boto3 S3 client
+    :param bucket: Bucket name
+    :param prefix: Key prefix
+    :return: Object keys
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    return [
+        obj["Key"]
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+        for obj in page.get("Contents", [])
+    ]
+
+
+def aws_sng_tile_path(s3_client: Any, bucket: str, pid: str) -> str:
+    """
+    Get the Sinergise tile prefix of a product from its productInfo.json
+    :param s3_client: boto3 S3 client
+    :param bucket: Sinergise L1C or L2A bucket
+    :param pid: Sentinel-2 product id
+    :return: Tile prefix
+    """
+    prd_info = s3_client.get_object(
+        Bucket=bucket,
+        Key=f"{aws_sng_prd_prefix(pid)}/productInfo.json",
+        RequestPayer="requester",
+    )
+    return json.loads(prd_info["Body"].read())["tiles"][0]["path"]
+
+
+def fetch_metadata(
+    pid: str, data_source: str, s3_client: Optional[Any] = None
+) -> Dict[str, bytes]:
+    """
+    Download only the product and tile metadata XML files of a product
+    :param pid: Sentinel-2 product id (with .SAFE)
+    :param data_source: creodias or aws_sng
+    :param s3_client: boto3 S3 client, created from the data source if None
+    :return: Object key to file content
+    """
+    extra_args: Dict[str, str] = {}
+    if data_source == "creodias":
+        s3_client = s3_client or creodias_s3_client()
+        bucket = CREODIAS_EODATA_BUCKET
+        keys = [
+            key
+            for key in list_keys(s3_client, bucket, creodias_prd_prefix(pid) + "/")
+            if key.endswith(SAFE_METADATA_FILES)
+        ]
+    elif data_source == "aws_sng":
+        s3_client = s3_client or aws_sng_s3_client()
+        bucket = AWS_SNG_L2A_BUCKET if "MSIL2A" in pid else AWS_SNG_L1C_BUCKET
+        keys = [
+            f"{aws_sng_prd_prefix(pid)}/metadata.xml",
+            f"{aws_sng_tile_path(s3_client, bucket, pid)}/metadata.xml",
+        ]
+        extra_args = {"RequestPayer": "requester"}
+    else:
+        raise ValueError(f"Metadata fetch not available for {data_source}")
+    if not keys:
+        raise ProductNotFoundError(f"No metadata file found for {pid} on {data_source}")
+    return {
+        key: s3_client.get_object(Bucket=bucket, Key=key, **extra_args)["Body"].read()
+        for key in keys
+    }
+
+
+def download_plan(
+    s3_client: Any, plan: FetchPlan, max_workers: int = DOWNLOAD_WORKERS
+) -> Path:
+    """
+    Download the objects of a fetch plan by concurrent byte ranges
+    :param s3_client: boto3 S3 client
+    :param plan: Fetch plan
+    :param max_workers: Number of parts downloaded in parallel
+    :return: Local product folder
+    """
+    RangedDownloader(s3_client, max_workers).download(plan.items, plan.extra_args)
+    return plan.l2a_folder
+
+
+def fetch_creodias_safe(
+    pid: str,
+    out_dir: Path,
+    max_workers: int = DOWNLOAD_WORKERS,
+    s3_client: Optional[Any] = None,
+) -> Path:
+    """
+    Download a whole SAFE product from Creodias EODATA
+    :param pid: Sentinel-2 product id (with .SAFE)
+    :param out_dir: Output directory
+    :param max_workers: Number of parts downloaded in parallel
+    :param s3_client: boto3 S3 client, created if None
+    :return: Local SAFE folder
+    """
+    s3_client = s3_client or creodias_s3_client()
+    prefix = creodias_prd_prefix(pid) + "/"
+    keys = list_keys(s3_client, CREODIAS_EODATA_BUCKET, prefix)
+    if not keys:
+        raise ProductNotFoundError(f"The product {pid} is not found on creodias")
+    safe_dir = out_dir / pid
+    items = []
+    for key in keys:
+        out_path = safe_dir / key[len(prefix) :]
+        if key.endswith("/"):
+            # Folder markers, the empty folders of the SAFE
+            out_path.mkdir(parents=True, exist_ok=True)
+        else:
+            items.append(FetchItem(CREODIAS_EODATA_BUCKET, key, out_path))
+    return download_plan(s3_client, FetchPlan(safe_dir, items, {}), max_workers)
+
+
+def fetch_l2a_bands(
+    pid: str,
+    out_dir: Path,
+    data_source: str,
+    only_scl: bool = False,
+    max_workers: int = DOWNLOAD_WORKERS,
+    s3_client: Optional[Any] = None,
+) -> Path:
+    """
+    Download only the L2A files needed to build the ARD
+    :param pid: Sentinel-2 product id (with .SAFE)
+    :param out_dir: Output directory
+    :param data_source: creodias or aws_sng
+    :param only_scl: True to process scl only
+    :param max_workers: Number of parts downloaded in parallel
+    :param s3_client: boto3 S3 client, created from the data source if None
+    :return: Local L2A product folder
+    """
+    if data_source == "creodias":
+        s3_client = s3_client or creodias_s3_client()
+        keys = list_keys(
+            s3_client, CREODIAS_EODATA_BUCKET, creodias_prd_prefix(pid) + "/"
+        )
+        plan = plan_creodias_fetch(pid, out_dir, keys, only_scl)
+    elif data_source == "aws_sng":
+        s3_client = s3_client or aws_sng_s3_client()
+        tile_path = aws_sng_tile_path(s3_client, AWS_SNG_L2A_BUCKET, pid)
+        plan = plan_aws_sng_fetch(pid, out_dir, tile_path, only_scl)
+    else:
+        raise ValueError(f"Band-selective fetch not available for {data_source}")
+    return download_plan(s3_client, plan, max_workers)
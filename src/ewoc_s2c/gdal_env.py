@@ -0,0 +1,108 @@
+""" EWoC Sen2Cor GDAL execution profile module"""
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Share of the memory limit given to the GDAL block cache, the rest is left
+# to the band arrays and to Sen2Cor
+GDAL_CACHE_FRACTION = 0.25
+GDAL_CACHE_MIN_MB = 64
+GDAL_CACHE_MAX_MB = 2048
+VSI_CACHE_SIZE = 64 * 1024 * 1024
+
+_APPLIED: Optional[Dict[str, str]] = None
+
+
+def cpu_count() -> int:
+    """
+    Get the number of CPUs available to the process (affinity and cgroup quota)
+    :return: Number of CPUs
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = (
+            Path("/sys/fs/cgroup/cpu.max").read_text(encoding="utf-8").split()
+        )
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def memory_limit() -> int:
+    """
+    Get the memory available to the process: cgroup (v2 or v1) limit or
+    physical memory
+    :return: Memory limit in bytes
+    """
+    limits = []
+    for cgroup_file in (
+        "/sys/fs/cgroup/memory.max",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ):
+        try:
+            limits.append(int(Path(cgroup_file).read_text(encoding="utf-8").strip()))
+        except (OSError, ValueError):
+            continue
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    limits.append(int(line.split()[1]) * 1024)
+                    break
+    except OSError:
+        pass
+    return min(limits) if limits else GDAL_CACHE_MIN_MB * 4 * 1024 * 1024
+
+
+def gdal_profile(
+    processes: int = 1,
+    cpus: Optional[int] = None,
+    mem_limit: Optional[int] = None,
+) -> Dict[str, str]:
+    """
+    Compute the GDAL configuration used to decode the JP2 bands
+    :param processes: Number of processes sharing the CPUs and the memory
+    :param cpus: Number of CPUs, detected if None
+    :param mem_limit: Memory limit in bytes, detected if None
+    :return: GDAL configuration options
+    """
+    threads = max(1, (cpus or cpu_count()) // processes)
+    cache_mb = int((mem_limit or memory_limit()) * GDAL_CACHE_FRACTION / processes)
+    cache_mb = min(max(cache_mb // (1024 * 1024), GDAL_CACHE_MIN_MB), GDAL_CACHE_MAX_MB)
+    return {
+        # JP2OpenJPEG driver and OpenJPEG library threads
+        "GDAL_NUM_THREADS": str(threads),
+        "OPJ_NUM_THREADS": str(threads),
+        # Kakadu driver, when GDAL is built with it
+        "JP2KAK_THREADS": str(threads),
+        "GDAL_CACHEMAX": str(cache_mb),
+        "VSI_CACHE": "TRUE",
+        "VSI_CACHE_SIZE": str(VSI_CACHE_SIZE),
+    }
+
+
+def apply_gdal_profile(processes: int = 1) -> Dict[str, str]:
+    """
+    Set the GDAL profile in the process environment, once per process.
+    It has to be done before the first raster read since GDAL reads some
+    options (GDAL_CACHEMAX) only once. Options already set in the
+    environment are kept.
+    :param processes: Number of processes sharing the CPUs and the memory
+    :return: GDAL configuration options in use
+    """
+    global _APPLIED  # pylint: disable=global-statement
+    if _APPLIED is None:
+        _APPLIED = {
+            key: os.environ.setdefault(key, value)
+            for key, value in gdal_profile(processes).items()
+        }
+        logger.debug("GDAL profile: %s", _APPLIED)
+    return _APPLIED
@@ -0,0 +1,184 @@
+""" EWoC Sen2Cor local SAFE collection ingest module"""
+from concurrent.futures import Future, as_completed
+import logging
+import os
+from pathlib import Path
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ewoc_s2c.durations import DurationModel, longest_first, pack
+from ewoc_s2c.report import prediction_summary
+from ewoc_s2c.utils import WORK_ROOT, ard_product_folder, clean
+from ewoc_s2c.worker import worker_pool
+
+if TYPE_CHECKING:
+    from ewoc_s2c.pipeline import ProcessingOptions
+
+logger = logging.getLogger(__name__)
+
+INGEST_DIR = WORK_ROOT / "INGEST"
+
+
+class LocalProduct(NamedTuple):
+    """SAFE product found on disk"""
+
+    safe_dir: Path
+    level: str
+
+
+def find_safe_products(root: Path) -> List[LocalProduct]:
+    """
+    Find the Sentinel-2 SAFE products of a folder tree, the products are
+    not searched for other products
+    :param root: Folder to scan
+    :return: L1C products first (Sen2Cor), then L2A products, by path
+    """
+    from ewoc_dag.eo_prd_id.s2_prd_id import S2PrdIdInfo
+
+    products = []
+    for dirpath, dirnames, _ in os.walk(root):
+        safe_names = [name for name in dirnames if name.endswith(".SAFE")]
+        dirnames[:] = sorted(name for name in dirnames if not name.endswith(".SAFE"))
+        for name in safe_names:
+            if S2PrdIdInfo.is_l1c(name):
+                level = "L1C"
+            elif S2PrdIdInfo.is_l2a(name):
+                level = "L2A"
+            else:
+                logger.warning("%s is not a L1C or L2A product, skipped", name)
+                continue
+            products.append(LocalProduct(Path(dirpath) / name, level))
+    return sorted(products, key=lambda product: (product.level, product.safe_dir))
+
+
+def run_local_product(
+    safe_dir: str, out_dir: str, options: "ProcessingOptions", work_root: Path
+) -> Tuple[str, float]:
+    """
+    Process a product on disk in a worker process
+    :param safe_dir: SAFE folder
+    :param out_dir: ARD root directory
+    :param options: Processing options
+    :param work_root: Root of the worker work folders
+    :return: done or empty (valid fraction), processing time in seconds
+    """
+    from ewoc_s2c.pipeline import process_local_product
+
+    start = time.perf_counter()
+    ard_folder = process_local_product(
+        Path(safe_dir),
+        Path(out_dir),
+        options,
+        l2a_dir=work_root / f"worker_{os.getpid()}",
+    )
+    return ("done" if ard_folder else "empty"), time.perf_counter() - start
+
+
+def ingest_dir(
+    root: Path,
+    out_dir: Optional[Path] = None,
+    concurrency: int = 1,
+    overwrite: bool = False,
+    verbose: Optional[str] = None,
+    work_root: Path = INGEST_DIR,
+    duration_history: Iterable[Path] = (),
+    **params: Any,
+) -> Dict[str, int]:
+    """
+    Convert the SAFE products of a folder tree to ARD with a pool of worker
+    processes. The products are submitted longest first (predicted time):
+    the L1C products first, Sen2Cor runs one product at a time, and the L2A
+    conversions fill the other workers.
+    :param root: Folder to scan
+    :param out_dir: ARD root directory, None to write the ARD next to each
+     product
+    :param concurrency: Number of worker processes
+    :param overwrite: True to convert again the products which have an ARD,
+     the products with the same ARD (L1C and L2A) are converted once
+    :param verbose: verbose level of the workers
+    :param work_root: Root of the worker work folders
+    :param duration_history: Run reports of past runs predicting the
+     processing time of the products, default durations otherwise
+    :param params: Processing options, see ewoc_s2c.pipeline.ProcessingOptions
+    :return: Number of done, empty, existing, duplicate and failed products
+    """
+    from ewoc_s2c.pipeline import ProcessingOptions
+
+    options = ProcessingOptions.from_params(params)
+    products = find_safe_products(root)
+    logger.info(
+        "%s L1C and %s L2A products in %s",
+        sum(product.level == "L1C" for product in products),
+        sum(product.level == "L2A" for product in products),
+        root,
+    )
+    counts = {"done": 0, "empty": 0, "exists": 0, "duplicate": 0, "failed": 0}
+    # One product per ARD, the L2A rather than its L1C (no Sen2Cor)
+    planned: Dict[Path, Tuple[LocalProduct, Path]] = {}
+    for product in reversed(products):
+        product_out = product.safe_dir.parent if out_dir is None else out_dir
+        ard_folder = ard_product_folder(
+            product_out, product.safe_dir.name.replace(".SAFE", "")
+        )
+        if ard_folder in planned:
+            logger.info(
+                "%s has the ARD of %s, skipped",
+                product.safe_dir.name,
+                planned[ard_folder][0].safe_dir.name,
+            )
+            counts["duplicate"] += 1
+        elif ard_folder.exists() and not overwrite:
+            logger.info("%s exists, skipped", ard_folder)
+            counts["exists"] += 1
+        else:
+            planned[ard_folder] = (product, product_out)
+    model = DurationModel.from_reports(duration_history)
+    predictions = {
+        ard_folder: model.predict(
+            product.safe_dir.name, options.only_scl, options.data_source
+        )
+        for ard_folder, (product, _) in planned.items()
+    }
+    jobs = longest_first(list(predictions.items()))
+    if jobs:
+        logger.info(
+            "Predicted makespan on %s workers: %.0fs (%.0fs in path order)",
+            concurrency,
+            pack(jobs, concurrency)[1],
+            pack(list(reversed(predictions.items())), concurrency)[1],
+        )
+    durations: List[Tuple[float, float]] = []
+    futures: Dict[Future, Tuple[LocalProduct, float]] = {}
+    with worker_pool(concurrency, verbose) as executor:
+        for ard_folder, predicted in jobs:
+            product, product_out = planned[ard_folder]
+            if ard_folder.exists():
+                clean(ard_folder)
+            future = executor.submit(
+                run_local_product,
+                str(product.safe_dir),
+                str(product_out),
+                options,
+                work_root,
+            )
+            futures[future] = (product, predicted)
+        for future in as_completed(futures):
+            product, predicted = futures[future]
+            try:
+                status, duration = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.error("%s failed: %r", product.safe_dir.name, err)
+                counts["failed"] += 1
+            else:
+                logger.info(
+                    "%s %s in %.1fs (predicted %.1fs)",
+                    product.safe_dir.name,
+                    status,
+                    duration,
+                    predicted,
+                )
+                counts[status] += 1
+                durations.append((predicted, duration))
+    logger.info("Ingest of %s: %s", root, counts)
+    logger.info("Predicted versus actual time: %s", prediction_summary(durations))
+    return counts
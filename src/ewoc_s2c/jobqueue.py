@@ -0,0 +1,684 @@
+""" EWoC Sen2Cor job queue module"""
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class Job(NamedTuple):
+    """Product to process, claimed from a queue"""
+
+    job_id: str
+    pid: str
+    params: Dict[str, Any]
+    attempts: int
+
+
+class SqliteJobQueue:
+    """
+    Job queue stored in a local SQLite database. A claimed job is invisible
+    to the other workers until it is acknowledged or its visibility timeout
+    expires.
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, pid TEXT NOT NULL, params TEXT NOT NULL,"
+            "priority REAL NOT NULL DEFAULT 0, status TEXT NOT NULL,"
+            "visible_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_ready "
+            "ON jobs (status, visible_at, priority)"
+        )
+
+    def put(
+        self, pid: str, params: Optional[Dict[str, Any]] = None, priority: float = 0
+    ) -> str:
+        """
+        Add a product to the queue
+        :param pid: Sentinel-2 product id
+        :param params: Processing parameters
+        :param priority: Jobs with higher priority are claimed first
+        :return: Job id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO jobs (job_id, pid, params, priority, status, visible_at,"
+            " created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, pid, json.dumps(params or {}), priority, now, now, now),
+        )
+        return job_id
+
+    def claim(self, visibility_timeout: float) -> Optional[Job]:
+        """
+        Claim the next visible job
+        :param visibility_timeout: Seconds before the job is visible again
+        :return: Job or None if no job is visible
+        """
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT job_id, pid, params, attempts FROM jobs "
+                "WHERE status = 'queued' AND visible_at <= ? "
+                "ORDER BY priority DESC, created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET visible_at = ?, attempts = attempts + 1,"
+                " updated_at = ? WHERE job_id = ?",
+                (now + visibility_timeout, now, row[0]),
+            )
+        finally:
+            self._conn.execute("COMMIT")
+        return Job(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+    def extend(self, job: Job, visibility_timeout: float) -> bool:
+        """
+        Keep a job invisible while it is processed
+        :param job: Claimed job
+        :param visibility_timeout: Seconds before the job is visible again
+        :return: False if the job expired and was claimed again
+        """
+        now = time.time()
+        return self._update_claimed(
+            job, "visible_at = ?, updated_at = ?", (now + visibility_timeout, now)
+        )
+
+    def _update_claimed(
+        self, job: Job, assignments: str, values: Tuple[Any, ...]
+    ) -> bool:
+        """
+        Update a job if its claim is still the one of the caller
+        :param job: Claimed job
+        :param assignments: SET clause of the update
+        :param values: Values of the SET clause
+        :return: False if the job expired and was claimed again
+        """
+        # The attempts of a job identify its claims
+        cursor = self._conn.execute(
+            f"UPDATE jobs SET {assignments}"
+            " WHERE job_id = ? AND attempts = ? AND status = 'queued'",
+            (*values, job.job_id, job.attempts),
+        )
+        if cursor.rowcount == 0:
+            logger.warning("Lost the claim of %s (%s)", job.job_id, job.pid)
+            return False
+        return True
+
+    def ack(self, job: Job) -> None:
+        """
+        Mark a job as done, unless it expired and was claimed again
+        :param job: Claimed job
+        """
+        self._update_claimed(job, "status = 'done', updated_at = ?", (time.time(),))
+
+    def nack(self, job: Job, error: str, retry: bool = True, delay: float = 0) -> None:
+        """
+        Release a job after a failure, unless it expired and was claimed again
+        :param job: Claimed job
+        :param error: Error message
+        :param retry: False to mark the job as failed
+        :param delay: Seconds before the job is visible again
+        """
+        now = time.time()
+        self._update_claimed(
+            job,
+            "status = ?, visible_at = ?, error = ?, updated_at = ?",
+            ("queued" if retry else "failed", now + delay, error, now),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Count the jobs by status
+        :return: Status to number of jobs
+        """
+        return dict(
+            self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        )
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """
+        Get the state of every job
+        :return: Job records (job_id, pid, status, attempts, error)
+        """
+        rows = self._conn.execute(
+            "SELECT job_id, pid, status, attempts, error FROM jobs ORDER BY created_at"
+        )
+        return [
+            dict(zip(("job_id", "pid", "status", "attempts", "error"), row))
+            for row in rows
+        ]
+
+
+class RedisJobQueue:
+    """
+    Job queue stored in a Redis compatible server. Pending and claimed jobs
+    are in a sorted set scored by the time they become visible.
+    """
+
+    def __init__(self, client: Any, name: str = "ewoc_s2c") -> None:
+        """
+        :param client: redis.Redis compatible client (ex: fakeredis.FakeRedis)
+        :param name: Queue name, prefix of the Redis keys
+        """
+        self._client = client
+        self._visible_key = f"{name}:visible"
+        self._jobs_key = f"{name}:jobs"
+        self._status_key = f"{name}:status"
+
+    def put(
+        self, pid: str, params: Optional[Dict[str, Any]] = None, priority: float = 0
+    ) -> str:
+        """
+        Add a product to the queue
+        :param pid: Sentinel-2 product id
+        :param params: Processing parameters
+        :param priority: Jobs with higher priority are claimed first
+        :return: Job id
+        """
+        job_id = uuid.uuid4().hex
+        job = {"pid": pid, "params": params or {}, "attempts": 0}
+        pipe = self._client.pipeline()
+        pipe.hset(self._jobs_key, job_id, json.dumps(job))
+        pipe.hset(self._status_key, job_id, "queued")
+        pipe.zadd(self._visible_key, {job_id: time.time() - priority})
+        pipe.execute()
+        return job_id
+
+    def claim(self, visibility_timeout: float) -> Optional[Job]:
+        """
+        Claim the next visible job
+        :param visibility_timeout: Seconds before the job is visible again
+        :return: Job or None if no job is visible
+        """
+        from redis.exceptions import WatchError
+
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._visible_key)
+                    now = time.time()
+                    job_ids = pipe.zrangebyscore(
+                        self._visible_key, "-inf", now, start=0, num=1
+                    )
+                    if not job_ids:
+                        pipe.unwatch()
+                        return None
+                    job_id = job_ids[0]
+                    if isinstance(job_id, bytes):
+                        job_id = job_id.decode()
+                    job = json.loads(pipe.hget(self._jobs_key, job_id))
+                    job["attempts"] += 1
+                    pipe.multi()
+                    pipe.zadd(self._visible_key, {job_id: now + visibility_timeout})
+                    pipe.hset(self._jobs_key, job_id, json.dumps(job))
+                    pipe.execute()
+                    return Job(job_id, job["pid"], job["params"], job["attempts"])
+                except WatchError:
+                    continue
+
+    def _update_claimed(self, job: Job, update: Callable[[Any], None]) -> bool:
+        """
+        Update a job in a transaction if its claim is still the one of the
+        caller
+        :param job: Claimed job
+        :param update: Function queuing the update commands on a pipeline
+        :return: False if the job expired and was claimed again
+        """
+        from redis.exceptions import WatchError
+
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._jobs_key)
+                    value = pipe.hget(self._jobs_key, job.job_id)
+                    # The attempts of a job identify its claims
+                    if value is None or json.loads(value)["attempts"] != job.attempts:
+                        pipe.unwatch()
+                        logger.warning("Lost the claim of %s (%s)", job.job_id, job.pid)
+                        return False
+                    pipe.multi()
+                    update(pipe)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    def extend(self, job: Job, visibility_timeout: float) -> bool:
+        """
+        Keep a job invisible while it is processed
+        :param job: Claimed job
+        :param visibility_timeout: Seconds before the job is visible again
+        :return: False if the job expired and was claimed again
+        """
+        return self._update_claimed(
+            job,
+            lambda pipe: pipe.zadd(
+                self._visible_key,
+                {job.job_id: time.time() + visibility_timeout},
+                xx=True,
+            ),
+        )
+
+    def ack(self, job: Job) -> None:
+        """
+        Mark a job as done, unless it expired and was claimed again
+        :param job: Claimed job
+        """
+
+        def _done(pipe: Any) -> None:
+            pipe.zrem(self._visible_key, job.job_id)
+            pipe.hset(self._status_key, job.job_id, "done")
+
+        self._update_claimed(job, _done)
+
+    def nack(self, job: Job, error: str, retry: bool = True, delay: float = 0) -> None:
+        """
+        Release a job after a failure, unless it expired and was claimed again
+        :param job: Claimed job
+        :param error: Error message
+        :param retry: False to mark the job as failed
+        :param delay: Seconds before the job is visible again
+        """
+
+        def _release(pipe: Any) -> None:
+            if retry:
+                pipe.zadd(self._visible_key, {job.job_id: time.time() + delay})
+            else:
+                pipe.zrem(self._visible_key, job.job_id)
+                pipe.hset(self._status_key, job.job_id, "failed")
+
+        if self._update_claimed(job, _release):
+            logger.debug("Released job %s: %s", job.job_id, error)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Count the jobs by status
+        :return: Status to number of jobs
+        """
+        counts: Dict[str, int] = {}
+        for status in self._client.hvals(self._status_key):
+            if isinstance(status, bytes):
+                status = status.decode()
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """
+        Get the state of every job
+        :return: Job records (job_id, pid, status, attempts)
+        """
+        statuses = {
+            _decode(job_id): _decode(status)
+            for job_id, status in self._client.hgetall(self._status_key).items()
+        }
+        return [
+            {
+                "job_id": _decode(job_id),
+                "pid": job["pid"],
+                "status": statuses.get(_decode(job_id), "queued"),
+                "attempts": job["attempts"],
+            }
+            for job_id, job in (
+                (job_id, json.loads(value))
+                for job_id, value in self._client.hgetall(self._jobs_key).items()
+            )
+        ]
+
+
+def _decode(value: Any) -> str:
+    """
+    Decode a Redis value
+    :param value: bytes or str
+    :return: str
+    """
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    """
+    Write a JSON file atomically (rename of a temporary file)
+    :param path: Output file
+    :param data: JSON content
+    """
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Read a JSON file written by _write_json
+    :param path: JSON file
+    :return: JSON content, None if the file does not exist
+    """
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+class FileJobQueue:
+    """
+    Job queue stored in a folder of a shared POSIX file system, for workers
+    on several nodes. A claimed job has a lease file, created exclusively
+    (O_EXCL) and renewed by its worker. The lease of a crashed worker expires
+    and the job is claimed again by another worker. Layout:
+
+    - jobs/<job_id>.json: product and parameters, the job ids sort by priority
+    - leases/<job_id>.json: owner, expiry time and attempts of a claimed job
+    - leases/<job_id>.lock: flock held while the lease is checked and updated
+    - results/<job_id>.json: outcome of a finished (done or failed) job
+    """
+
+    def __init__(self, root: Path) -> None:
+        """
+        :param root: Queue folder, on a file system shared by the workers
+        """
+        self.root = root
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        for folder in ("jobs", "leases", "results"):
+            (root / folder).mkdir(parents=True, exist_ok=True)
+        # Lease tokens and claim times of the jobs claimed by this process
+        self._leases: Dict[str, Dict[str, Any]] = {}
+
+    def put(
+        self, pid: str, params: Optional[Dict[str, Any]] = None, priority: float = 0
+    ) -> str:
+        """
+        Add a product to the queue
+        :param pid: Sentinel-2 product id
+        :param params: Processing parameters
+        :param priority: Jobs with higher priority are claimed first
+        :return: Job id
+        """
+        # Sorting the ids gives the claim order: priority, then insertion
+        job_id = f"{1e9 - priority:020.6f}_{time.time_ns()}_{uuid.uuid4().hex[:8]}"
+        job = {"pid": pid, "params": params or {}, "created": time.time()}
+        _write_json(self.root / "jobs" / f"{job_id}.json", job)
+        return job_id
+
+    def _lease_file(self, job_id: str) -> Path:
+        return self.root / "leases" / f"{job_id}.json"
+
+    @contextmanager
+    def _lease_lock(self, job_id: str) -> Iterator[None]:
+        """
+        Lock the lease of a job, its check and its update are atomic
+        :param job_id: Job id
+        """
+        lock_path = self.root / "leases" / f"{job_id}.lock"
+        with open(lock_path, "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _create_lease(
+        self, job_id: str, visibility_timeout: float, attempts: int
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Create the lease of a job if no other worker has it
+        :param job_id: Job id
+        :param visibility_timeout: Seconds before the lease expires
+        :param attempts: Attempts including this one
+        :return: Lease, None if the job is leased by another worker
+        """
+        lease = {
+            "owner": self.worker,
+            "token": uuid.uuid4().hex,
+            "expires": time.time() + visibility_timeout,
+            "attempts": attempts,
+        }
+        try:
+            fd = os.open(
+                self._lease_file(job_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644
+            )
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w", encoding="utf-8") as lease_file:
+            lease_file.write(json.dumps(lease))
+        return lease
+
+    def _take_stale_lease(self, job_id: str, token: str) -> bool:
+        """
+        Move away the expired or released lease of a job, if it is still the
+        one read by this worker
+        :param job_id: Job id
+        :param token: Token of the lease read
+        :return: True if the lease was removed, the job can be claimed
+        """
+        # Not renewed by its owner between the check and the move
+        with self._lease_lock(job_id):
+            lease_file = self._lease_file(job_id)
+            stale_file = lease_file.with_suffix(f".{uuid.uuid4().hex}.stale")
+            try:
+                os.rename(lease_file, stale_file)
+            except FileNotFoundError:
+                return False
+            try:
+                moved = _read_json(stale_file)
+            except json.JSONDecodeError:
+                # A new lease being written by its creator
+                moved = None
+            if moved is not None and moved["token"] == token:
+                os.unlink(stale_file)
+                return True
+            # Another worker claimed the job since the lease was read: its lease
+            # is put back, unless a third one was created meanwhile
+            try:
+                os.link(stale_file, lease_file)
+            except FileExistsError:
+                logger.warning("Lease of %s replaced twice during a claim", job_id)
+            os.unlink(stale_file)
+            return False
+
+    def claim(self, visibility_timeout: float) -> Optional[Job]:
+        """
+        Claim the next job without result and without a valid lease
+        :param visibility_timeout: Seconds before the lease expires
+        :return: Job or None if no job can be claimed
+        """
+        finished = set(os.listdir(self.root / "results"))
+        leased = set(os.listdir(self.root / "leases"))
+        for name in sorted(os.listdir(self.root / "jobs")):
+            if name in finished or not name.endswith(".json"):
+                continue
+            job_id = name[: -len(".json")]
+            attempts = 1
+            if name in leased:
+                try:
+                    old_lease = _read_json(self._lease_file(job_id))
+                except json.JSONDecodeError:
+                    # Being written by its creator
+                    continue
+                if old_lease is None or old_lease["expires"] > time.time():
+                    continue
+                # Expired or released: the worker which moves it away claims it
+                if not self._take_stale_lease(job_id, old_lease["token"]):
+                    continue
+                attempts = old_lease["attempts"] + 1
+                if old_lease["owner"] is not None:
+                    logger.warning(
+                        "Lease of %s by %s expired, job claimed again",
+                        job_id,
+                        old_lease["owner"],
+                    )
+            lease = self._create_lease(job_id, visibility_timeout, attempts)
+            if lease is None:
+                continue
+            job = _read_json(self.root / "jobs" / name)
+            if job is None:
+                continue
+            lease["claimed"] = time.time()
+            self._leases[job_id] = lease
+            return Job(job_id, job["pid"], job["params"], attempts)
+        return None
+
+    def _owns(self, job: Job) -> bool:
+        """
+        Check that the lease of a job is still the one of this worker
+        :param job: Claimed job
+        :return: False if the lease expired and the job was claimed again
+        """
+        lease = self._leases.get(job.job_id)
+        try:
+            current = _read_json(self._lease_file(job.job_id))
+        except json.JSONDecodeError:
+            current = None
+        if lease is None or current is None or current["token"] != lease["token"]:
+            logger.warning("Lost the lease of %s (%s)", job.job_id, job.pid)
+            return False
+        return True
+
+    def extend(self, job: Job, visibility_timeout: float) -> bool:
+        """
+        Renew the lease of a job while it is processed
+        :param job: Claimed job
+        :param visibility_timeout: Seconds before the lease expires
+        :return: False if the lease expired and the job was claimed again
+        """
+        # Not moved away by a claim between the check and the write
+        with self._lease_lock(job.job_id):
+            if not self._owns(job):
+                return False
+            lease = dict(
+                self._leases[job.job_id], expires=time.time() + visibility_timeout
+            )
+            _write_json(self._lease_file(job.job_id), lease)
+        return True
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None) -> None:
+        """
+        Write the result of a job and remove its lease, unless the lease
+        expired and the job was claimed again
+        :param job: Claimed job
+        :param status: done or failed
+        :param error: Error message
+        """
+        with self._lease_lock(job.job_id):
+            if not self._owns(job):
+                self._leases.pop(job.job_id, None)
+                return
+            lease = self._leases.pop(job.job_id)
+            result = {
+                "pid": job.pid,
+                "status": status,
+                "attempts": job.attempts,
+                "worker": self.worker,
+                "seconds": time.time() - lease["claimed"],
+                "finished": time.time(),
+                "error": error,
+            }
+            _write_json(self.root / "results" / f"{job.job_id}.json", result)
+            os.unlink(self._lease_file(job.job_id))
+
+    def ack(self, job: Job) -> None:
+        """
+        Mark a job as done, unless it expired and was claimed again
+        :param job: Claimed job
+        """
+        self._finish(job, "done")
+
+    def nack(self, job: Job, error: str, retry: bool = True, delay: float = 0) -> None:
+        """
+        Release a job after a failure, unless it expired and was claimed again
+        :param job: Claimed job
+        :param error: Error message
+        :param retry: False to mark the job as failed
+        :param delay: Seconds before the job is visible again
+        """
+        if not retry:
+            self._finish(job, "failed", error)
+            return
+        with self._lease_lock(job.job_id):
+            if self._owns(job):
+                # Released lease: no owner, claimable after the delay
+                lease = {
+                    "owner": None,
+                    "token": uuid.uuid4().hex,
+                    "expires": time.time() + delay,
+                    "attempts": job.attempts,
+                    "error": error,
+                }
+                _write_json(self._lease_file(job.job_id), lease)
+        self._leases.pop(job.job_id, None)
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """
+        Get the state of every job
+        :return: Job records (job_id, pid, status, attempts, worker, seconds,
+         error), running jobs have a valid lease
+        """
+        records = []
+        for job_file in sorted((self.root / "jobs").glob("*.json")):
+            job_id = job_file.stem
+            job = _read_json(job_file) or {}
+            record: Dict[str, Any] = {"job_id": job_id, "pid": job.get("pid")}
+            result = _read_json(self.root / "results" / job_file.name)
+            if result is not None:
+                record.update(result)
+            else:
+                try:
+                    lease = _read_json(self._lease_file(job_id)) or {}
+                except json.JSONDecodeError:
+                    lease = {}
+                running = (
+                    lease.get("owner") is not None and lease["expires"] > time.time()
+                )
+                record.update(
+                    status="running" if running else "queued",
+                    attempts=lease.get("attempts", 0),
+                    worker=lease["owner"] if running else None,
+                    error=lease.get("error"),
+                )
+            records.append(record)
+        return records
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Count the jobs by status
+        :return: Status to number of jobs
+        """
+        counts: Dict[str, int] = {}
+        for record in self.jobs():
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return counts
+
+
+def open_queue(url: str) -> Any:
+    """
+    Open a job queue from its URL
+    :param url: sqlite:///path/to/queue.db, redis://host:port/db?name=queue or
+     file:///shared/folder
+    :return: Job queue
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SqliteJobQueue(Path(parsed.path))
+    if parsed.scheme == "file":
+        return FileJobQueue(Path(parsed.path))
+    if parsed.scheme in ["redis", "rediss"]:
+        import redis
+
+        name = parse_qs(parsed.query).get("name", ["ewoc_s2c"])[0]
+        return RedisJobQueue(redis.Redis.from_url(url.split("?")[0]), name)
+    raise ValueError(f"Unsupported queue URL {url}")
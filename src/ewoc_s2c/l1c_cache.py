@@ -0,0 +1,231 @@
+""" EWoC Sen2Cor shared L1C product cache module"""
+from contextlib import ExitStack, contextmanager
+import errno
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+L1C_CACHE_SIZE_GB = 200
+MANIFEST_FILE = "manifest.json"
+# Interrupted downloads are kept to be resumed, then removed after a day
+PARTIAL_PREFIX = ".partial-"
+PARTIAL_MAX_AGE = 24 * 3600
+# Linux FICLONE ioctl: copy-on-write clone of a file (btrfs, xfs...)
+FICLONE = 0x40049409
+
+
+def _clone_file(src: str, dst: str) -> None:
+    """
+    Materialize a file: reflink, hardlink or copy, the first which works
+    :param src: Source file
+    :param dst: Destination file
+    """
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return
+        except OSError:
+            pass
+    os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, dst)
+
+
+class L1CCache:
+    """
+    L1C SAFE products shared by the runs of a host (or of a shared file
+    system). Entries are published by an atomic rename, checked against their
+    file sizes when used, and handed to Sen2Cor as reflinked, hardlinked or
+    copied trees, so an entry can be evicted while its copies are in use.
+    Each product has two locks: <name>.lock serializes its download, and the
+    processes copying it hold <name>.use shared so that it is not removed
+    under them.
+    """
+
+    def __init__(self, cache_dir: Path, max_size_gb: float = L1C_CACHE_SIZE_GB) -> None:
+        """
+        :param cache_dir: Cache folder
+        :param max_size_gb: Maximum size of the cache in GB
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = int(max_size_gb * 1e9)
+        (self.cache_dir / ".locks").mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _lock(self, name: str, mode: int = fcntl.LOCK_EX) -> Iterator[None]:
+        """
+        Hold a lock of the cache
+        :param name: Lock name
+        :param mode: fcntl.LOCK_EX or fcntl.LOCK_SH, with fcntl.LOCK_NB
+         BlockingIOError is raised if the lock is held
+        """
+        with open(self.cache_dir / ".locks" / name, "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, mode)
+            yield
+
+    def _remove_unused(self, entry_dir: Path) -> None:
+        """
+        Remove an entry once no process copies it
+        :param entry_dir: Entry folder
+        """
+        with self._lock(f"{entry_dir.name}.use"):
+            self._remove(entry_dir)
+
+    def _entry_dir(self, pid: str) -> Path:
+        """
+        Get the folder of a cache entry
+        :param pid: Sentinel-2 product id
+        :return: Entry folder
+        """
+        return self.cache_dir / pid.replace(".SAFE", "")
+
+    def _verified_safe(self, pid: str) -> Optional[Path]:
+        """
+        Get the SAFE folder of a cache entry if it is complete
+        :param pid: Sentinel-2 product id
+        :return: SAFE folder, None if missing or damaged
+        """
+        entry_dir = self._entry_dir(pid)
+        try:
+            manifest = json.loads(
+                (entry_dir / MANIFEST_FILE).read_text(encoding="utf-8")
+            )
+        except (OSError, json.JSONDecodeError):
+            return None
+        safe_dir = entry_dir / manifest["safe"]
+        for rel_path, size in manifest["files"].items():
+            try:
+                if (safe_dir / rel_path).stat().st_size != size:
+                    raise OSError(f"Size of {rel_path} changed")
+            except OSError as err:
+                logger.warning("L1C cache entry %s is damaged: %s", pid, err)
+                self._remove_unused(entry_dir)
+                return None
+        return safe_dir
+
+    def _add(self, pid: str, download: Callable[[Path], Path]) -> Path:
+        """
+        Download a product in a temporary folder of the cache and publish it
+        :param pid: Sentinel-2 product id
+        :param download: Function downloading the product in a folder
+        :return: SAFE folder in the cache
+        """
+        # Same folder for each attempt, under the lock of the product, so
+        # that an interrupted download is resumed
+        tmp_dir = self.cache_dir / f"{PARTIAL_PREFIX}{self._entry_dir(pid).name}"
+        tmp_dir.mkdir(exist_ok=True)
+        try:
+            safe_dir = Path(download(tmp_dir))
+            files: Dict[str, int] = {}
+            for path in safe_dir.rglob("*"):
+                if path.is_file():
+                    files[str(path.relative_to(safe_dir))] = path.stat().st_size
+                    # Copies may be hardlinks, protect the cached files
+                    path.chmod(0o444)
+            # The SAFE may be in a sub-folder of the download folder (ex:
+            # auto_<source>/ with the auto data source)
+            safe_rel = safe_dir.resolve().relative_to(tmp_dir.resolve())
+            manifest = {"safe": str(safe_rel), "files": files}
+            (tmp_dir / MANIFEST_FILE).write_text(json.dumps(manifest), encoding="utf-8")
+            entry_dir = self._entry_dir(pid)
+            self._remove_unused(entry_dir)
+            os.rename(tmp_dir, entry_dir)
+        except Exception:
+            logger.warning("Download of %s interrupted, kept to be resumed", pid)
+            raise
+        logger.info("Added %s to the L1C cache", pid)
+        return entry_dir / safe_rel
+
+    def _remove(self, entry_dir: Path) -> None:
+        """
+        Remove an entry, unpublished first so that it is never seen partial
+        :param entry_dir: Entry folder
+        """
+        try:
+            (entry_dir / MANIFEST_FILE).unlink()
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def get(self, pid: str, download: Callable[[Path], Path], out_dir: Path) -> Path:
+        """
+        Get a copy of a L1C product, downloaded in the cache if needed
+        :param pid: Sentinel-2 product id
+        :param download: Function downloading the product in a folder,
+         returns the SAFE folder
+        :param out_dir: Folder where the product is materialized
+        :return: SAFE folder in out_dir
+        """
+        name = self._entry_dir(pid).name
+        with ExitStack() as locks:
+            # One download per product, the other processes wait for it
+            with self._lock(f"{name}.lock"):
+                safe_dir = self._verified_safe(pid)
+                if safe_dir is None:
+                    logger.info("L1C cache miss %s", pid)
+                    safe_dir = self._add(pid, download)
+                else:
+                    logger.info("L1C cache hit %s", pid)
+                # Taken before the download lock is released: the entry cannot
+                # be evicted nor replaced until it is copied
+                locks.enter_context(self._lock(f"{name}.use", fcntl.LOCK_SH))
+            shutil.copytree(
+                safe_dir, out_dir / safe_dir.name, copy_function=_clone_file
+            )
+            # Recently used entries are evicted last
+            os.utime(self._entry_dir(pid))
+        self.evict()
+        return out_dir / safe_dir.name
+
+    def evict(self) -> None:
+        """Remove the least recently used products above the size limit"""
+        entries = {}
+        for manifest_file in self.cache_dir.glob(f"*/{MANIFEST_FILE}"):
+            try:
+                manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+                entries[manifest_file.parent] = (
+                    manifest_file.parent.stat().st_mtime,
+                    sum(manifest["files"].values()),
+                )
+            except (OSError, json.JSONDecodeError):
+                continue
+        total = sum(size for _, size in entries.values())
+        for entry_dir, (_, size) in sorted(entries.items(), key=lambda item: item[1]):
+            if total <= self.max_size:
+                break
+            try:
+                with self._lock(
+                    f"{entry_dir.name}.lock", fcntl.LOCK_EX | fcntl.LOCK_NB
+                ), self._lock(f"{entry_dir.name}.use", fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    self._remove(entry_dir)
+            except BlockingIOError:
+                logger.debug("%s is in use, not evicted", entry_dir.name)
+                continue
+            total -= size
+            logger.info("Evicted %s from the L1C cache", entry_dir.name)
+        for partial_dir in self.cache_dir.glob(f"{PARTIAL_PREFIX}*"):
+            try:
+                if time.time() - partial_dir.stat().st_mtime < PARTIAL_MAX_AGE:
+                    continue
+            except FileNotFoundError:
+                continue
+            entry_name = partial_dir.name[len(PARTIAL_PREFIX) :]
+            lock_path = self.cache_dir / ".locks" / f"{entry_name}.lock"
+            with open(lock_path, "a", encoding="utf-8") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                shutil.rmtree(partial_dir, ignore_errors=True)
+            logger.info("Removed the interrupted download %s", entry_name)
@@ -0,0 +1,222 @@
+""" EWoC Sen2Cor L2A result cache module"""
+from contextlib import ExitStack, contextmanager
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import Any, Dict, Iterator, Optional
+import uuid
+import xml.etree.ElementTree as ET
+
+from ewoc_s2c.sen2cor import set_gipp_dem
+from ewoc_s2c.utils import SEN2COR_ROOT, SEN2COR_VERSION
+
+logger = logging.getLogger(__name__)
+
+L2A_CACHE_SIZE_GB = 100
+ENTRY_FILE = "entry.json"
+# GIPP elements which do not change the Sen2Cor output
+GIPP_IGNORED = ("Log_Level",)
+
+
+def gipp_hash(dem_type: str) -> str:
+    """
+    Hash the GIPP Sen2Cor will run with for a DEM type
+    :param dem_type: DEM type
+    :return: SHA-256 hex digest
+    """
+    root = ET.parse(SEN2COR_ROOT / "cfg" / "L2A_GIPP.xml").getroot()
+    set_gipp_dem(root, dem_type)
+    for tag in GIPP_IGNORED:
+        for elt in root.iter(tag):
+            elt.text = None
+    return hashlib.sha256(ET.tostring(root)).hexdigest()
+
+
+def l2a_cache_key(pid: str, dem_type: str, only_scl: bool = False) -> str:
+    """
+    Compute the cache key of the Sen2Cor output of a L1C product
+    :param pid: L1C product id
+    :param dem_type: DEM type
+    :param only_scl: True for the scene classification only runs
+    :return: SHA-256 hex digest
+    """
+    inputs = {
+        "pid": pid.replace(".SAFE", ""),
+        "sen2cor_version": SEN2COR_VERSION,
+        "gipp": gipp_hash(dem_type),
+        "dem_type": dem_type,
+        "only_scl": only_scl,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _tree_size(folder: Path) -> int:
+    """
+    Get the size of the files of a folder
+    :param folder: Folder path
+    :return: Size in bytes
+    """
+    return sum(path.stat().st_size for path in folder.rglob("*") if path.is_file())
+
+
+def _write_entry(entry_file: Path, entry: Dict[str, Any]) -> None:
+    """
+    Write the information of a cache entry atomically
+    :param entry_file: Entry information file
+    :param entry: Entry information
+    """
+    tmp_file = entry_file.with_suffix(f".{os.getpid()}.tmp")
+    tmp_file.write_text(json.dumps(entry), encoding="utf-8")
+    os.replace(tmp_file, entry_file)
+
+
+class L2ACache:
+    """
+    Sen2Cor L2A SAFE outputs stored by key, least recently used entries are
+    evicted above the size limit. The entries returned by get and put are
+    read in place: they are pinned with a shared lock on .locks/<key>.use
+    until release, and eviction skips the pinned entries.
+    """
+
+    def __init__(self, cache_dir: Path, max_size_gb: float = L2A_CACHE_SIZE_GB) -> None:
+        """
+        :param cache_dir: Cache folder, can be shared between hosts
+        :param max_size_gb: Maximum size of the cache in GB
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = int(max_size_gb * 1e9)
+        (self.cache_dir / ".locks").mkdir(parents=True, exist_ok=True)
+        # Use locks of the entries pinned by this instance
+        self._pins = ExitStack()
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        """Lock the cache index for an update"""
+        with open(self.cache_dir / ".lock", "w", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    @contextmanager
+    def _use_lock(self, key: str, mode: int) -> Iterator[None]:
+        """
+        Hold the use lock of an entry
+        :param key: Cache key
+        :param mode: fcntl.LOCK_SH to pin the entry, fcntl.LOCK_EX with
+         fcntl.LOCK_NB to remove it, BlockingIOError is raised if it is pinned
+        """
+        with open(
+            self.cache_dir / ".locks" / f"{key}.use", "a", encoding="utf-8"
+        ) as lock:
+            fcntl.flock(lock, mode)
+            yield
+
+    def release(self) -> None:
+        """Unpin the entries returned so far, they can be evicted again"""
+        self._pins.close()
+
+    def _entry_dir(self, key: str) -> Path:
+        """
+        Get the folder of a cache entry
+        :param key: Cache key
+        :return: Entry folder
+        """
+        return self.cache_dir / key[:2] / key
+
+    def _entries(self) -> Dict[Path, Dict[str, Any]]:
+        """
+        Read the cache entries
+        :return: Entry folder to entry information
+        """
+        entries = {}
+        for entry_file in self.cache_dir.glob(f"*/*/{ENTRY_FILE}"):
+            try:
+                entries[entry_file.parent] = json.loads(
+                    entry_file.read_text(encoding="utf-8")
+                )
+            except (OSError, json.JSONDecodeError):
+                continue
+        return entries
+
+    def get(self, key: str) -> Optional[Path]:
+        """
+        Get the L2A SAFE folder of a key and mark it as recently used, the
+        entry is pinned until release
+        :param key: Cache key
+        :return: L2A SAFE folder, None if not in the cache
+        """
+        entry_file = self._entry_dir(key) / ENTRY_FILE
+        with self._lock():
+            try:
+                entry = json.loads(entry_file.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                logger.info("L2A cache miss %s", key)
+                return None
+            entry["last_used"] = time.time()
+            _write_entry(entry_file, entry)
+            # Taken before the cache lock is released: not evicted meanwhile
+            self._pins.enter_context(self._use_lock(key, fcntl.LOCK_SH))
+        logger.info("L2A cache hit %s: %s", key, entry["l2a"])
+        return entry_file.parent / entry["l2a"]
+
+    def put(self, key: str, l2a_safe: Path, pid: str) -> Path:
+        """
+        Move a L2A SAFE folder into the cache and evict the least recently
+        used entries above the size limit, the entry is pinned until release
+        :param key: Cache key
+        :param l2a_safe: L2A SAFE folder produced by Sen2Cor
+        :param pid: L1C product id
+        :return: L2A SAFE folder in the cache
+        """
+        entry_dir = self._entry_dir(key)
+        # Filled next to its final place, published by an atomic rename
+        tmp_dir = self.cache_dir / f".tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir()
+        shutil.move(str(l2a_safe), tmp_dir / l2a_safe.name)
+        entry: Dict[str, Any] = {
+            "pid": pid,
+            "l2a": l2a_safe.name,
+            "size": _tree_size(tmp_dir),
+            "created": time.time(),
+            "last_used": time.time(),
+        }
+        _write_entry(tmp_dir / ENTRY_FILE, entry)
+        entry_dir.parent.mkdir(exist_ok=True)
+        with self._lock():
+            try:
+                os.rename(tmp_dir, entry_dir)
+                logger.info("Added %s to the L2A cache (%s)", pid, key)
+            except OSError:
+                # Already added by another process, use its output
+                shutil.rmtree(tmp_dir)
+                entry = json.loads((entry_dir / ENTRY_FILE).read_text(encoding="utf-8"))
+            self._pins.enter_context(self._use_lock(key, fcntl.LOCK_SH))
+            self._evict()
+        return entry_dir / entry["l2a"]
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used entries above the size limit, except
+        the pinned ones, the cache lock has to be held
+        """
+        entries = self._entries()
+        total = sum(entry["size"] for entry in entries.values())
+        for entry_dir, entry in sorted(
+            entries.items(), key=lambda item: item[1]["last_used"]
+        ):
+            if total <= self.max_size:
+                break
+            try:
+                with self._use_lock(entry_dir.name, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    # Unpublish first so that readers never see a partial entry
+                    (entry_dir / ENTRY_FILE).unlink()
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+            except BlockingIOError:
+                logger.debug("%s is in use, not evicted", entry["pid"])
+                continue
+            total -= entry["size"]
+            logger.info("Evicted %s from the L2A cache", entry["pid"])
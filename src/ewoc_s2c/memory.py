@@ -0,0 +1,89 @@
+""" EWoC Sen2Cor band buffer pool and memory usage module"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional, Tuple
+
+if TYPE_CHECKING:
+    from nptyping import NDArray
+
+logger = logging.getLogger(__name__)
+
+# Buffers of the conversion in progress, one backing array per buffer role:
+# the 20m arrays use the memory of the 10m ones
+_POOL: ContextVar[Optional[Dict[str, "NDArray[Any]"]]] = ContextVar(
+    "buffer_pool", default=None
+)
+
+
+@contextmanager
+def buffer_pool() -> Iterator[None]:
+    """
+    Reuse the buffers of get_buffer until the end of the block, they are
+    released afterwards so that a worker does not keep them between products
+    """
+    token = _POOL.set({})
+    try:
+        yield
+    finally:
+        _POOL.reset(token)
+
+
+def get_buffer(name: str, shape: Tuple[int, ...], dtype: Any) -> "NDArray[Any]":
+    """
+    Get an array of the buffer pool in use, its content is undefined. A
+    buffer is valid until the next call with the same name. Without pool, a
+    new array is allocated.
+    :param name: Role of the buffer (band, scl, mask...)
+    :param shape: Array shape, the tile shape of a resolution
+    :param dtype: Array dtype
+    :return: Array
+    """
+    import numpy as np
+
+    pool = _POOL.get()
+    if pool is None:
+        return np.empty(shape, dtype=dtype)
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    backing = pool.get(name)
+    if backing is None or backing.size < nbytes:
+        # Released before the allocation of the larger one
+        pool.pop(name, None)
+        del backing
+        backing = pool[name] = np.empty(nbytes, dtype=np.uint8)
+        logger.debug("New %s buffer of %.0f MB", name, nbytes / 1024**2)
+    return backing[:nbytes].view(dtype).reshape(shape)
+
+
+def _proc_status_mb(field: str) -> float:
+    """
+    Read a memory field of /proc/self/status
+    :param field: VmRSS or VmHWM
+    :return: Value in MB, 0 if not available
+    """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def reset_peak_memory() -> None:
+    """Reset the peak resident memory of the process (Linux 4.0+)"""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        logger.debug("Peak memory cannot be reset")
+
+
+def memory_usage() -> Tuple[float, float]:
+    """
+    Get the resident memory of the process
+    :return: Current and peak (since the last reset) resident memory in MB
+    """
+    return _proc_status_mb("VmRSS"), _proc_status_mb("VmHWM")
@@ -0,0 +1,557 @@
+""" EWoC Sen2Cor product processing module"""
+from contextlib import contextmanager
+import fcntl
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional
+
+from ewoc_s2c.l1c_cache import L1C_CACHE_SIZE_GB, L1CCache
+from ewoc_s2c.l2a_cache import L2A_CACHE_SIZE_GB, L2ACache, l2a_cache_key
+from ewoc_s2c.memory import buffer_pool, memory_usage, reset_peak_memory
+from ewoc_s2c.preflight import preflight
+from ewoc_s2c.profiling import profile_stage
+from ewoc_s2c.report import append_run_report
+from ewoc_s2c.safe_check import check_links, check_safe
+from ewoc_s2c.sinks import LocalSink, S3Sink, abort_on_failure, use_sink
+from ewoc_s2c.sources import DataSource, get_source
+from ewoc_s2c.streaming import StreamingArd, stream_s2c
+from ewoc_s2c.upload import clear_content_hashes
+from ewoc_s2c.sen2cor import custom_s2c_dem, edit_xml_config_file, run_s2c, unlink
+from ewoc_s2c.utils import (
+    SEN2COR_ROOT,
+    WORK_ROOT,
+    clean,
+    ewoc_s3_upload,
+    l2a_to_ard,
+    make_tmp_dirs,
+)
+
+logger = logging.getLogger(__name__)
+
+WORK_DIR = WORK_ROOT / "OUT"
+# Processing options which are paths, strings in the job queue parameters
+PATH_OPTIONS = ("datacube_dir", "l2a_cache_dir", "l1c_cache_dir", "run_report")
+# Sen2Cor configuration and DEM folder are shared by all the processes
+SEN2COR_LOCK_FILE = SEN2COR_ROOT / "ewoc_s2c.lock"
+
+
+@contextmanager
+def sen2cor_lock() -> Iterator[None]:
+    """
+    Lock the Sen2Cor configuration and DEM folder for one L1C product
+    """
+    SEN2COR_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(SEN2COR_LOCK_FILE, "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def fetch_checked_l1c(pid: str, source: DataSource, out_dir: Path) -> Path:
+    """
+    Download a L1C product and check it against its manifest, a damaged
+    product is downloaded again once
+    :param pid: Sentinel-2 L1C product identifier
+    :param source: Sentinel-2 product data source
+    :param out_dir: L1C download folder
+    :return: L1C SAFE folder
+    """
+    for attempt in (1, 2):
+        l1c_safe_folder = source.get_l1c(pid, out_dir)
+        with profile_stage("check"):
+            problems = check_safe(l1c_safe_folder)
+        if not problems:
+            return l1c_safe_folder
+        logger.warning(
+            "Damaged L1C product %s (attempt %s): %s", pid, attempt, "; ".join(problems)
+        )
+        clean(l1c_safe_folder)
+    raise ValueError(f"L1C product {pid} is damaged: {'; '.join(problems)}")
+
+
+def run_sen2cor(
+    l1c_safe_folder: Path,
+    pid: str,
+    dem_type: str,
+    only_scl: bool,
+    out_dir_l2a: Path,
+    converter: Optional[StreamingArd] = None,
+) -> Path:
+    """
+    Run Sen2Cor on a L1C product with the DEM of its tile
+    :param l1c_safe_folder: L1C SAFE folder
+    :param pid: Sentinel-2 L1C product identifier
+    :param dem_type: DEM type
+    :param only_scl: True to process scl only
+    :param out_dir_l2a: Sen2Cor output folder
+    :param converter: ARD conversion fed with the bands completed while
+     Sen2Cor runs, None to wait for Sen2Cor
+    :return: L2A SAFE folder
+    """
+    with sen2cor_lock():
+        with profile_stage("dem"):
+            # Edit config file
+            edit_xml_config_file(dem_type)
+            # Download and create a DEM mosaic
+            tile = pid.split("_")[5][1:]
+            dem_tmp_dir, dem_syms = custom_s2c_dem(dem_type, tile)
+            dem_problems = check_links(dem_syms)
+        if dem_problems:
+            clean(dem_tmp_dir)
+            unlink(dem_syms)
+            raise ValueError(f"Sen2Cor DEM is broken: {'; '.join(dem_problems)}")
+        # Run sen2cor in subprocess
+        with profile_stage("sen2cor", subprocess=True):
+            if converter is None:
+                l2a_safe_folder = run_s2c(l1c_safe_folder, out_dir_l2a, only_scl)
+            else:
+                l2a_safe_folder = stream_s2c(
+                    l1c_safe_folder, out_dir_l2a, converter, only_scl
+                )
+        clean(dem_tmp_dir)
+        unlink(dem_syms)
+    return l2a_safe_folder
+
+
+def sen2cor_l2a(
+    pid: str,
+    source: DataSource,
+    dem_type: str,
+    only_scl: bool,
+    out_dir_l1c: Path,
+    out_dir_l2a: Path,
+    l1c_cache: Optional[L1CCache] = None,
+    converter: Optional[StreamingArd] = None,
+) -> Path:
+    """
+    Download a L1C product and run Sen2Cor
+    :param pid: Sentinel-2 L1C product identifier
+    :param source: Sentinel-2 product data source
+    :param dem_type: DEM type
+    :param only_scl: True to process scl only
+    :param out_dir_l1c: L1C download folder
+    :param out_dir_l2a: Sen2Cor output folder
+    :param l1c_cache: Shared L1C cache, None to download the product
+    :param converter: ARD conversion fed while Sen2Cor runs, None to wait
+     for Sen2Cor
+    :return: L2A SAFE folder
+    """
+    # Get Sat product by id using the data source
+    with profile_stage("download"):
+        if l1c_cache is None:
+            l1c_safe_folder = fetch_checked_l1c(pid, source, out_dir_l1c)
+        else:
+            # Only checked products enter the cache
+            l1c_safe_folder = l1c_cache.get(
+                pid,
+                lambda cache_tmp_dir: fetch_checked_l1c(pid, source, cache_tmp_dir),
+                out_dir_l1c,
+            )
+    return run_sen2cor(l1c_safe_folder, pid, dem_type, only_scl, out_dir_l2a, converter)
+
+
+def report_product(
+    run_report: Optional[Path], record: Dict[str, Any], start: float, status: str
+) -> None:
+    """
+    Log the memory usage of a product and add its outcome to the run report
+    :param run_report: Run report file, None to disable the report
+    :param record: Product record
+    :param start: Processing start time (time.perf_counter)
+    :param status: done, skipped (pre-flight) or empty (valid fraction)
+    """
+    rss, peak_rss = memory_usage()
+    logger.info(
+        "%s %s: resident memory %.0f MB, peak %.0f MB",
+        record["pid"],
+        status,
+        rss,
+        peak_rss,
+    )
+    if run_report is None:
+        return
+    record.update(
+        status=status,
+        seconds=round(time.perf_counter() - start, 3),
+        rss_mb=round(rss),
+        peak_rss_mb=round(peak_rss),
+    )
+    append_run_report(run_report, record)
+
+
+class ProcessingOptions(NamedTuple):
+    """
+    Processing options of the products
+    :param data_source: Sentinel-2 product data source, for the products on
+     disk the data source whose L2A band layout and offset rules apply
+    :param dem_type: DEM type
+    :param only_scl: True to process scl only
+    :param datacube_dir: Datacubes root directory, None to skip the datacube output
+    :param ard_layout: band or stacked ARD files
+    :param interleave: pixel or band interleaving of the stacked ARD files
+    :param ard_sink: local to write the ARD on disk and upload it, s3 to write
+     it directly to the ARD bucket
+    :param stream: True to convert (and with the s3 sink upload) the bands
+     completed by Sen2Cor while it runs, committed when it succeeds
+    :param l2a_cache_dir: Sen2Cor output cache folder, None to disable the cache
+    :param l2a_cache_size: Maximum size of the Sen2Cor output cache in GB
+    :param l1c_cache_dir: Shared L1C product cache folder, None to disable it
+    :param l1c_cache_size: Maximum size of the L1C product cache in GB
+    :param min_valid_fraction: Minimum fraction of valid pixels (from the SCL)
+     to write and upload the ARD
+    :param max_cloud_cover: Maximum cloud cover (%) of the product metadata
+    :param max_nodata: Maximum nodata pixels (%) of the product metadata
+    :param min_baseline: Minimum processing baseline (ex: 0400)
+    :param preflight_action: skip the products which do not meet the
+     thresholds, or flag them in the run report and process them
+    :param run_report: JSON lines file the outcome of the products is added to
+    """
+
+    data_source: str = "creodias"
+    dem_type: str = "srtm"
+    only_scl: bool = False
+    datacube_dir: Optional[Path] = None
+    ard_layout: str = "band"
+    interleave: str = "pixel"
+    ard_sink: str = "local"
+    stream: bool = False
+    l2a_cache_dir: Optional[Path] = None
+    l2a_cache_size: float = L2A_CACHE_SIZE_GB
+    l1c_cache_dir: Optional[Path] = None
+    l1c_cache_size: float = L1C_CACHE_SIZE_GB
+    min_valid_fraction: float = 0.0
+    max_cloud_cover: Optional[float] = None
+    max_nodata: Optional[float] = None
+    min_baseline: Optional[str] = None
+    preflight_action: str = "skip"
+    run_report: Optional[Path] = None
+
+    @classmethod
+    def from_params(cls, params: Dict[str, Any]) -> "ProcessingOptions":
+        """
+        Get the options of JSON parameters (job queue), where the paths are
+        strings
+        :param params: Option name to value
+        :return: Processing options
+        """
+        params = dict(params)
+        for name in PATH_OPTIONS:
+            if params.get(name) is not None:
+                params[name] = Path(params[name])
+        return cls(**params)
+
+
+def check_preflight(
+    pid: str, source: DataSource, options: ProcessingOptions, record: Dict[str, Any]
+) -> bool:
+    """
+    Run the pre-flight checks of a product, on its metadata only
+    :param pid: Sentinel-2 product identifier
+    :param source: Sentinel-2 product data source
+    :param options: Processing options
+    :param record: Product record, the metadata and the failed checks are added
+    :return: False if the product is skipped
+    """
+    thresholds = (options.max_cloud_cover, options.max_nodata, options.min_baseline)
+    if thresholds == (None, None, None):
+        return True
+    # Metadata only, before any heavy download
+    with profile_stage("preflight"):
+        checks = preflight(pid, source, *thresholds)
+    record["metadata"] = checks.metadata._asdict()
+    if not checks.reasons:
+        return True
+    record["reasons"] = checks.reasons
+    if options.preflight_action == "skip":
+        logger.warning("Skipped %s: %s", pid, "; ".join(checks.reasons))
+        return False
+    logger.warning("Flagged %s: %s", pid, "; ".join(checks.reasons))
+    return True
+
+
+def l1c_to_ard(
+    pid: str,
+    source: DataSource,
+    options: ProcessingOptions,
+    l2a_dir: Path,
+    upload_dir: Path,
+) -> Optional[Path]:
+    """
+    Run Sen2Cor on a L1C product, or get its output from the L2A cache, and
+    convert it to ARD through the sink in use
+    :param pid: Sentinel-2 L1C product identifier
+    :param source: Sentinel-2 product data source
+    :param options: Processing options
+    :param l2a_dir: Work folder
+    :param upload_dir: ARD root directory
+    :return: ARD product folder, None if the product has too few valid pixels
+    """
+    out_dir_l1c, out_dir_l2a = make_tmp_dirs(l2a_dir)
+    l2a_safe_folder = None
+    converter = None
+    ard_folder = None
+    l2a_cache = None
+    if options.l2a_cache_dir is not None:
+        l2a_cache = L2ACache(options.l2a_cache_dir, options.l2a_cache_size)
+        cache_key = l2a_cache_key(pid, options.dem_type, options.only_scl)
+        l2a_safe_folder = l2a_cache.get(cache_key)
+    try:
+        if l2a_safe_folder is None:
+            l1c_cache = None
+            if options.l1c_cache_dir is not None:
+                l1c_cache = L1CCache(options.l1c_cache_dir, options.l1c_cache_size)
+            if options.stream:
+                converter = StreamingArd(
+                    upload_dir,
+                    pid,
+                    options.data_source,
+                    options.only_scl,
+                    options.ard_layout,
+                    options.interleave,
+                    options.min_valid_fraction,
+                )
+            with buffer_pool():
+                l2a_safe_folder = sen2cor_l2a(
+                    pid,
+                    source,
+                    options.dem_type,
+                    options.only_scl,
+                    out_dir_l1c,
+                    out_dir_l2a,
+                    l1c_cache,
+                    converter,
+                )
+            if converter is not None:
+                with buffer_pool(), profile_stage("ard"):
+                    ard_folder = converter.finish(l2a_safe_folder)
+            if l2a_cache is not None:
+                l2a_safe_folder = l2a_cache.put(cache_key, l2a_safe_folder, pid)
+        if converter is None:
+            # Convert the sen2cor output to ewoc ard format
+            with buffer_pool(), profile_stage("ard"):
+                ard_folder = l2a_to_ard(
+                    l2a_safe_folder,
+                    upload_dir,
+                    pid,
+                    options.data_source,
+                    options.only_scl,
+                    options.ard_layout,
+                    options.interleave,
+                    options.min_valid_fraction,
+                )
+    finally:
+        if l2a_cache is not None:
+            # The cache entry read in place can be evicted once converted
+            l2a_cache.release()
+    # Delete local folders
+    clean(out_dir_l2a)
+    return ard_folder
+
+
+def open_sink(options: ProcessingOptions, upload_dir: Path, production_id: str) -> Any:
+    """
+    Create the ARD output sink of a product
+    :param options: Processing options
+    :param upload_dir: ARD root directory
+    :param production_id: Special identifier, bucket prefix of the ARD
+    :return: LocalSink or S3Sink
+    """
+    if options.ard_sink != "s3":
+        return LocalSink()
+    if options.datacube_dir is not None:
+        raise ValueError("The datacube output needs the local ARD sink")
+    return S3Sink(upload_dir, production_id)
+
+
+def publish_ard(sink: Any, upload_dir: Path, production_id: str) -> None:
+    """
+    Upload the ARD of a product: commit the files of the s3 sink, or upload
+    the files written on the local disk
+    :param sink: LocalSink or S3Sink
+    :param upload_dir: ARD root directory
+    :param production_id: Special identifier, bucket prefix of the ARD
+    """
+    if isinstance(sink, S3Sink):
+        sink.commit()
+        report = sink.report()
+        print(
+            f"Uploaded {report.uploaded} tif files to bucket | {report.up_dir} | "
+            f"{report.skipped} unchanged files skipped "
+            f"({report.bytes_saved / 1e6:.1f} MB saved)"
+        )
+        clean(upload_dir)
+    else:
+        with profile_stage("upload"):
+            ewoc_s3_upload(upload_dir, production_id)
+
+
+def process_product(
+    pid: str,
+    production_id: str = "0000",
+    options: ProcessingOptions = ProcessingOptions(),
+    predicted_seconds: Optional[float] = None,
+    owned: Optional[Callable[[], bool]] = None,
+    l2a_dir: Path = WORK_DIR,
+) -> None:
+    """
+    Run Sen2Cor (L1C ids) and convert the L2A to ARD for a product ID
+    :param pid: Sentinel-2 product identifier
+    :param production_id: Special identifier
+    :param options: Processing options
+    :param predicted_seconds: Processing time predicted by the scheduler,
+     added to the run report next to the actual time
+    :param owned: Function checked before the upload, False when the job was
+     claimed again by another worker: the product is abandoned
+    :param l2a_dir: Work folder, cleared before processing
+    :return: None
+    """
+    from ewoc_dag.eo_prd_id.s2_prd_id import S2PrdIdInfo
+
+    if os.path.exists(l2a_dir):
+        clean(l2a_dir)
+        logger.info("Cleared %s", l2a_dir)
+    l2a_dir.mkdir(exist_ok=False, parents=True)
+    upload_dir = l2a_dir / "upload"
+    upload_dir.mkdir(exist_ok=True, parents=True)
+    if not pid.endswith(".SAFE"):
+        pid += ".SAFE"
+    sink = open_sink(options, upload_dir, production_id)
+    with abort_on_failure(sink):
+        source = get_source(options.data_source)
+        start = time.perf_counter()
+        # Peak memory of this product, the steady state is the RSS between products
+        reset_peak_memory()
+        # Checksums of the files of the previous products, uploaded
+        clear_content_hashes()
+        record: Dict[str, Any] = {
+            "pid": pid,
+            "production_id": production_id,
+            "data_source": options.data_source,
+            "only_scl": options.only_scl,
+        }
+        if predicted_seconds is not None:
+            record["predicted_seconds"] = round(predicted_seconds, 3)
+        if not check_preflight(pid, source, options, record):
+            report_product(options.run_report, record, start, "skipped")
+            return
+        if not S2PrdIdInfo.is_l2a(pid):
+            with use_sink(sink):
+                ard_folder = l1c_to_ard(pid, source, options, l2a_dir, upload_dir)
+        elif source.supports_l2a:
+            with profile_stage("download"):
+                l2a_folder = source.get_l2a(pid, l2a_dir, options.only_scl)
+            logger.info("Product downloaded from %s", options.data_source)
+            with use_sink(sink), buffer_pool(), profile_stage("ard"):
+                ard_folder = source.to_ard(
+                    l2a_folder,
+                    upload_dir,
+                    pid,
+                    options.only_scl,
+                    options.ard_layout,
+                    options.interleave,
+                    options.min_valid_fraction,
+                )
+        else:
+            logger.warning("%s is not supported (yet) for L2A ids", options.data_source)
+            return
+        if ard_folder is None:
+            # Empty footprint, nothing to add to the datacube nor to upload
+            if isinstance(sink, S3Sink):
+                sink.abort()
+            report_product(options.run_report, record, start, "empty")
+            return
+        if options.datacube_dir is not None:
+            from ewoc_s2c.datacube import append_ard_to_datacube
+
+            with profile_stage("datacube"):
+                append_ard_to_datacube(ard_folder, options.datacube_dir)
+        if owned is not None and not owned():
+            raise RuntimeError(f"{pid} abandoned, its job was claimed again")
+        # Send to s3, already done by the s3 sink
+        publish_ard(sink, upload_dir, production_id)
+        report_product(options.run_report, record, start, "done")
+
+
+def process_local_product(
+    safe_dir: Path,
+    out_dir: Path,
+    options: ProcessingOptions = ProcessingOptions(),
+    l2a_dir: Path = WORK_DIR,
+) -> Optional[Path]:
+    """
+    Convert a SAFE product already on disk to ARD, with Sen2Cor for the L1C
+    products, without download nor upload
+    :param safe_dir: L1C or L2A SAFE folder, read in place
+    :param out_dir: ARD root directory
+    :param options: Processing options, the download, cache, pre-flight,
+     datacube and upload options are not used
+    :param l2a_dir: Work folder of the Sen2Cor output, cleared before processing
+    :return: ARD product folder, None if the product has too few valid pixels
+    """
+    from ewoc_dag.eo_prd_id.s2_prd_id import S2PrdIdInfo
+
+    pid = safe_dir.name
+    start = time.perf_counter()
+    reset_peak_memory()
+    clear_content_hashes()
+    record: Dict[str, Any] = {
+        "pid": pid,
+        "data_source": options.data_source,
+        "only_scl": options.only_scl,
+        "safe_dir": str(safe_dir),
+    }
+    converter = None
+    if S2PrdIdInfo.is_l2a(pid):
+        l2a_safe_folder = safe_dir
+    else:
+        with profile_stage("check"):
+            problems = check_safe(safe_dir)
+        if problems:
+            raise ValueError(f"L1C product {pid} is damaged: {'; '.join(problems)}")
+        if os.path.exists(l2a_dir):
+            clean(l2a_dir)
+        _, out_dir_l2a = make_tmp_dirs(l2a_dir)
+        if options.stream:
+            converter = StreamingArd(
+                out_dir,
+                pid,
+                options.data_source,
+                options.only_scl,
+                options.ard_layout,
+                options.interleave,
+                options.min_valid_fraction,
+            )
+        try:
+            with buffer_pool():
+                l2a_safe_folder = run_sen2cor(
+                    safe_dir,
+                    pid,
+                    options.dem_type,
+                    options.only_scl,
+                    out_dir_l2a,
+                    converter,
+                )
+        except BaseException:
+            # No partial ARD next to the complete ones
+            if converter is not None and converter.ard_folder.exists():
+                clean(converter.ard_folder)
+            raise
+    with buffer_pool(), profile_stage("ard"):
+        if converter is not None:
+            ard_folder = converter.finish(l2a_safe_folder)
+        else:
+            ard_folder = l2a_to_ard(
+                l2a_safe_folder,
+                out_dir,
+                pid,
+                options.data_source,
+                options.only_scl,
+                options.ard_layout,
+                options.interleave,
+                options.min_valid_fraction,
+            )
+    if l2a_safe_folder != safe_dir:
+        clean(l2a_dir)
+    report_product(options.run_report, record, start, "done" if ard_folder else "empty")
+    return ard_folder
@@ -0,0 +1,134 @@
+""" EWoC Sen2Cor pre-flight metadata check module"""
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional
+import xml.etree.ElementTree as ET
+
+from ewoc_s2c.resolver import ordered_variants
+from ewoc_s2c.sources import DataSource
+
+logger = logging.getLogger(__name__)
+
+# Metadata elements, the first one found is used
+CLOUD_COVER_TAGS = ("Cloud_Coverage_Assessment", "CLOUDY_PIXEL_PERCENTAGE")
+NODATA_TAGS = ("NODATA_PIXEL_PERCENTAGE",)
+BASELINE_TAGS = ("PROCESSING_BASELINE",)
+
+
+class ProductMetadata(NamedTuple):
+    """Scene information read from the product and tile metadata"""
+
+    cloud_cover: Optional[float]
+    nodata: Optional[float]
+    baseline: str
+
+
+class PreflightResult(NamedTuple):
+    """Metadata of a product and the thresholds it does not meet"""
+
+    metadata: ProductMetadata
+    reasons: List[str]
+
+
+def parse_metadata(pid: str, xml_files: Iterable[bytes]) -> ProductMetadata:
+    """
+    Read the scene information of the product and tile metadata files
+    :param pid: Sentinel-2 product id
+    :param xml_files: Content of the metadata files
+    :return: Product metadata, the baseline is the one of the id if missing
+    """
+    values: Dict[str, str] = {}
+    for content in xml_files:
+        for elt in ET.fromstring(content).iter():
+            # Tags are namespaced in the tile metadata
+            tag = elt.tag.rsplit("}", 1)[-1]
+            if elt.text and elt.text.strip():
+                values.setdefault(tag, elt.text.strip())
+
+    def _first(tags: Iterable[str]) -> Optional[str]:
+        return next((values[tag] for tag in tags if tag in values), None)
+
+    cloud_cover = _first(CLOUD_COVER_TAGS)
+    nodata = _first(NODATA_TAGS)
+    baseline = _first(BASELINE_TAGS) or pid.split("_")[3][1:]
+    return ProductMetadata(
+        float(cloud_cover) if cloud_cover is not None else None,
+        float(nodata) if nodata is not None else None,
+        baseline.replace(".", ""),
+    )
+
+
+def check_thresholds(
+    metadata: ProductMetadata,
+    max_cloud_cover: Optional[float] = None,
+    max_nodata: Optional[float] = None,
+    min_baseline: Optional[str] = None,
+) -> List[str]:
+    """
+    Check the product metadata against thresholds, unknown values pass
+    :param metadata: Product metadata
+    :param max_cloud_cover: Maximum cloud cover in percent
+    :param max_nodata: Maximum nodata pixels in percent
+    :param min_baseline: Minimum processing baseline (ex: 0400 or 04.00)
+    :return: Thresholds not met, empty if the product passes
+    """
+    reasons = []
+    if (
+        max_cloud_cover is not None
+        and metadata.cloud_cover is not None
+        and metadata.cloud_cover > max_cloud_cover
+    ):
+        reasons.append(f"cloud cover {metadata.cloud_cover}% > {max_cloud_cover}%")
+    if (
+        max_nodata is not None
+        and metadata.nodata is not None
+        and metadata.nodata > max_nodata
+    ):
+        reasons.append(f"nodata {metadata.nodata}% > {max_nodata}%")
+    if min_baseline is not None and int(metadata.baseline) < int(
+        min_baseline.replace(".", "")
+    ):
+        reasons.append(f"baseline {metadata.baseline} < {min_baseline}")
+    return reasons
+
+
+def preflight(
+    pid: str,
+    source: DataSource,
+    max_cloud_cover: Optional[float] = None,
+    max_nodata: Optional[float] = None,
+    min_baseline: Optional[str] = None,
+) -> PreflightResult:
+    """
+    Fetch the metadata of a product, without its bands, and check it against
+    thresholds. A product whose metadata cannot be fetched is only checked on
+    the baseline of its id.
+    :param pid: Sentinel-2 product id (with .SAFE)
+    :param source: Sentinel-2 product data source
+    :param max_cloud_cover: Maximum cloud cover in percent
+    :param max_nodata: Maximum nodata pixels in percent
+    :param min_baseline: Minimum processing baseline
+    :return: Product metadata and thresholds not met
+    """
+    xml_files: Dict[str, bytes] = {}
+    if max_cloud_cover is not None or max_nodata is not None:
+        # Known-good id variant first, the download statistics are not updated
+        source_key = f"{source.name}:{pid.split('_')[1]}"
+        for _, variant_pid in ordered_variants(pid, source_key):
+            try:
+                xml_files = source.fetch_metadata(variant_pid)
+                break
+            except Exception as err:  # pylint: disable=broad-except
+                logger.info("No metadata for %s: %s", variant_pid, err)
+        if not xml_files:
+            logger.warning("Metadata of %s not found, checks skipped", pid)
+    metadata = parse_metadata(pid, xml_files.values())
+    reasons = check_thresholds(metadata, max_cloud_cover, max_nodata, min_baseline)
+    logger.info(
+        "Pre-flight %s: cloud cover %s%%, nodata %s%%, baseline %s -> %s",
+        pid,
+        metadata.cloud_cover,
+        metadata.nodata,
+        metadata.baseline,
+        "; ".join(reasons) or "ok",
+    )
+    return PreflightResult(metadata, reasons)
@@ -0,0 +1,193 @@
+""" EWoC Sen2Cor stage profiler module"""
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+from pathlib import Path
+import resource
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two samples of the profiled thread
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 15
+SUMMARY_FILE = "profile.txt"
+
+
+def _frame_name(frame: FrameType) -> str:
+    """
+    Name of a stack frame in the collapsed stacks
+    :param frame: Python frame
+    :return: function (file:line of the function)
+    """
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class StageProfiler:
+    """
+    Sampling profiler of the stages of a product. The stack of the thread
+    which opened the profiler is sampled every interval and counted for the
+    current stage: the overhead is the one of the sampling thread, the
+    profiled code is not instrumented. Subprocesses (Sen2Cor) are timed
+    with their CPU time since their Python stack only waits for them.
+    """
+
+    def __init__(self, out_dir: Path, interval: float = SAMPLE_INTERVAL) -> None:
+        """
+        :param out_dir: Folder of the collapsed stacks and of the summary
+        :param interval: Seconds between two samples
+        """
+        self.out_dir = Path(out_dir)
+        self.interval = interval
+        self.stacks: Dict[str, Counter] = {}
+        self.wall_times: Dict[str, float] = {}
+        self.subprocess_cpu: Dict[str, float] = {}
+        # Samples out of the stages are counted for "other"
+        self._stages: List[str] = ["other"]
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample, name="stage-profiler", daemon=True
+        )
+
+    def _sample(self) -> None:
+        """Sample the profiled thread until the profiler is stopped"""
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(  # pylint: disable=protected-access
+                self._thread_id
+            )
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            stage = self._stages[-1]
+            self.stacks.setdefault(stage, Counter())[";".join(reversed(names))] += 1
+
+    def start(self) -> None:
+        """Start the sampling"""
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """Stop the sampling and write the results"""
+        self._stop.set()
+        self._sampler.join()
+        self.write()
+
+    @contextmanager
+    def stage(self, name: str, subprocess: bool = False) -> Iterator[None]:
+        """
+        Count the samples of a block for a stage
+        :param name: Stage name
+        :param subprocess: True if the stage runs a subprocess, its CPU time
+         is reported
+        """
+        self._stages.append(name)
+        start = time.perf_counter()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield
+        finally:
+            self._stages.pop()
+            self.wall_times[name] = (
+                self.wall_times.get(name, 0) + time.perf_counter() - start
+            )
+            if subprocess:
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                self.subprocess_cpu[name] = (
+                    self.subprocess_cpu.get(name, 0)
+                    + after.ru_utime
+                    - children.ru_utime
+                    + after.ru_stime
+                    - children.ru_stime
+                )
+
+    def top_functions(self, stage: str, top: int = TOP_FUNCTIONS) -> List[str]:
+        """
+        Get the table of the functions with the most samples of a stage
+        :param stage: Stage name
+        :param top: Number of functions
+        :return: Table lines: self %, total % (with the callees), function
+        """
+        stacks = self.stacks.get(stage, Counter())
+        nb_samples = max(sum(stacks.values()), 1)
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        lines = [f"{'self %':>8} {'total %':>8}  function"]
+        for frame, count in own.most_common(top):
+            lines.append(
+                f"{100 * count / nb_samples:8.1f} "
+                f"{100 * total[frame] / nb_samples:8.1f}  {frame}"
+            )
+        return lines
+
+    def write(self) -> None:
+        """
+        Write the collapsed stacks of each stage (<stage>.collapsed, for
+        flamegraph.pl or speedscope) and the summary (profile.txt)
+        """
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        for old_file in self.out_dir.glob("*.collapsed"):
+            old_file.unlink()
+        summary = []
+        # In the order of the processing, the samples out of the stages last
+        for stage in dict.fromkeys([*self.wall_times, *self.stacks]):
+            stacks = self.stacks.get(stage, Counter())
+            with open(
+                self.out_dir / f"{stage}.collapsed", "w", encoding="utf-8"
+            ) as collapsed:
+                for stack, count in stacks.most_common():
+                    collapsed.write(f"{stack} {count}\n")
+            header = f"{stage}: {sum(stacks.values())} samples"
+            if stage in self.wall_times:
+                header += f", {self.wall_times[stage]:.2f}s"
+            if stage in self.subprocess_cpu:
+                header += f", subprocess CPU {self.subprocess_cpu[stage]:.2f}s"
+            summary += [header, *self.top_functions(stage), ""]
+        (self.out_dir / SUMMARY_FILE).write_text("\n".join(summary), encoding="utf-8")
+        logger.info("Profile written to %s", self.out_dir)
+
+
+_PROFILER: ContextVar[Optional[StageProfiler]] = ContextVar(
+    "stage_profiler", default=None
+)
+
+
+@contextmanager
+def use_profiler(profiler: StageProfiler) -> Iterator[StageProfiler]:
+    """
+    Profile the stages of a block
+    :param profiler: Stage profiler
+    """
+    token = _PROFILER.set(profiler)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _PROFILER.reset(token)
+
+
+@contextmanager
+def profile_stage(name: str, subprocess: bool = False) -> Iterator[None]:
+    """
+    Count a block for a stage of the profiler in use, if any
+    :param name: Stage name
+    :param subprocess: True if the stage runs a subprocess
+    """
+    profiler = _PROFILER.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name, subprocess):
+        yield
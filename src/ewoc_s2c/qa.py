@@ -0,0 +1,89 @@
+""" EWoC Sen2Cor ARD quality statistics module"""
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    from nptyping import NDArray
+
+logger = logging.getLogger(__name__)
+
+# Coarse histogram: 32 bins of 512 for the reflectances (the last one gets
+# everything above 15872), of 8 for the uint8 masks
+HISTOGRAM_BINS = 32
+HISTOGRAM_BIN_WIDTH = 512
+# Rows counted together, the indices of np.bincount are cast to intp
+CHUNK_ROWS = 64
+
+
+def _value_counts(array: "NDArray[Any]") -> "NDArray[Any]":
+    """
+    Count the pixels of each value of an array, by chunks of rows
+    :param array: uint8 or uint16 array (rows, cols)
+    :return: Number of pixels of each value of the dtype
+    """
+    import numpy as np
+
+    nb_values = np.iinfo(array.dtype).max + 1
+    counts = np.zeros(nb_values, dtype=np.int64)
+    for row in range(0, array.shape[0], CHUNK_ROWS):
+        counts += np.bincount(
+            array[row : row + CHUNK_ROWS].ravel(), minlength=nb_values
+        )
+    return counts
+
+
+def band_stats(band: "NDArray[Any]", nodata: Optional[int]) -> Dict[str, str]:
+    """
+    Compute the statistics of the valid pixels of a band in one pass: the
+    pixels of each value are counted and everything is derived from the
+    counts. The GDAL STATISTICS_* band tags are read by GDAL and the GIS
+    tools without decoding the pixels.
+    :param band: uint8 or uint16 band array (rows, cols)
+    :param nodata: Nodata value, None if all the pixels are valid
+    :return: Band tags: STATISTICS_MINIMUM, STATISTICS_MAXIMUM,
+     STATISTICS_MEAN, STATISTICS_STDDEV, STATISTICS_VALID_PERCENT, VALID_COUNT,
+     HISTOGRAM (counts of the valid pixels by bin) and HISTOGRAM_BIN_WIDTH
+    """
+    import numpy as np
+
+    counts = _value_counts(band)
+    if nodata is not None:
+        counts[nodata] = 0
+    count = int(counts.sum())
+    width = min(HISTOGRAM_BIN_WIDTH, counts.size // HISTOGRAM_BINS)
+    histogram = np.add.reduceat(counts, np.arange(HISTOGRAM_BINS) * width)
+    tags = {
+        "VALID_COUNT": str(count),
+        "STATISTICS_VALID_PERCENT": f"{100 * count / max(band.size, 1):.4f}",
+        "HISTOGRAM": ",".join(str(nb) for nb in histogram),
+        "HISTOGRAM_BIN_WIDTH": str(width),
+    }
+    if count:
+        # Exact integer sums, 65535**2 * 120M pixels fits in 64 bits
+        values = np.arange(counts.size, dtype=np.int64)
+        mean = int(counts @ values) / count
+        variance = int(counts @ (values * values)) / count - mean * mean
+        present = np.flatnonzero(counts)
+        tags.update(
+            STATISTICS_MINIMUM=str(present[0]),
+            STATISTICS_MAXIMUM=str(present[-1]),
+            STATISTICS_MEAN=f"{mean:.4f}",
+            STATISTICS_STDDEV=f"{max(variance, 0) ** 0.5:.4f}",
+        )
+    return tags
+
+
+def scl_class_counts(scl: "NDArray[Any]") -> Dict[str, str]:
+    """
+    Count the pixels of each class of a SCL array
+    :param scl: SCL array (uint8)
+    :return: SCL_CLASS_COUNTS tag, class:count of the classes present
+    """
+    import numpy as np
+
+    counts = _value_counts(scl)
+    return {
+        "SCL_CLASS_COUNTS": ",".join(
+            f"{value}:{counts[value]}" for value in np.flatnonzero(counts)
+        )
+    }
@@ -0,0 +1,353 @@
+""" EWoC Sen2Cor ranged download module"""
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Parts of the files downloaded concurrently, all the files of a product
+# share the workers and the connection pool of the S3 client
+PART_SIZE = 16 * 1024 * 1024
+DOWNLOAD_WORKERS = 16
+CHUNK_SIZE = 1024 * 1024
+# Usual part sizes of the multipart uploads (MiB), to check the local files
+# against their multipart ETag
+ETAG_PART_MIB = (5, 8, 16, 32, 64, 100, 128)
+
+# Event stopping the downloads started in the current context
+_CANCEL: ContextVar[Optional[threading.Event]] = ContextVar(
+    "download_cancel", default=None
+)
+
+
+@contextmanager
+def use_cancel_event(cancel: threading.Event) -> Iterator[threading.Event]:
+    """
+    Stop the ranged downloads of the block when an event is set, they raise
+    CancelledError and can be resumed
+    :param cancel: Cancel event
+    """
+    token = _CANCEL.set(cancel)
+    try:
+        yield cancel
+    finally:
+        _CANCEL.reset(token)
+
+
+def local_etags(path: Path, etag: str) -> Set[str]:
+    """
+    Compute the S3 ETags a local file may have, with the number of parts of
+    the ETag of an object. The part size of a multipart ETag is unknown: the
+    usual part sizes (MiB multiples) giving that number of parts are tried,
+    in one read of the file
+    :param path: Local file
+    :param etag: Object ETag
+    :return: Candidate ETags (unquoted)
+    """
+    etag = etag.strip('"')
+    size = path.stat().st_size
+    if "-" in etag:
+        nb_parts = int(etag.split("-")[1])
+        smallest = math.ceil(size / nb_parts / CHUNK_SIZE) * CHUNK_SIZE
+        part_sizes = {
+            part_size
+            for part_size in [smallest] + [mib * CHUNK_SIZE for mib in ETAG_PART_MIB]
+            if part_size >= smallest and math.ceil(size / part_size) == nb_parts
+        }
+    else:
+        nb_parts, part_sizes = 1, {max(size, CHUNK_SIZE)}
+    # MD5 of each part, the parts are MiB multiples and the chunks 1 MiB
+    parts: Dict[int, List[Any]] = {part_size: [] for part_size in part_sizes}
+    offset = 0
+    with open(path, "rb") as local_file:
+        for chunk in iter(lambda: local_file.read(CHUNK_SIZE), b""):
+            for part_size, digests in parts.items():
+                if offset % part_size == 0:
+                    digests.append(hashlib.md5())
+                digests[-1].update(chunk)
+            offset += len(chunk)
+    if "-" not in etag:
+        return {
+            digests[0].hexdigest() if digests else hashlib.md5().hexdigest()
+            for digests in parts.values()
+        }
+    return {
+        hashlib.md5(b"".join(digest.digest() for digest in digests)).hexdigest()
+        + f"-{nb_parts}"
+        for digests in parts.values()
+    }
+
+
+class PartialFile:
+    """
+    File being downloaded by parts: the parts are written in place in
+    <file>.part and the completed ones recorded in <file>.part.json, so
+    that an interrupted download resumes with the missing parts if the
+    object did not change
+    """
+
+    def __init__(self, out_path: Path, size: int, etag: str, part_size: int) -> None:
+        """
+        :param out_path: Output file
+        :param size: Object size
+        :param etag: Object ETag
+        :param part_size: Part size in bytes
+        """
+        self.out_path = out_path
+        self.size = size
+        self.etag = etag
+        self.part_size = part_size
+        self.nb_parts = max(math.ceil(size / part_size), 1)
+        self.part_path = out_path.with_name(f"{out_path.name}.part")
+        self.state_path = out_path.with_name(f"{out_path.name}.part.json")
+        self.done: Set[int] = set()
+        self._lock = threading.Lock()
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+            if (state["etag"], state["size"], state["part_size"]) == (
+                etag,
+                size,
+                part_size,
+            ) and self.part_path.exists():
+                self.done = set(state["parts"])
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+        if self.done:
+            logger.info(
+                "Resuming %s: %s/%s parts", out_path.name, len(self.done), self.nb_parts
+            )
+        self._fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT)
+        os.ftruncate(self._fd, size)
+
+    def missing_parts(self) -> List[int]:
+        """
+        Get the parts to download
+        :return: Part indices
+        """
+        return [index for index in range(self.nb_parts) if index not in self.done]
+
+    def part_range(self, index: int) -> Tuple[int, int]:
+        """
+        Get the byte range of a part
+        :param index: Part index
+        :return: First and last byte (inclusive)
+        """
+        start = index * self.part_size
+        return start, min(start + self.part_size, self.size) - 1
+
+    def write(self, offset: int, data: bytes) -> None:
+        """
+        Write data of a part
+        :param offset: Position in the file
+        :param data: Bytes
+        """
+        while data:
+            written = os.pwrite(self._fd, data, offset)
+            offset += written
+            data = data[written:]
+
+    def part_done(self, index: int) -> bool:
+        """
+        Record a completed part
+        :param index: Part index
+        :return: True if all the parts are downloaded
+        """
+        with self._lock:
+            self.done.add(index)
+            tmp_file = self.state_path.with_suffix(".tmp")
+            tmp_file.write_text(
+                json.dumps(
+                    {
+                        "etag": self.etag,
+                        "size": self.size,
+                        "part_size": self.part_size,
+                        "parts": sorted(self.done),
+                    }
+                ),
+                encoding="utf-8",
+            )
+            os.replace(tmp_file, self.state_path)
+            return len(self.done) == self.nb_parts
+
+    def close(self) -> None:
+        """Close the part file, the download can be resumed"""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def finish(self) -> None:
+        """Check the downloaded file and move it to its final name"""
+        self.close()
+        size = self.part_path.stat().st_size
+        if size != self.size:
+            raise ValueError(f"{self.out_path.name} has {size} bytes, not {self.size}")
+        # The ETag of an object uploaded in one part is its MD5
+        md5 = self.etag.strip('"')
+        if md5 and "-" not in md5:
+            digest = hashlib.md5()
+            with open(self.part_path, "rb") as part_file:
+                for chunk in iter(lambda: part_file.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            if digest.hexdigest() != md5:
+                self.part_path.unlink()
+                self.state_path.unlink(missing_ok=True)
+                raise ValueError(f"{self.out_path.name} has a wrong MD5 checksum")
+        os.replace(self.part_path, self.out_path)
+        self.state_path.unlink(missing_ok=True)
+
+
+class RangedDownloader:
+    """
+    Download S3 objects by byte ranges: the parts of all the files are
+    downloaded concurrently over the connection pool of one S3 client
+    """
+
+    def __init__(
+        self,
+        s3_client: Any,
+        max_workers: int = DOWNLOAD_WORKERS,
+        part_size: int = PART_SIZE,
+    ) -> None:
+        """
+        :param s3_client: boto3 S3 client, its max_pool_connections should be
+         at least max_workers
+        :param max_workers: Number of parts downloaded in parallel
+        :param part_size: Part size in bytes
+        """
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+        self.part_size = part_size
+        self.cancel = _CANCEL.get()
+
+    def _check_cancel(self) -> None:
+        """Raise CancelledError if the downloads are cancelled"""
+        if self.cancel is not None and self.cancel.is_set():
+            raise CancelledError("Download cancelled")
+
+    def _open(
+        self, item: Tuple[str, str, Path], extra_args: Dict[str, str]
+    ) -> Optional[PartialFile]:
+        """
+        Prepare the download of an object
+        :param item: Bucket, key and output file
+        :param extra_args: Extra arguments of the S3 requests (RequestPayer)
+        :return: Partial file, None if the file is already downloaded
+        """
+        bucket, key, out_path = item
+        head = self.s3_client.head_object(Bucket=bucket, Key=key, **extra_args)
+        etag = head.get("ETag", "")
+        if out_path.exists() and out_path.stat().st_size == head["ContentLength"]:
+            if not etag or etag.strip('"') in local_etags(out_path, etag):
+                logger.debug("%s already downloaded", out_path.name)
+                return None
+            logger.warning("%s differs from its object, downloaded again", out_path)
+        partial = PartialFile(out_path, head["ContentLength"], etag, self.part_size)
+        if not partial.missing_parts():
+            # Interrupted after its last part, before it was checked and renamed
+            partial.finish()
+            return None
+        return partial
+
+    def _get_part(
+        self,
+        item: Tuple[str, str, Path],
+        partial: PartialFile,
+        index: int,
+        extra_args: Dict[str, str],
+    ) -> None:
+        """
+        Download a part of an object, the last part completes the file
+        :param item: Bucket, key and output file
+        :param partial: Partial file
+        :param index: Part index
+        :param extra_args: Extra arguments of the S3 requests
+        """
+        bucket, key, _ = item
+        if partial.size:
+            start, end = partial.part_range(index)
+            # The parts of a resumed file must come from the same object
+            if_match = {"IfMatch": partial.etag} if partial.etag else {}
+            response = self.s3_client.get_object(
+                Bucket=bucket,
+                Key=key,
+                Range=f"bytes={start}-{end}",
+                **if_match,
+                **extra_args,
+            )
+            for chunk in response["Body"].iter_chunks(CHUNK_SIZE):
+                self._check_cancel()
+                partial.write(start, chunk)
+                start += len(chunk)
+            if start != end + 1:
+                raise ValueError(f"Truncated part {index} of {key}")
+        if partial.part_done(index):
+            partial.finish()
+
+    def download(
+        self,
+        items: Iterable[Tuple[str, str, Path]],
+        extra_args: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """
+        Download objects, the files already downloaded are skipped and the
+        partial files resumed
+        :param items: Bucket, key and output file of each object
+        :param extra_args: Extra arguments of the S3 requests (RequestPayer)
+        :return: Number of bytes of the files
+        """
+        extra_args = extra_args or {}
+        items = list(items)
+        start = time.perf_counter()
+        partials: List[Optional[PartialFile]] = []
+        failed = threading.Event()
+
+        def _get_part(part: Tuple[Tuple[str, str, Path], PartialFile, int]) -> None:
+            # The queued parts are dropped after an error, the download resumes
+            if failed.is_set():
+                return
+            try:
+                self._check_cancel()
+                self._get_part(*part, extra_args)
+            except Exception:
+                failed.set()
+                raise
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                partials = list(
+                    executor.map(lambda item: self._open(item, extra_args), items)
+                )
+                # Largest files first, their parts are spread over the workers
+                parts = sorted(
+                    (
+                        (item, partial, index)
+                        for item, partial in zip(items, partials)
+                        if partial is not None
+                        for index in partial.missing_parts()
+                    ),
+                    key=lambda part: -part[1].size,
+                )
+                # Raise the first download error
+                list(executor.map(_get_part, parts))
+        finally:
+            for partial in partials:
+                if partial is not None:
+                    partial.close()
+        nb_bytes = sum(item[2].stat().st_size for item in items)
+        logger.info(
+            "Downloaded %s files (%.1f MB) in %.1fs",
+            len(items),
+            nb_bytes / 1e6,
+            time.perf_counter() - start,
+        )
+        return nb_bytes
@@ -0,0 +1,105 @@
+""" EWoC Sen2Cor run report module"""
+import fcntl
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def append_run_report(report_file: Path, record: Dict[str, Any]) -> None:
+    """
+    Append the record of a product to a JSON lines run report, the file can
+    be shared by several processes
+    :param report_file: Run report file
+    :param record: Product record
+    """
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_file, "a", encoding="utf-8") as report:
+        fcntl.flock(report, fcntl.LOCK_EX)
+        report.write(json.dumps(record) + "\n")
+    logger.debug("Added %s to %s", record.get("pid"), report_file)
+
+
+def read_run_report(report_file: Path) -> List[Dict[str, Any]]:
+    """
+    Read the records of a run report, truncated lines are ignored
+    :param report_file: Run report file
+    :return: Product records
+    """
+    records = []
+    for line in report_file.read_text(encoding="utf-8").splitlines():
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return records
+
+
+def prediction_summary(durations: List[Tuple[float, float]]) -> Dict[str, float]:
+    """
+    Compare the predicted and actual processing times of products
+    :param durations: Predicted and actual seconds of each product
+    :return: Number of products, total predicted and actual seconds, mean
+     absolute error in seconds and relative to the actual time
+    """
+    if not durations:
+        return {"products": 0}
+    errors = [abs(predicted - actual) for predicted, actual in durations]
+    relative = [
+        error / actual for error, (_, actual) in zip(errors, durations) if actual > 0
+    ]
+    return {
+        "products": len(durations),
+        "predicted": round(sum(predicted for predicted, _ in durations), 1),
+        "actual": round(sum(actual for _, actual in durations), 1),
+        "mean_error": round(sum(errors) / len(errors), 1),
+        "mean_relative_error": round(sum(relative) / max(len(relative), 1), 3),
+    }
+
+
+def batch_report(
+    jobs: List[Dict[str, Any]], report_file: Optional[Path] = None
+) -> Dict[str, Any]:
+    """
+    Consolidate the state of the jobs of a queue and the run report records
+    :param jobs: Job records of the queue (see the jobs method of the queues)
+    :param report_file: Run report written by the workers
+    :return: Summary (jobs by status, done jobs and time by worker, predicted
+     versus actual time of the scheduled products) and the product records
+    """
+    products = {}
+    if report_file is not None and report_file.exists():
+        # Last outcome of each product: done, skipped or empty
+        products = {record["pid"]: record for record in read_run_report(report_file)}
+    by_status: Dict[str, int] = {}
+    by_worker: Dict[str, Dict[str, float]] = {}
+    records = []
+    durations = []
+    for job in jobs:
+        record = dict(job)
+        outcome = products.get(job["pid"]) or products.get(f"{job['pid']}.SAFE")
+        if job["status"] == "done" and outcome is not None:
+            record.update(
+                status=outcome["status"],
+                metadata=outcome.get("metadata"),
+                reasons=outcome.get("reasons"),
+            )
+            if outcome.get("predicted_seconds") is not None:
+                record["predicted_seconds"] = outcome["predicted_seconds"]
+                durations.append((outcome["predicted_seconds"], outcome["seconds"]))
+        by_status[record["status"]] = by_status.get(record["status"], 0) + 1
+        if job.get("worker") and job["status"] in ("done", "failed"):
+            worker = by_worker.setdefault(job["worker"], {"jobs": 0, "seconds": 0.0})
+            worker["jobs"] += 1
+            worker["seconds"] += job.get("seconds") or 0.0
+        records.append(record)
+    summary: Dict[str, Any] = {
+        "jobs": len(jobs),
+        "status": by_status,
+        "workers": by_worker,
+    }
+    if durations:
+        summary["durations"] = prediction_summary(durations)
+    return {"summary": summary, "products": records}
@@ -0,0 +1,241 @@
+""" EWoC Sen2Cor product id resolution module"""
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PID_CACHE_FILE = Path(
+    os.getenv("EWOC_S2C_PID_CACHE", Path.home() / ".cache/ewoc_s2c/pid_cache.json")
+)
+# Weight of the last download in the rolling latency of a source
+LATENCY_SMOOTHING = 0.3
+# Number of products whose known-good id variant is kept per source, the
+# least recently resolved products are dropped first
+MAX_KNOWN_PRODUCTS = 10000
+# S3 error codes of a missing object (also raised through ewoc_dag), the
+# other errors are not a miss
+NOT_FOUND_CODES = ("404", "NoSuchKey", "NotFound")
+
+
+class ProductNotFoundError(Exception):
+    """The product id does not exist on the data source"""
+
+
+def pid_variants(pid: str) -> Dict[str, str]:
+    """
+    Get the ids under which a product can be archived
+    :param pid: Sentinel-2 product id
+    :return: Variant name (acquisition/production) to product id
+    """
+    date_acq = pid.split("_")[2][:8]
+    date_end = pid.split("_")[-1][:8]
+    variants = {"acquisition": pid}
+    if date_acq != date_end:
+        variants["production"] = pid.replace(date_acq, date_end)
+    return variants
+
+
+def is_not_found(err: Exception) -> bool:
+    """
+    Check if a download error means that the product id does not exist
+    :param err: Error raised by the download
+    :return: False for the credential, network... errors
+    """
+    from botocore.exceptions import ClientError
+
+    if isinstance(err, ProductNotFoundError):
+        return True
+    if isinstance(err, ClientError):
+        return err.response.get("Error", {}).get("Code") in NOT_FOUND_CODES
+    return False
+
+
+@contextmanager
+def _locked_cache(cache_file: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Open the resolution cache for update, the file is locked and
+    replaced atomically
+    :param cache_file: Path to the JSON cache file
+    """
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_file.with_suffix(".lock"), "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            cache = json.loads(cache_file.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            cache = {}
+        yield cache
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(cache, indent=1), encoding="utf-8")
+        os.replace(tmp_file, cache_file)
+
+
+def _source_entry(cache: Dict[str, Any], source_key: str) -> Dict[str, Any]:
+    """
+    Get (and create if needed) the cache entry of a source
+    :param cache: Resolution cache
+    :param source_key: Source identifier
+    :return: Source entry
+    """
+    entry = cache.setdefault("sources", {}).setdefault(
+        source_key, {"products": {}, "latency": {"count": 0, "total": 0.0}}
+    )
+    # Variant hits by platform of the previous caches
+    entry.pop("hits", None)
+    entry.setdefault("products", {})
+    return entry
+
+
+def ordered_variants(
+    pid: str, source_key: str, cache_file: Path = PID_CACHE_FILE
+) -> List[Tuple[str, str]]:
+    """
+    Order the product id variants, known-good first
+    :param pid: Sentinel-2 product id
+    :param source_key: Source identifier
+    :param cache_file: Path to the JSON cache file
+    :return: List of (variant name, product id)
+    """
+    variants = pid_variants(pid)
+    try:
+        cache = json.loads(cache_file.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+    known = cache.get("sources", {}).get(source_key, {}).get("products", {}).get(pid)
+    return sorted(variants.items(), key=lambda variant: variant[0] != known)
+
+
+def resolve_s2_product(
+    pid: str,
+    fetch: Callable[[str], Path],
+    source: str,
+    cache_file: Path = PID_CACHE_FILE,
+) -> Path:
+    """
+    Get a product trying its id variants, known-good variant first. Only a
+    missing product makes the next variant tried, the other errors are
+    raised. The resolution latency is the time spent on the missing
+    variants before the download of the right one
+    :param pid: Sentinel-2 product id
+    :param fetch: Function downloading a product id, returns the product path
+    :param source: Sentinel-2 product data source
+    :param cache_file: Path to the JSON cache file
+    :return: Path returned by fetch
+    """
+    source_key = f"{source}:{pid.split('_')[1]}"
+    start = time.perf_counter()
+    for attempt, (variant, variant_pid) in enumerate(
+        ordered_variants(pid, source_key, cache_file), start=1
+    ):
+        fetch_start = time.perf_counter()
+        try:
+            prd_path = fetch(variant_pid)
+        except Exception as err:  # pylint: disable=broad-except
+            if not is_not_found(err):
+                logger.error(
+                    "Download of %s from %s failed: %r", variant_pid, source, err
+                )
+                raise
+            logger.info(
+                "The product %s is not found on %s using %s date: %s",
+                variant_pid,
+                source,
+                variant,
+                err,
+            )
+            continue
+        latency = fetch_start - start
+        with _locked_cache(cache_file) as cache:
+            entry = _source_entry(cache, source_key)
+            # Re-inserted to be the most recently resolved product
+            entry["products"].pop(pid, None)
+            entry["products"][pid] = variant
+            for old_pid in list(entry["products"])[:-MAX_KNOWN_PRODUCTS]:
+                del entry["products"][old_pid]
+            entry["latency"]["count"] += 1
+            entry["latency"]["total"] += latency
+            mean_latency = entry["latency"]["total"] / entry["latency"]["count"]
+        logger.info(
+            "Resolved %s on %s with %s date in %.2fs (%s attempts, mean %.2fs),"
+            " downloaded in %.2fs",
+            pid,
+            source,
+            variant,
+            latency,
+            attempt,
+            mean_latency,
+            time.perf_counter() - fetch_start,
+        )
+        return prd_path
+    logger.error("The product %s is not found", pid)
+    raise ValueError(f"The product {pid} is not found")
+
+
+def resolution_stats(
+    cache_file: Optional[Path] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Get the resolution statistics recorded for each source
+    :param cache_file: Path to the JSON cache file
+    :return: Source to number of resolutions, mean resolution latency and
+     number of products with a known-good variant
+    """
+    try:
+        cache = json.loads((cache_file or PID_CACHE_FILE).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {
+        source_key: {
+            "count": entry["latency"]["count"],
+            "mean_latency": entry["latency"]["total"]
+            / max(entry["latency"]["count"], 1),
+            "known": len(entry.get("products", {})),
+        }
+        for source_key, entry in cache.get("sources", {}).items()
+    }
+
+
+def record_source_fetch(
+    source_key: str, seconds: float, success: bool, cache_file: Path = PID_CACHE_FILE
+) -> None:
+    """
+    Update the health of a source after a download: rolling latency of the
+    successful downloads and number of failures since the last success
+    :param source_key: Source identifier (source:product type)
+    :param seconds: Download time
+    :param success: False if the download failed
+    :param cache_file: Path to the JSON cache file
+    """
+    with _locked_cache(cache_file) as cache:
+        health = cache.setdefault("health", {}).setdefault(
+            source_key, {"latency": None, "fetches": 0, "failures": 0}
+        )
+        if success:
+            if health["latency"] is not None:
+                seconds = (1 - LATENCY_SMOOTHING) * health[
+                    "latency"
+                ] + LATENCY_SMOOTHING * seconds
+            health.update(latency=seconds, fetches=health["fetches"] + 1, failures=0)
+        else:
+            health.update(failures=health["failures"] + 1, failed_at=time.time())
+
+
+def source_health(cache_file: Optional[Path] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Get the health recorded for each source
+    :param cache_file: Path to the JSON cache file
+    :return: Source identifier to rolling latency (None before the first
+     success), number of successful downloads, failures since the last
+     success and time of the last failure (failed_at)
+    """
+    try:
+        cache = json.loads((cache_file or PID_CACHE_FILE).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return cache.get("health", {})
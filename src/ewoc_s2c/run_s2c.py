@@ -1,27 +1,156 @@
 """ EWoC Sen2Cor processor CLI"""
 import logging
-import os
 from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
 
 import click
-from ewoc_dag.eo_prd_id.s2_prd_id import S2PrdIdInfo
-from ewoc_dag.s2_dag import get_s2_product
-
-from ewoc_s2c.utils import (
-    clean,
-    custom_s2c_dem,
-    edit_xml_config_file,
-    ewoc_s3_upload,
-    l2a_to_ard,
-    l2a_to_ard_aws_cog,
-    make_tmp_dirs,
-    run_s2c,
-    set_logger,
-    unlink,
-)
+
+from ewoc_s2c.utils import set_logger
 
 logger = logging.getLogger(__name__)
 
+# Processing options of the products already on disk: no download, cache,
+# pre-flight check nor upload
+LOCAL_OPTIONS = (
+    "data_source",
+    "dem_type",
+    "only_scl",
+    "ard_layout",
+    "interleave",
+    "min_valid_fraction",
+    "stream",
+    "run_report",
+)
+
+
+def processing_options(
+    func: Callable, names: Optional[Tuple[str, ...]] = None
+) -> Callable:
+    """
+    Add the product processing options to a command
+    :param func: Command function
+    :param names: Options to add, None for all of them
+    :return: Decorated function
+    """
+    options = {
+        "production_id": click.option(
+            "--production_id",
+            default="0000",
+            help="Production ID that will be used to upload to s3 bucket. "
+            "Default: 0000",
+        ),
+        "data_source": click.option("-ds", "--data_source", default="creodias"),
+        "dem_type": click.option(
+            "-dem",
+            "--dem_type",
+            default="srtm",
+            help="DEM that will be used in the process",
+        ),
+        "only_scl": click.option("-sc", "--only_scl", default=False, is_flag=True),
+        "datacube_dir": click.option(
+            "--datacube_dir",
+            type=click.Path(path_type=Path),
+            default=None,
+            help="Also append the ARD to the per-tile Zarr datacubes of this folder",
+        ),
+        "ard_layout": click.option(
+            "--ard_layout",
+            type=click.Choice(["band", "stacked"]),
+            default="band",
+            help="One ARD file per band or one multi-band ARD file per resolution",
+        ),
+        "interleave": click.option(
+            "--interleave",
+            type=click.Choice(["pixel", "band"]),
+            default="pixel",
+            help="Interleaving of the stacked ARD files",
+        ),
+        "ard_sink": click.option(
+            "--ard_sink",
+            type=click.Choice(["local", "s3"]),
+            default="local",
+            help="Write the ARD on the local disk then upload it, "
+            "or directly to the ARD bucket",
+        ),
+        "stream": click.option(
+            "--stream",
+            is_flag=True,
+            help="Convert the bands completed by Sen2Cor while it runs",
+        ),
+        "l2a_cache_dir": click.option(
+            "--l2a_cache_dir",
+            type=click.Path(path_type=Path),
+            default=None,
+            help="Reuse the Sen2Cor outputs stored in this folder",
+        ),
+        "l2a_cache_size": click.option(
+            "--l2a_cache_size",
+            default=100.0,
+            help="Maximum size in GB of the Sen2Cor output cache",
+        ),
+        "l1c_cache_dir": click.option(
+            "--l1c_cache_dir",
+            type=click.Path(path_type=Path),
+            default=None,
+            help="Share the downloaded L1C products between runs in this folder",
+        ),
+        "l1c_cache_size": click.option(
+            "--l1c_cache_size",
+            default=200.0,
+            help="Maximum size in GB of the L1C product cache",
+        ),
+        "min_valid_fraction": click.option(
+            "--min_valid_fraction",
+            type=click.FloatRange(0, 1),
+            default=0.0,
+            help="Skip the products with a smaller fraction of valid pixels "
+            "(from the SCL)",
+        ),
+        "max_cloud_cover": click.option(
+            "--max_cloud_cover",
+            type=click.FloatRange(0, 100),
+            default=None,
+            help="Pre-flight check: maximum cloud cover (%) of the product metadata",
+        ),
+        "max_nodata": click.option(
+            "--max_nodata",
+            type=click.FloatRange(0, 100),
+            default=None,
+            help="Pre-flight check: maximum nodata pixels (%) of the product metadata",
+        ),
+        "min_baseline": click.option(
+            "--min_baseline",
+            default=None,
+            help="Pre-flight check: minimum processing baseline (ex: 0400)",
+        ),
+        "preflight_action": click.option(
+            "--preflight_action",
+            type=click.Choice(["skip", "flag"]),
+            default="skip",
+            help="Skip the products failing the pre-flight checks, or process "
+            "them and flag them in the run report",
+        ),
+        "run_report": click.option(
+            "--run_report",
+            type=click.Path(path_type=Path),
+            default=None,
+            help="Add the outcome of each product to this JSON lines file",
+        ),
+    }
+    for name, option in reversed(options.items()):
+        if names is None or name in names:
+            func = option(func)
+    return func
+
+
+def local_options(func: Callable) -> Callable:
+    """
+    Add the processing options of the products on disk to a command
+    :param func: Command function
+    :return: Decorated function
+    """
+    return processing_options(func, LOCAL_OPTIONS)
+
 
 @click.group()
 @click.option(
@@ -30,7 +159,8 @@ logger = logging.getLogger(__name__)
     help="Set verbosity level: v for info, vv for debug",
     required=False,
 )
-def cli(verbose):
+@click.pass_context
+def cli(ctx, verbose):
     """
     CLI
     :param verbose: verbose level
@@ -38,186 +168,275 @@ def cli(verbose):
     """
     click.secho("Run sen2cor", fg="green", bold=True)
     set_logger(verbose)
+    ctx.obj = {"verbose": verbose}
 
 
 @cli.command("s2c_id", help="Sen2cor for on product using EOdag ID")
 @click.option("-p", "--pid", help="S2 L1C product ID")
 @click.option(
-    "--production_id",
-    default="0000",
-    help="Production ID that will be used to upload to s3 bucket. " "Default: 0000",
+    "--profile_dir",
+    type=click.Path(path_type=Path),
+    default=None,
+    help="Profile the processing stages and write the collapsed stacks and "
+    "the hot functions of each stage to this folder",
 )
-@click.option("-ds", "--data_source", default="creodias")
-@click.option(
-    "-dem", "--dem_type", default="srtm", help="DEM that will be used in the process"
-)
-@click.option("-sc", "--only_scl", default=False, is_flag=True)
+@processing_options
 def run_id(
-    pid: str,
-    production_id: str,
-    data_source: str,
-    dem_type: str,
-    only_scl: bool = False,
+    pid: str, profile_dir: Optional[Path], production_id: str, **params: Any
 ) -> None:
     """
     Run Sen2Cor with a product ID
     :param pid: Sentinel-2 product identifier
-    :param l2a_dir: Output folder
+    :param profile_dir: Folder of the stage profiles, None to disable profiling
     :param production_id: Special identifier
-    :param data_source: Sentinel-2 product data source
-    :param dem_type: DEM type
-    :param only_scl: True to process scl only
-    :param no_sen2cor: Download directly, no local atmospheric correction
+    :param params: Processing options, see ewoc_s2c.pipeline.ProcessingOptions
+    :return: None
+    """
+    from ewoc_s2c.pipeline import ProcessingOptions, process_product
+
+    options = ProcessingOptions(**params)
+    if profile_dir is None:
+        process_product(pid, production_id, options)
+        return
+    from ewoc_s2c.profiling import SUMMARY_FILE, StageProfiler, use_profiler
+
+    with use_profiler(StageProfiler(profile_dir)):
+        process_product(pid, production_id, options)
+    click.echo((profile_dir / SUMMARY_FILE).read_text(encoding="utf-8"))
+
+
+@cli.command("s2c_dir", help="Sen2cor and ARD for the SAFE products of a folder")
+@click.option(
+    "-i",
+    "--input_dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    required=True,
+    help="Folder tree with L1C and L2A SAFE products",
+)
+@click.option(
+    "-o",
+    "--out_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="ARD root folder. Default: next to each product",
+)
+@click.option("-c", "--concurrency", default=1, help="Number of worker processes")
+@click.option(
+    "--overwrite", is_flag=True, help="Convert again the products with an ARD"
+)
+@click.option(
+    "--duration_history",
+    type=click.Path(path_type=Path),
+    multiple=True,
+    help="Run reports of past runs predicting the processing time of the products",
+)
+@local_options
+@click.pass_context
+def run_dir(
+    ctx: click.Context,
+    input_dir: Path,
+    out_dir: Optional[Path],
+    concurrency: int,
+    overwrite: bool,
+    duration_history: Tuple[Path, ...],
+    **params: Any,
+) -> None:
+    """
+    Run Sen2Cor and convert to ARD the products of a folder, offline
+    :param input_dir: Folder tree with SAFE products
+    :param out_dir: ARD root folder, None to write the ARD next to the products
+    :param concurrency: Number of worker processes
+    :param overwrite: True to convert again the products which have an ARD
+    :param duration_history: Run report files predicting the processing time
+     of the products, submitted longest first
+    :param params: Processing options, see ewoc_s2c.pipeline.ProcessingOptions
+    :return: None
+    """
+    from ewoc_s2c.ingest import ingest_dir
+
+    counts = ingest_dir(
+        input_dir,
+        out_dir,
+        concurrency=concurrency,
+        overwrite=overwrite,
+        verbose=ctx.obj["verbose"],
+        duration_history=duration_history,
+        **params,
+    )
+    click.echo(" | ".join(f"{status}: {nb}" for status, nb in counts.items()))
+
+
+@cli.command("enqueue", help="Add products to a job queue")
+@click.option("-q", "--queue", "queue_url", required=True, help="Job queue URL")
+@click.option("-p", "--pid", "pids", multiple=True, help="S2 product ID")
+@click.option(
+    "--pid_file",
+    type=click.Path(exists=True, path_type=Path),
+    help="Text file with one S2 product ID per line",
+)
+@click.option(
+    "--duration_history",
+    type=click.Path(path_type=Path),
+    multiple=True,
+    help="Run reports of past campaigns: the products are claimed longest first",
+)
+@processing_options
+def enqueue(
+    queue_url: str,
+    pids: Tuple[str, ...],
+    pid_file: Optional[Path],
+    duration_history: Tuple[Path, ...],
+    **params: Any,
+) -> None:
+    """
+    Add products to a job queue
+    :param queue_url: sqlite:///path/to/queue.db, redis://host:port/db?name=queue
+     or file:///shared/folder
+    :param pids: Sentinel-2 product identifiers
+    :param pid_file: File with one Sentinel-2 product identifier per line
+    :param duration_history: Run report files whose durations predict the
+     processing time of the products, the job priority
+    :param params: Production id and processing options, see
+     ewoc_s2c.pipeline.ProcessingOptions
     :return: None
     """
+    from ewoc_s2c.durations import DurationModel
+    from ewoc_s2c.jobqueue import open_queue
+    from ewoc_s2c.pipeline import PATH_OPTIONS
+
+    all_pids = list(pids)
+    if pid_file is not None:
+        all_pids += [
+            line.strip()
+            for line in pid_file.read_text(encoding="utf-8").splitlines()
+            if line.strip()
+        ]
+    for path_param in PATH_OPTIONS:
+        if params[path_param] is not None:
+            params[path_param] = str(params[path_param])
+    queue = open_queue(queue_url)
+    if not duration_history:
+        for pid in all_pids:
+            queue.put(pid, params)
+        click.echo(f"Added {len(all_pids)} products to {queue_url}")
+        return
+    # Longest first: the workers pulling the jobs pack them as LPT
+    model = DurationModel.from_reports(duration_history)
+    total = 0.0
+    for pid in all_pids:
+        predicted = model.predict(pid, params["only_scl"], params["data_source"])
+        queue.put(pid, {**params, "predicted_seconds": predicted}, priority=predicted)
+        total += predicted
+    click.echo(
+        f"Added {len(all_pids)} products to {queue_url}, "
+        f"{total / 3600:.1f} predicted hours"
+    )
+
+
+@cli.command("serve", help="Process the products of a job queue")
+@click.option("-q", "--queue", "queue_url", required=True, help="Job queue URL")
+@click.option("-c", "--concurrency", default=1, help="Number of worker processes")
+@click.option(
+    "--visibility_timeout",
+    default=3600.0,
+    help="Seconds before a job claimed by a dead worker is processed again",
+)
+@click.option("--drain", is_flag=True, help="Stop when the queue is empty")
+@click.option("--max_attempts", default=3, help="Attempts before a job fails")
+@click.option("--poll_interval", default=10.0, help="Seconds between queue polls")
+@click.pass_context
+def serve_queue(
+    ctx: click.Context,
+    queue_url: str,
+    concurrency: int,
+    visibility_timeout: float,
+    drain: bool,
+    max_attempts: int,
+    poll_interval: float,
+) -> None:
+    """
+    Process the products of a job queue with long-lived workers
+    :param queue_url: sqlite:///path/to/queue.db, redis://host:port/db?name=queue
+     or file:///shared/folder
+    :param concurrency: Number of worker processes
+    :param visibility_timeout: Seconds before a claimed job is visible again
+    :param drain: True to stop when the queue is empty
+    :param max_attempts: Number of attempts before a job is marked as failed
+    :param poll_interval: Seconds between two polls of an empty queue
+    :return: None
+    """
+    from ewoc_s2c.jobqueue import open_queue
+    from ewoc_s2c.worker import serve
+
+    counts = serve(
+        open_queue(queue_url),
+        concurrency=concurrency,
+        visibility_timeout=visibility_timeout,
+        drain=drain,
+        max_attempts=max_attempts,
+        poll_interval=poll_interval,
+        verbose=ctx.obj["verbose"],
+    )
+    click.echo(
+        f"Done: {counts['done']} | Failed: {counts['failed']} | "
+        f"Abandoned: {counts['abandoned']}"
+    )
+
+
+@cli.command("batch_report", help="Consolidated report of a job queue")
+@click.option("-q", "--queue", "queue_url", required=True, help="Job queue URL")
+@click.option(
+    "--run_report",
+    type=click.Path(path_type=Path),
+    default=None,
+    help="Run report written by the workers (--run_report of enqueue)",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(path_type=Path),
+    default=None,
+    help="Write the report of every product to this JSON file",
+)
+def batch_report_cmd(
+    queue_url: str, run_report: Optional[Path], output: Optional[Path]
+) -> None:
+    """
+    Report the state of the products of a job queue
+    :param queue_url: Job queue URL
+    :param run_report: Run report file written by the workers
+    :param output: JSON output file
+    :return: None
+    """
+    import json
+
+    from ewoc_s2c.jobqueue import open_queue
+    from ewoc_s2c.report import batch_report
 
-    l2a_dir = Path("/work/SEN2TEST/OUT/")
-    if os.path.exists(l2a_dir):
-        clean(l2a_dir)
-        logger.info("Cleared %s", l2a_dir)
-    l2a_dir.mkdir(exist_ok=False, parents=True)
-    upload_dir = l2a_dir / "upload"
-    upload_dir.mkdir(exist_ok=True, parents=True)
-    if not pid.endswith(".SAFE"):
-        pid += ".SAFE"
-    if S2PrdIdInfo.is_l2a(pid):
-        if data_source == "aws":
-            # Only aws cog option supported in full
-            try:
-                l2a_folder = get_s2_product(
-                    pid,
-                    l2a_dir,
-                    source=data_source,
-                    l2_mask_only=only_scl,
-                    aws_l2a_cogs=True)
-            except:
-                try:
-                    date_acq = pid.split('_')[2][:8]
-                    date_end = pid.split('_')[-1][:8]
-                    if date_acq!=date_end:
-                        pid_new = pid.replace(date_acq, date_end)
-                    logger.info("The product %s is not found using acquisition date %s. Try to use production date %s", pid, date_acq, date_end)
-                    l2a_folder = get_s2_product(
-                        pid_new,
-                        l2a_dir,
-                        source=data_source,
-                        l2_mask_only=only_scl,
-                        aws_l2a_cogs=True)
-                except:
-                    logger.error("The product %s is not found", pid)
-                    raise ValueError(f"The product {pid} is not found")
-            l2a_to_ard_aws_cog(l2a_folder, upload_dir, data_source, only_scl)
-            ewoc_s3_upload(upload_dir, production_id)
-        elif data_source == "aws_sng":
-            try:
-                l2a_folder = get_s2_product(
-                    pid,
-                    l2a_dir,
-                    source="aws",
-                    l2_mask_only=only_scl,
-                    aws_l2a_cogs=False)
-            except:
-                try:
-                    date_acq = pid.split('_')[2][:8]
-                    date_end = pid.split('_')[-1][:8]
-                    if date_acq!=date_end:
-                        pid_new = pid.replace(date_acq, date_end)
-                    logger.info("The product %s is not found using acquisition date %s. Try to use production date %s", pid, date_acq, date_end)
-                    l2a_folder = get_s2_product(
-                        pid_new,
-                        l2a_dir,
-                        source="aws",
-                        l2_mask_only=only_scl,
-                        aws_l2a_cogs=False)
-                except:
-                    logger.error("The product %s is not found", pid)
-                    raise ValueError(f"The product {pid} is not found")
-            logger.info("Product downloaded from Sinergise bucket")
-            l2a_to_ard(l2a_folder, upload_dir, pid, data_source, only_scl)
-            ewoc_s3_upload(upload_dir, production_id)
-        elif data_source == "creodias":
-            try:
-                l2a_folder = get_s2_product(
-                    pid,
-                    l2a_dir,
-                    source=data_source,
-                    l2_mask_only=only_scl)
-            except:
-                try:
-                    date_acq = pid.split('_')[2][:8]
-                    date_end = pid.split('_')[-1][:8]
-                    if date_acq!=date_end:
-                        pid_new = pid.replace(date_acq, date_end)
-                    logger.info("The product %s is not found using acquisition date %s. Try to use production date %s", pid, date_acq, date_end)
-                    l2a_folder = get_s2_product(
-                        pid_new,
-                        l2a_dir,
-                        source=data_source,
-                        l2_mask_only=only_scl)
-                except:
-                    logger.error("The product %s is not found", pid)
-                    raise ValueError(f"The product {pid} is not found")
-            l2a_to_ard(l2a_folder, upload_dir, pid, data_source, only_scl)
-            ewoc_s3_upload(upload_dir, production_id)
-        else:
-            logger.warning("%s is not supported (yet) for L2A ids", data_source)
-    else:
-        # Edit config file
-        edit_xml_config_file(dem_type)
-        # Download and create a DEM mosaic
-        tile = pid.split("_")[5][1:]
-        dem_tmp_dir, dem_syms = custom_s2c_dem(dem_type, tile)
-        out_dir_l1c, out_dir_l2a = make_tmp_dirs(l2a_dir)
-        # Get Sat product by id using ewoc_dag
-        if data_source == "aws_sng":
-            try:
-                l1c_safe_folder = get_s2_product(
-                    pid,
-                    out_dir_l1c,
-                    source='aws',
-                    aws_l1c_safe=True,
-                    aws_l2a_cogs=False)
-            except:
-                try:
-                    date_acq = pid.split('_')[2][:8]
-                    date_end = pid.split('_')[-1][:8]
-                    if date_acq!=date_end:
-                        pid_new = pid.replace(date_acq, date_end)
-                    logger.info("The product %s is not found using acquisition date %s. Try to use production date %s", pid, date_acq, date_end)
-                    l1c_safe_folder = get_s2_product(
-                        pid_new,
-                        out_dir_l1c,
-                        source='aws',
-                        aws_l1c_safe=True,
-                        aws_l2a_cogs=False)
-                except:
-                    logger.error("The product %s is not found", pid)
-                    raise ValueError(f"The product {pid} is not found")
-        else:
-            try:
-                l1c_safe_folder = get_s2_product(pid, out_dir_l1c, source=data_source)
-            except:
-                try:
-                    date_acq = pid.split('_')[2][:8]
-                    date_end = pid.split('_')[-1][:8]
-                    if date_acq!=date_end:
-                        pid_new = pid.replace(date_acq, date_end)
-                    logger.info("The product %s is not found using acquisition date %s. Try to use production date %s", pid, date_acq, date_end)
-                    l1c_safe_folder = get_s2_product(pid_new, out_dir_l1c, source=data_source)
-                except:
-                    logger.error("The product %s is not found", pid)
-                    raise ValueError(f"The product {pid} is not found")
-        # Run sen2cor in subprocess
-        l2a_safe_folder = run_s2c(l1c_safe_folder, out_dir_l2a, only_scl)
-        # Convert the sen2cor output to ewoc ard format
-        l2a_to_ard(l2a_safe_folder, upload_dir, pid, data_source, only_scl)
-        # Delete local folders
-        clean(out_dir_l2a)
-        clean(dem_tmp_dir)
-        unlink(dem_syms)
-        # Send to s3
-        ewoc_s3_upload(upload_dir, production_id)
+    report = batch_report(open_queue(queue_url).jobs(), run_report)
+    summary = report["summary"]
+    click.echo(
+        f"{summary['jobs']} jobs: "
+        + ", ".join(
+            f"{status} {nb}" for status, nb in sorted(summary["status"].items())
+        )
+    )
+    for worker, stats in sorted(summary["workers"].items()):
+        click.echo(f"{worker}: {stats['jobs']} jobs in {stats['seconds']:.0f}s")
+    if "durations" in summary:
+        durations = summary["durations"]
+        click.echo(
+            f"Predicted {durations['predicted']:.0f}s, "
+            f"actual {durations['actual']:.0f}s for {durations['products']} "
+            f"products, mean error {durations['mean_error']:.0f}s "
+            f"({durations['mean_relative_error']:.0%})"
+        )
+    for record in report["products"]:
+        if record["status"] == "failed":
+            click.echo(f"Failed {record['pid']}: {record.get('error')}")
+    if output is not None:
+        output.write_text(json.dumps(report, indent=1), encoding="utf-8")
 
 
 if __name__ == "__main__":
-    cli()
+    cli()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,142 @@
+""" EWoC Sen2Cor SAFE product integrity check module"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SAFE = "manifest.safe"
+# Checksum names of the manifest to hashlib algorithms
+CHECKSUM_ALGORITHMS = {"MD5": "md5", "SHA-256": "sha256", "SHA3-256": "sha3_256"}
+# Documentation and schemas, not read by Sen2Cor
+OPTIONAL_FOLDERS = ("HTML", "rep_info")
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ManifestFile(NamedTuple):
+    """File of a SAFE product listed in its manifest"""
+
+    path: str
+    size: Optional[int]
+    checksum_name: Optional[str]
+    checksum: Optional[str]
+
+
+def read_manifest(safe_dir: Path) -> List[ManifestFile]:
+    """
+    Read the files listed in the manifest of a SAFE product
+    :param safe_dir: SAFE folder
+    :return: Files of the data objects, paths relative to the SAFE folder
+    """
+    files = []
+    root = ET.parse(safe_dir / MANIFEST_SAFE).getroot()
+    for elt in root.iter():
+        if elt.tag.rsplit("}", 1)[-1] != "byteStream":
+            continue
+        location, checksum = None, None
+        for child in elt:
+            tag = child.tag.rsplit("}", 1)[-1]
+            if tag == "fileLocation":
+                location = child.get("href")
+            elif tag == "checksum":
+                checksum = child
+        if location is None:
+            continue
+        size = elt.get("size")
+        files.append(
+            ManifestFile(
+                os.path.normpath(location),
+                int(size) if size is not None else None,
+                checksum.get("checksumName") if checksum is not None else None,
+                (checksum.text or "").strip().lower() if checksum is not None else None,
+            )
+        )
+    return files
+
+
+def file_checksum(path: Path, algorithm: str) -> str:
+    """
+    Compute the checksum of a file
+    :param path: File
+    :param algorithm: hashlib algorithm
+    :return: Hex digest
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        # hashlib releases the GIL on large buffers, files are hashed in parallel
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_file(safe_dir: Path, entry: ManifestFile) -> Optional[str]:
+    """
+    Check a file of a SAFE product against its manifest entry
+    :param safe_dir: SAFE folder
+    :param entry: Manifest entry
+    :return: Problem found, None if the file is valid
+    """
+    path = safe_dir / entry.path
+    if not path.is_file():
+        if entry.path.split(os.sep)[0] in OPTIONAL_FOLDERS:
+            return None
+        return f"{entry.path} is missing"
+    size = path.stat().st_size
+    if entry.size is not None and size != entry.size:
+        return f"{entry.path} has {size} bytes instead of {entry.size}"
+    algorithm = CHECKSUM_ALGORITHMS.get(entry.checksum_name or "")
+    if algorithm is not None and file_checksum(path, algorithm) != entry.checksum:
+        return f"{entry.path} has a wrong {entry.checksum_name} checksum"
+    return None
+
+
+def check_safe(safe_dir: Path, max_workers: int = HASH_WORKERS) -> List[str]:
+    """
+    Check the files of a SAFE product against its manifest: presence, size
+    and checksum, the files are hashed in parallel
+    :param safe_dir: SAFE folder
+    :param max_workers: Number of files hashed in parallel
+    :return: Problems found, empty if the product is valid
+    """
+    safe_dir = Path(safe_dir)
+    if not (safe_dir / MANIFEST_SAFE).is_file():
+        logger.warning("No %s in %s, not checked", MANIFEST_SAFE, safe_dir.name)
+        return []
+    try:
+        entries = read_manifest(safe_dir)
+    except ET.ParseError as err:
+        return [f"{MANIFEST_SAFE} cannot be read: {err}"]
+    # Largest files first so that they do not end the check alone
+    entries.sort(key=lambda entry: -(entry.size or 0))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        problems = [
+            problem
+            for problem in executor.map(
+                lambda entry: check_file(safe_dir, entry), entries
+            )
+            if problem is not None
+        ]
+    logger.info(
+        "%s: %s files checked, %s problems", safe_dir.name, len(entries), len(problems)
+    )
+    return problems
+
+
+def check_links(links: List[Path]) -> List[str]:
+    """
+    Check that symbolic links resolve to non-empty files
+    :param links: Links
+    :return: Problems found, empty if all the links are valid
+    """
+    problems = []
+    for link in links:
+        if not link.exists():
+            problems.append(f"{link} does not resolve")
+        elif link.stat().st_size == 0:
+            problems.append(f"{link} points to an empty file")
+    return problems
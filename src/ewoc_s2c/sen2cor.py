@@ -0,0 +1,207 @@
+""" EWoC Sen2Cor execution and configuration module"""
+import logging
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+from typing import List, Optional, Tuple
+import uuid
+import xml.etree.ElementTree as ET
+
+from ewoc_s2c.dem import get_dem_tiles
+from ewoc_s2c.utils import SEN2COR_ROOT, WORK_ROOT, clean
+
+logger = logging.getLogger(__name__)
+
+L2A_PROCESS = os.getenv(
+    "EWOC_S2C_L2A_PROCESS", "./Sen2Cor-02.09.00-Linux64/bin/L2A_Process"
+)
+
+
+def run_s2c(
+    l1c_safe: Path,
+    l2a_out: Path,
+    only_scl: bool = False,
+    bin_path: Optional[str] = None,
+) -> Path:
+    """
+    Run sen2cor subprocess
+    :param l1c_safe: Path to SAFE folder
+    :param l2a_out: Path to output directory for generated L2A products
+    :param bin_path: Path to L2A_Process, L2A_PROCESS if None
+    :return: Path to L2A SAFE
+    """
+    s2c_cmd = s2c_command(l1c_safe, l2a_out, only_scl, bin_path)
+    try:
+        execute_cmd(s2c_cmd)
+    except RuntimeError:
+        logger.error("Sen2cor execution error")
+        sys.exit(1)
+    return s2c_output(l2a_out)
+
+
+def s2c_command(
+    l1c_safe: Path,
+    l2a_out: Path,
+    only_scl: bool = False,
+    bin_path: Optional[str] = None,
+) -> str:
+    """
+    Get the sen2cor command line
+    :param l1c_safe: Path to SAFE folder
+    :param l2a_out: Path to output directory for generated L2A products
+    :param only_scl: True to process scl only
+    :param bin_path: Path to L2A_Process, L2A_PROCESS if None
+    :return: Shell command
+    """
+    bin_path = bin_path or L2A_PROCESS
+    # L2A_Process is expected to be added to /bin/
+    # After installing sen2cor run source Sen2Cor-02.09.00-Linux64/L2A_Bashrc
+    # This should work in container and local env
+    if only_scl:
+        return f"{bin_path} {l1c_safe} --output_dir {l2a_out} --sc_only"
+    return f"{bin_path} {l1c_safe} --output_dir {l2a_out} --resolution 10 --debug"
+
+
+def s2c_output(l2a_out: Path) -> Path:
+    """
+    Get the L2A SAFE written by sen2cor
+    :param l2a_out: Sen2cor output directory
+    :return: Path to L2A SAFE
+    """
+    # TODO: select folder using date and tile id from l1 id
+    l2a_safe_folder = [
+        l2a_out / fold for fold in os.listdir(l2a_out) if fold.endswith("SAFE")
+    ][0]
+    return l2a_safe_folder
+
+
+def custom_s2c_dem(dem_type: str, tile_id: str) -> Tuple[Path, List]:
+    """
+    Download and create a DEM mosaïc
+    :param dem_type: DEM type (srtm or copdem)
+    :param tile_id: MGRS tile id (ex 31TCJ Toulouse)
+    :return: DEM temporary directory and list of links to the downloaded DEM files
+    """
+    from ewoc_dag.srtm_dag import get_srtm3s_ids
+    import rasterio
+    from rasterio.merge import merge
+
+    # Generate temporary folder
+    dem_tmp_dir = WORK_ROOT / "DEM"
+    if dem_tmp_dir.exists():
+        shutil.rmtree(dem_tmp_dir)
+    dem_tmp_dir.mkdir(exist_ok=False, parents=True)
+    # Clear the folder from tiles remaining from previous runs
+    s2c_docker_dem_path = SEN2COR_ROOT / "dem" / dem_type
+    s2c_docker_dem_folder = str(s2c_docker_dem_path)
+    if s2c_docker_dem_path.exists():
+        clean(s2c_docker_dem_path)
+        logger.info("%s --> clean (deleted)", s2c_docker_dem_path)
+    # Create (back) the dem folder
+    s2c_docker_dem_path.mkdir(parents=True)
+    logger.info("%s --> created", s2c_docker_dem_path)
+    # Download the dem files through the DEM cache, tile by tile when the
+    # tiles have an URL
+    dem_files = get_dem_tiles(dem_type, tile_id)
+    if not dem_files:
+        raise ValueError(f"No {dem_type} DEM tile for {tile_id}")
+    raster_list = [str(dem_file) for dem_file in dem_files]
+
+    sources = []
+    uid = uuid.uuid4()
+    output_fn = os.path.join(dem_tmp_dir, f"mosaic_{uid}.tif")
+
+    for raster_name in raster_list:
+        src = rasterio.open(raster_name)
+        sources.append(src)
+    merge(sources, dst_path=output_fn, method="max")
+    logger.info("Created mosaic %s", output_fn)
+    for src in sources:
+        src.close()
+    links = []
+
+    # Artificially change copdem filenames to srtm filenames
+    # to run sen2cor 2.9 with copdem
+    if dem_type == "copdem":
+        raster_list = get_srtm3s_ids(tile_id)
+
+    for raster_name in raster_list:
+        try:
+            if dem_type == "copdem":
+                raster_name = raster_name + ".tif"
+            # raster_name = os.path.basename(raster_name).replace("_COG_", "_")
+            if dem_type == "srtm":
+                raster_name = os.path.basename(raster_name)
+            os.symlink(output_fn, os.path.join(s2c_docker_dem_folder, raster_name))
+            links.append(Path(os.path.join(s2c_docker_dem_folder, raster_name)))
+        except OSError:
+            logger.info("Symlink error: probably already exists")
+    return dem_tmp_dir, links
+
+
+def unlink(links: List) -> None:
+    """
+    Remove symlinks created
+    :param links: List of links
+    :return: None
+    """
+    for symlink in links:
+        try:
+            symlink.unlink()
+            logger.info(" -- [Ok] Unlinked %s", symlink)
+        except FileNotFoundError:
+            logger.info("Cannot unlink %s", symlink)
+
+
+def set_gipp_dem(root: ET.Element, dem_type: str) -> None:
+    """
+    Set the DEM of a Sen2Cor GIPP
+    :param root: GIPP root element
+    :param dem_type: DEM type
+    """
+    for name in root.iter("DEM_Directory"):
+        name.text = f"dem/{dem_type}"
+    for name in root.iter("DEM_Reference"):
+        if dem_type == "srtm":
+            name.text = (
+                "http://srtm.csi.cgiar.org/wp-content/uploads/files/srtm_5x5/TIFF/"
+            )
+        elif dem_type == "copdem":
+            name.text = "NONE"
+        else:
+            raise AttributeError("Attribute dem_type must be srtm or copdem")
+
+
+def edit_xml_config_file(dem_type):
+    """
+    Edit xml config file depending on DEM used
+    :param dem_type: DEM type
+    """
+    s2c_docker_cfg_file = SEN2COR_ROOT / "cfg" / "L2A_GIPP.xml"
+    tree = ET.parse(s2c_docker_cfg_file)
+    set_gipp_dem(tree.getroot(), dem_type)
+    tree.write(s2c_docker_cfg_file, encoding="utf-8", xml_declaration=True)
+    logger.info("%s --> edited with DEM infos", s2c_docker_cfg_file)
+
+
+def execute_cmd(cmd: str) -> None:
+    """
+    Execute the given cmd.
+    :param cmd: The command and its parameters to execute
+    """
+    logger.debug("Launching command: %s", cmd)
+    try:
+        subprocess.run(cmd, shell=True, check=True)
+    except subprocess.CalledProcessError as err:
+        logger.error(
+            "Following error code %s \
+            occurred while running command %s with following output:\
+            %s / %s",
+            err.returncode,
+            err.cmd,
+            err.stdout,
+            err.stderr,
+        )
+        raise
@@ -0,0 +1,215 @@
+""" EWoC Sen2Cor ARD output sinks module"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import io
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator
+import uuid
+
+from ewoc_s2c.upload import (
+    CONTENT_HASH_KEY,
+    ArdFolderState,
+    UploadReport,
+    ard_bucket_client,
+    ard_key,
+    get_content_hash,
+)
+
+logger = logging.getLogger(__name__)
+
+# Multipart upload of the in-memory files, same part size as boto3 default
+# so that the ETags are the ones of upload_file
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+# Prefix of the files uploaded before their product is complete. They are
+# removed by commit or abort, those of killed workers by a lifecycle rule of
+# the ARD bucket (see README)
+STAGING_PREFIX = ".staging"
+
+
+class LocalSink:
+    """Write the ARD files on the local disk, they are uploaded afterwards"""
+
+    name = "local"
+
+    @contextmanager
+    def open(self, raster_fn: Path, **profile: Any) -> Iterator[Any]:
+        """
+        Open an ARD raster for writing
+        :param raster_fn: Output raster path
+        :param profile: rasterio creation profile
+        :return: Writable rasterio dataset
+        """
+        import rasterio
+
+        with rasterio.open(raster_fn, "w+", **profile) as dataset:
+            yield dataset
+
+
+class S3Sink:
+    """
+    Write the ARD files in memory and upload them to the ARD bucket when they
+    are closed, nothing is written on the local disk. GTiff needs random
+    access while writing, so the files are buffered in memory rather than
+    streamed through /vsis3/. With staging (default), the files are uploaded
+    under a staging prefix and copied to their keys by commit, so that a
+    product whose processing fails leaves no file in the ARD prefix.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        local_root: Path,
+        ard_prd_prefix: str,
+        staging: bool = True,
+    ) -> None:
+        """
+        :param local_root: ARD root folder the output paths are relative to
+        :param ard_prd_prefix: Bucket prefix where store data
+        :param staging: True to upload the files under a staging prefix until
+         commit
+        """
+        self.local_root = local_root
+        self.ard_prd_prefix = ard_prd_prefix
+        self.s3_client, self.bucket_name = ard_bucket_client()
+        self.state = ArdFolderState(self.s3_client, self.bucket_name)
+        self.uploaded, self.skipped, self.bytes_uploaded, self.bytes_saved = 0, 0, 0, 0
+        self.staging = f"{STAGING_PREFIX}/{uuid.uuid4().hex}" if staging else None
+        # Key to staging key of the files uploaded since the last commit
+        self.staged: Dict[str, str] = {}
+
+    @contextmanager
+    def open(self, raster_fn: Path, **profile: Any) -> Iterator[Any]:
+        """
+        Open an ARD raster for writing in memory, uploaded when closed
+        :param raster_fn: Output raster path, under local_root
+        :param profile: rasterio creation profile
+        :return: Writable rasterio dataset
+        """
+        from rasterio.io import MemoryFile
+
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as dataset:
+                yield dataset
+            self._put(raster_fn, memfile.getbuffer())
+
+    def _put(self, raster_fn: Path, data: memoryview) -> None:
+        """
+        Upload a file content if the bucket does not have it yet
+        :param raster_fn: Output raster path
+        :param data: File content
+        """
+        from boto3.s3.transfer import TransferConfig
+
+        key = ard_key(self.local_root, raster_fn, self.ard_prd_prefix)
+        digest = get_content_hash(raster_fn)
+        if self.state.is_unchanged(key, len(data), digest):
+            logger.debug("%s is unchanged", key)
+            self.skipped += 1
+            self.bytes_saved += len(data)
+            # A file written again may have been staged with another content
+            if key in self.staged:
+                self.s3_client.delete_object(
+                    Bucket=self.bucket_name, Key=self.staged.pop(key)
+                )
+            return
+        if self.staging is not None:
+            self.staged[key] = f"{self.staging}/{key}"
+        self.s3_client.upload_fileobj(
+            io.BytesIO(data),
+            self.bucket_name,
+            self.staged.get(key, key),
+            ExtraArgs={"Metadata": {CONTENT_HASH_KEY: digest}} if digest else None,
+            Config=TransferConfig(
+                multipart_threshold=MULTIPART_CHUNKSIZE,
+                multipart_chunksize=MULTIPART_CHUNKSIZE,
+            ),
+        )
+        logger.info("Uploaded s3://%s/%s", self.bucket_name, self.staged.get(key, key))
+        self.state.record(key, digest)
+        self.uploaded += 1
+        self.bytes_uploaded += len(data)
+
+    def commit(self) -> None:
+        """
+        Copy the staged files to their keys, server side, and record the
+        uploaded files in the content manifests
+        """
+        for key, staged_key in self.staged.items():
+            # The content checksum is in the metadata, copied with the object
+            self.s3_client.copy_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                CopySource={"Bucket": self.bucket_name, "Key": staged_key},
+                MetadataDirective="COPY",
+            )
+        if self.staged:
+            logger.info(
+                "Committed %s files to %s", len(self.staged), self.ard_prd_prefix
+            )
+        self.state.write_manifests()
+        self.abort()
+
+    def abort(self) -> None:
+        """Remove the staged files"""
+        # Not committed, the manifests do not record them
+        self.state.uploaded.clear()
+        if not self.staged:
+            return
+        self.s3_client.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={"Objects": [{"Key": key} for key in self.staged.values()]},
+        )
+        self.staged.clear()
+
+    def report(self) -> UploadReport:
+        """
+        Get the upload report of the files written so far
+        :return: Upload report
+        """
+        return UploadReport(
+            self.uploaded,
+            self.skipped,
+            self.bytes_uploaded,
+            self.bytes_saved,
+            f"s3://{self.bucket_name}/{self.ard_prd_prefix}",
+        )
+
+
+_SINK: ContextVar[Any] = ContextVar("ard_sink", default=LocalSink())
+
+
+def get_sink() -> Any:
+    """
+    Get the ARD output sink in use
+    :return: LocalSink or S3Sink
+    """
+    return _SINK.get()
+
+
+@contextmanager
+def use_sink(sink: Any) -> Iterator[Any]:
+    """
+    Write the ARD files through a sink
+    :param sink: LocalSink or S3Sink
+    """
+    token = _SINK.set(sink)
+    try:
+        yield sink
+    finally:
+        _SINK.reset(token)
+
+
+@contextmanager
+def abort_on_failure(sink: Any) -> Iterator[Any]:
+    """
+    Remove the files staged by a sink if the processing of the product fails
+    :param sink: LocalSink or S3Sink
+    """
+    try:
+        yield sink
+    except BaseException:
+        if isinstance(sink, S3Sink):
+            sink.abort()
+        raise
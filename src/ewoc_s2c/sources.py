@@ -0,0 +1,291 @@
+""" EWoC Sen2Cor data sources module"""
+from importlib import import_module
+from importlib.metadata import entry_points
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+from ewoc_s2c.resolver import resolve_s2_product
+
+logger = logging.getLogger(__name__)
+
+# Data sources are loaded on first use from "module:attribute" references,
+# other packages can add sources with the ewoc_s2c.sources entry point group
+ENTRY_POINT_GROUP = "ewoc_s2c.sources"
+SOURCES: Dict[str, str] = {
+    "auto": "ewoc_s2c.auto_source:AutoSource",
+    "aws": "ewoc_s2c.sources:AwsCogSource",
+    "aws_sng": "ewoc_s2c.sources:AwsSngSource",
+    "creodias": "ewoc_s2c.sources:CreodiasSource",
+}
+_LOADED: Dict[str, "DataSource"] = {}
+
+
+class DataSource:
+    """
+    Sentinel-2 data source: how to fetch products, find the L2A bands and
+    convert them to ARD. The default rules are the ones of ewoc_dag sources
+    providing L1C SAFE products.
+    """
+
+    supports_l2a = False
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def fetch_l1c(self, pid: str, out_dir: Path) -> Path:
+        """
+        Download a L1C product
+        :param pid: Sentinel-2 product id (with .SAFE)
+        :param out_dir: Output directory
+        :return: Path to the L1C SAFE folder
+        """
+        from ewoc_dag.s2_dag import get_s2_product
+
+        return get_s2_product(pid, out_dir, source=self.name)
+
+    def fetch_l2a(self, pid: str, out_dir: Path, only_scl: bool = False) -> Path:
+        """
+        Download a L2A product
+        :param pid: Sentinel-2 product id (with .SAFE)
+        :param out_dir: Output directory
+        :param only_scl: True to process scl only
+        :return: Path to the L2A product folder
+        """
+        raise NotImplementedError(f"{self.name} is not supported (yet) for L2A ids")
+
+    def get_l1c(self, pid: str, out_dir: Path) -> Path:
+        """
+        Download a L1C product trying its id variants
+        :param pid: Sentinel-2 product id (with .SAFE)
+        :param out_dir: Output directory
+        :return: Path to the L1C SAFE folder
+        """
+        return resolve_s2_product(
+            pid, lambda prd_id: self.fetch_l1c(prd_id, out_dir), self.name
+        )
+
+    def get_l2a(self, pid: str, out_dir: Path, only_scl: bool = False) -> Path:
+        """
+        Download a L2A product trying its id variants
+        :param pid: Sentinel-2 product id (with .SAFE)
+        :param out_dir: Output directory
+        :param only_scl: True to process scl only
+        :return: Path to the L2A product folder
+        """
+        return resolve_s2_product(
+            pid, lambda prd_id: self.fetch_l2a(prd_id, out_dir, only_scl), self.name
+        )
+
+    def fetch_metadata(self, pid: str) -> Dict[str, bytes]:
+        """
+        Download only the product and tile metadata XML files of a product
+        :param pid: Sentinel-2 product id (with .SAFE)
+        :return: File name to file content, empty if the source does not
+         provide them separately
+        """
+        logger.info("No metadata-only fetch for %s on %s", pid, self.name)
+        return {}
+
+    def find_band(  # pylint: disable=unused-argument
+        self, l2a_folder: Path, band_num: str, res: int, pid: str
+    ) -> Path:
+        """
+        Find L2A band at specific resolution
+        :param l2a_folder: L2A product folder
+        :param band_num: BXX/AOT/SCL/...
+        :param res: resolution (10/20/60)
+        :param pid: Sentinel-2 product id
+        :return: path to band
+        """
+        from ewoc_s2c.utils import find_l2a_band
+
+        return find_l2a_band(l2a_folder, band_num, res)
+
+    def needs_offset(self, pid: str) -> bool:  # pylint: disable=unused-argument
+        """
+        Check if the BOA_ADD_OFFSET of the product metadata has to be applied
+        :param pid: Sentinel-2 product id
+        :return: True if the offset has to be applied to the bands
+        """
+        return False
+
+    def to_ard(
+        self,
+        l2a_folder: Path,
+        work_dir: Path,
+        pid: str,
+        only_scl: bool = False,
+        layout: str = "band",
+        interleave: str = "pixel",
+        min_valid_fraction: float = 0.0,
+    ) -> Optional[Path]:
+        """
+        Convert a L2A product fetched from this source into EWoC ARD format
+        :param l2a_folder: L2A product folder
+        :param work_dir: Output directory
+        :param pid: Sentinel-2 product id
+        :param only_scl: True to process scl only
+        :param layout: band or stacked ARD files
+        :param interleave: pixel or band interleaving of the stacked ARD files
+        :param min_valid_fraction: Minimum fraction of valid pixels to write the ARD
+        :return: ARD product folder, None if the product has too few valid pixels
+        """
+        from ewoc_s2c.utils import l2a_to_ard
+
+        return l2a_to_ard(
+            l2a_folder,
+            work_dir,
+            pid,
+            self.name,
+            only_scl,
+            layout,
+            interleave,
+            min_valid_fraction,
+        )
+
+
+class CreodiasSource(DataSource):
+    """Creodias EODATA: L1C and L2A SAFE products"""
+
+    supports_l2a = True
+
+    def fetch_l1c(self, pid: str, out_dir: Path) -> Path:
+        from ewoc_s2c.fetch import creodias_eodata_configured, fetch_creodias_safe
+
+        if not creodias_eodata_configured():
+            # Downloaded by ewoc_dag with its own Creodias configuration
+            return super().fetch_l1c(pid, out_dir)
+        return fetch_creodias_safe(pid, out_dir)
+
+    def fetch_l2a(self, pid: str, out_dir: Path, only_scl: bool = False) -> Path:
+        from ewoc_s2c.fetch import fetch_l2a_bands
+
+        return fetch_l2a_bands(pid, out_dir, self.name, only_scl=only_scl)
+
+    def fetch_metadata(self, pid: str) -> Dict[str, bytes]:
+        from ewoc_s2c.fetch import fetch_metadata
+
+        return fetch_metadata(pid, self.name)
+
+
+class AwsSngSource(DataSource):
+    """Sinergise buckets on AWS: L1C SAFE and L2A JP2 products"""
+
+    supports_l2a = True
+
+    def fetch_l1c(self, pid: str, out_dir: Path) -> Path:
+        from ewoc_dag.s2_dag import get_s2_product
+
+        return get_s2_product(
+            pid, out_dir, source="aws", aws_l1c_safe=True, aws_l2a_cogs=False
+        )
+
+    def fetch_l2a(self, pid: str, out_dir: Path, only_scl: bool = False) -> Path:
+        from ewoc_s2c.fetch import fetch_l2a_bands
+
+        return fetch_l2a_bands(pid, out_dir, self.name, only_scl=only_scl)
+
+    def fetch_metadata(self, pid: str) -> Dict[str, bytes]:
+        from ewoc_s2c.fetch import fetch_metadata
+
+        return fetch_metadata(pid, self.name)
+
+    def find_band(self, l2a_folder: Path, band_num: str, res: int, pid: str) -> Path:
+        from ewoc_dag.eo_prd_id.s2_prd_id import S2PrdIdInfo
+
+        from ewoc_s2c.utils import find_l2a_band_sng
+
+        # L2A produced by Sen2Cor from a L1C id are in SAFE format
+        if not S2PrdIdInfo.is_l2a(pid):
+            return super().find_band(l2a_folder, band_num, res, pid)
+        return find_l2a_band_sng(l2a_folder, band_num, res)
+
+    def needs_offset(self, pid: str) -> bool:
+        from ewoc_dag.eo_prd_id.s2_prd_id import S2PrdIdInfo
+
+        return (
+            S2PrdIdInfo.is_l2a(pid)
+            and S2PrdIdInfo(pid).pdgs_processing_baseline_number == "0400"
+        )
+
+
+class AwsCogSource(DataSource):
+    """Element84 COGs on AWS for L2A products, ewoc_dag aws for L1C"""
+
+    supports_l2a = True
+
+    def fetch_l2a(self, pid: str, out_dir: Path, only_scl: bool = False) -> Path:
+        from ewoc_dag.s2_dag import get_s2_product
+
+        return get_s2_product(
+            pid, out_dir, source=self.name, l2_mask_only=only_scl, aws_l2a_cogs=True
+        )
+
+    def to_ard(
+        self,
+        l2a_folder: Path,
+        work_dir: Path,
+        pid: str,
+        only_scl: bool = False,
+        layout: str = "band",
+        interleave: str = "pixel",
+        min_valid_fraction: float = 0.0,
+    ) -> Optional[Path]:
+        from ewoc_s2c.utils import l2a_to_ard_aws_cog
+
+        return l2a_to_ard_aws_cog(
+            l2a_folder,
+            work_dir,
+            self.name,
+            only_scl,
+            layout,
+            interleave,
+            min_valid_fraction,
+        )
+
+
+def register_source(name: str, target: str) -> None:
+    """
+    Register a data source
+    :param name: Data source name (--data_source value)
+    :param target: Reference to the DataSource subclass, "module:attribute"
+    """
+    SOURCES[name] = target
+    _LOADED.pop(name, None)
+
+
+def _entry_point_target(name: str) -> Optional[str]:
+    """
+    Get the data source registered by another package under a name
+    :param name: Data source name
+    :return: "module:attribute" reference or None
+    """
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        group = eps.select(group=ENTRY_POINT_GROUP)
+    else:  # Python < 3.10
+        group = eps.get(ENTRY_POINT_GROUP, [])  # type: ignore
+    for entry_point in group:
+        if entry_point.name == name:
+            return entry_point.value
+    return None
+
+
+def get_source(name: str) -> DataSource:
+    """
+    Get a data source, loading its module on first use. Unknown names are
+    passed to ewoc_dag for L1C products.
+    :param name: Data source name
+    :return: Data source
+    """
+    if name not in _LOADED:
+        target = SOURCES.get(name) or _entry_point_target(name)
+        if target is None:
+            _LOADED[name] = DataSource(name)
+        else:
+            module_name, _, attr = target.partition(":")
+            source_cls = getattr(import_module(module_name), attr)
+            _LOADED[name] = source_cls(name)
+        logger.debug("Loaded data source %s", name)
+    return _LOADED[name]
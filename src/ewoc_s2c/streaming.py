@@ -0,0 +1,326 @@
+""" EWoC Sen2Cor streaming ARD conversion module"""
+import logging
+import os
+from pathlib import Path
+import struct
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ewoc_s2c.sources import get_source
+from ewoc_s2c.sen2cor import s2c_command, s2c_output
+from ewoc_s2c.utils import (
+    SclMask,
+    ard_file_prefix,
+    ard_product_folder,
+    band_to_ard,
+    get_ard_bands,
+    mask_footprint,
+    read_scl_mask,
+    stack_to_ard,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two scans of the Sen2Cor output folder, a band file is
+# complete when it did not change between two scans
+STREAM_POLL_SECONDS = float(os.getenv("EWOC_S2C_STREAM_POLL", "2"))
+JP2_SIGNATURE = b"\x00\x00\x00\x0cjP  \r\n\x87\n"
+J2K_SOC = b"\xff\x4f\xff\x51"
+J2K_EOC = b"\xff\xd9"
+
+
+def jp2_complete(path: Path) -> bool:
+    """
+    Check that a JPEG 2000 file is fully written: its boxes span the file
+    and its codestream ends with the end of codestream marker
+    :param path: JP2 or J2K file
+    :return: True if the file is complete
+    """
+    size = path.stat().st_size
+    with open(path, "rb") as jp2:
+        head = jp2.read(len(JP2_SIGNATURE))
+        if head.startswith(J2K_SOC):
+            jp2.seek(-len(J2K_EOC), os.SEEK_END)
+            return jp2.read(len(J2K_EOC)) == J2K_EOC
+        if head != JP2_SIGNATURE:
+            return False
+        offset = len(JP2_SIGNATURE)
+        codestream_end = None
+        while offset < size:
+            jp2.seek(offset)
+            header = jp2.read(8)
+            if len(header) < 8:
+                return False
+            length, box_type = struct.unpack(">I4s", header)
+            if length == 1:
+                extended = jp2.read(8)
+                if len(extended) < 8:
+                    return False
+                length = struct.unpack(">Q", extended)[0]
+            elif length == 0:
+                # Last box, up to the end of the file
+                length = size - offset
+            if length < 8:
+                return False
+            if box_type == b"jp2c":
+                codestream_end = offset + length
+            offset += length
+        if offset != size or codestream_end is None:
+            return False
+        jp2.seek(codestream_end - len(J2K_EOC))
+        return jp2.read(len(J2K_EOC)) == J2K_EOC
+
+
+class BandWatcher:
+    """Find the band files completed by Sen2Cor in its output folder"""
+
+    def __init__(self, l2a_out: Path, bands: Dict[str, int]) -> None:
+        """
+        :param l2a_out: Sen2Cor output folder
+        :param bands: Band id to resolution
+        """
+        self.l2a_out = l2a_out
+        self.pending = dict(bands)
+        # Size and modification time of the band files at the last scan
+        self._stats: Dict[Path, Tuple[int, int]] = {}
+
+    def poll(self) -> List[Tuple[str, Path]]:
+        """
+        Scan the output folder
+        :return: Band ids and files completed since the last scan
+        """
+        completed = []
+        for band, res in list(self.pending.items()):
+            pattern = f"*.SAFE/GRANULE/*/IMG_DATA/R{res}m/*_{band}_{res}m.jp2"
+            for path in self.l2a_out.glob(pattern):
+                try:
+                    stat = path.stat()
+                    previous = self._stats.get(path)
+                    self._stats[path] = (stat.st_size, stat.st_mtime_ns)
+                    if previous != self._stats[path] or not jp2_complete(path):
+                        continue
+                except FileNotFoundError:
+                    continue
+                completed.append((band, path))
+                del self.pending[band]
+                # A single file per band
+                break
+        return completed
+
+
+class StreamingArd:
+    """
+    ARD conversion of a product fed band by band, while Sen2Cor writes it.
+    The bands wait for the SCL check when a minimum valid fraction is set,
+    the stacked files for all the bands of their resolution, and all the
+    bands for the end of Sen2Cor when an offset from the product metadata
+    applies.
+    """
+
+    def __init__(
+        self,
+        work_dir: Path,
+        pid: str,
+        provider: str,
+        only_scl: bool = False,
+        layout: str = "band",
+        interleave: str = "pixel",
+        min_valid_fraction: float = 0.0,
+    ) -> None:
+        """
+        :param work_dir: Output directory
+        :param pid: Sentinel-2 product id
+        :param provider: Sentinel-2 product data source
+        :param only_scl: True to convert the SCL only
+        :param layout: band for one file per band, stacked for one file per
+         resolution (the MASK is in its own file)
+        :param interleave: pixel or band interleaving of the stacked files
+        :param min_valid_fraction: Minimum fraction of valid pixels (from the
+         SCL) to write the ARD
+        """
+        if layout not in ("band", "stacked"):
+            raise ValueError(f"ARD layout must be band or stacked, not {layout}")
+        self.pid = pid
+        self.product_id = pid.replace(".SAFE", "")
+        self.provider = provider
+        self.bands = get_ard_bands(only_scl)
+        self.layout = layout
+        self.interleave = interleave
+        self.min_valid_fraction = min_valid_fraction
+        self.ard_folder = ard_product_folder(work_dir, self.product_id)
+        self.streamable = not get_source(provider).needs_offset(pid)
+        self.empty = False
+        self._checked = min_valid_fraction <= 0
+        # SCL read for the check, kept for the MASK file
+        self._scl_mask: Optional[SclMask] = None
+        # Complete band files not converted yet
+        self._ready: Dict[str, Path] = {}
+        # Band file, size and modification time of the converted bands
+        self._converted: Dict[str, Tuple[Path, int, int]] = {}
+
+    def add(self, band: str, band_path: Path) -> None:
+        """
+        Convert a complete band file, or keep it until it can be
+        :param band: Band id
+        :param band_path: L2A band file
+        """
+        self._ready[band] = band_path
+        if self.streamable:
+            self._convert()
+
+    def _groups(self) -> List[List[str]]:
+        """
+        Get the bands written in the same ARD file
+        :return: Lists of band ids
+        """
+        if self.layout == "band":
+            return [[band] for band in self.bands]
+        groups = []
+        for res in sorted(set(self.bands.values())):
+            res_bands = [
+                band for band in self.bands if self.bands[band] == res and band != "SCL"
+            ]
+            if len(res_bands) > 1:
+                groups.append(res_bands)
+            else:
+                groups += [[band] for band in res_bands]
+        if "SCL" in self.bands:
+            groups.append(["SCL"])
+        return groups
+
+    def _convert(self) -> None:
+        """Convert the groups of bands whose files are all complete"""
+        if self.empty:
+            return
+        if not self._checked:
+            if "SCL" not in self._ready:
+                return
+            self._scl_mask = read_scl_mask(self._ready["SCL"])
+            fraction, _ = mask_footprint(
+                self._scl_mask.mask[0], self._scl_mask.meta["transform"]
+            )
+            if fraction < self.min_valid_fraction:
+                logger.warning(
+                    "%s has %.2f%% valid pixels (minimum %.2f%%), no ARD written",
+                    self.product_id,
+                    fraction * 100,
+                    self.min_valid_fraction * 100,
+                )
+                self.empty = True
+                return
+            self._checked = True
+        for group in self._groups():
+            if not all(band in self._ready for band in group):
+                continue
+            self.ard_folder.mkdir(exist_ok=True, parents=True)
+            if len(group) > 1:
+                raster_fn = (
+                    self.ard_folder
+                    / f"{ard_file_prefix(self.product_id)}_{self.bands[group[0]]}M.tif"
+                )
+                stack_to_ard(
+                    {band: self._ready[band] for band in group},
+                    raster_fn,
+                    data_source=self.provider,
+                    pid=self.product_id,
+                    interleave=self.interleave,
+                )
+                logger.info("Done --> %s", str(raster_fn))
+            else:
+                band_to_ard(
+                    group[0],
+                    self._ready[group[0]],
+                    self.ard_folder,
+                    self.product_id,
+                    self.provider,
+                    self._scl_mask,
+                )
+            if "SCL" in group:
+                # A SCL changed after its conversion is read again
+                self._scl_mask = None
+            for band in group:
+                band_path = self._ready.pop(band).resolve()
+                stat = band_path.stat()
+                self._converted[band] = (band_path, stat.st_size, stat.st_mtime_ns)
+
+    def finish(self, l2a_folder: Path) -> Optional[Path]:
+        """
+        Convert the bands left once Sen2Cor succeeded, and again the bands
+        whose file changed after their conversion
+        :param l2a_folder: L2A SAFE folder
+        :return: ARD product folder, None if the product has too few valid
+         pixels
+        """
+        source = get_source(self.provider)
+        changed = []
+        for band, res in self.bands.items():
+            band_path = source.find_band(l2a_folder, band, res, self.pid)
+            if band in self._converted:
+                # The watched and the found paths may differ by symlinks or
+                # relative parts
+                stat = band_path.stat()
+                if self._converted[band] == (
+                    band_path.resolve(),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ):
+                    continue
+                changed.append(band)
+            self._ready[band] = band_path
+        if changed:
+            logger.warning("%s changed after their conversion", ", ".join(changed))
+            # The other bands of their files are converted again with them
+            for group in self._groups():
+                if any(band in changed for band in group):
+                    for band in group:
+                        self._ready[band] = source.find_band(
+                            l2a_folder, band, self.bands[band], self.pid
+                        )
+        logger.info(
+            "%s bands converted while Sen2Cor was running, %s after",
+            len(self.bands) - len(self._ready),
+            len(self._ready),
+        )
+        self._convert()
+        return None if self.empty else self.ard_folder
+
+
+def stream_s2c(
+    l1c_safe: Path,
+    l2a_out: Path,
+    converter: StreamingArd,
+    only_scl: bool = False,
+    bin_path: Optional[str] = None,
+    poll_interval: float = STREAM_POLL_SECONDS,
+) -> Path:
+    """
+    Run sen2cor and convert its band files as they are completed
+    :param l1c_safe: Path to SAFE folder
+    :param l2a_out: Path to output directory for generated L2A products
+    :param converter: ARD conversion of the product
+    :param only_scl: True to process scl only
+    :param bin_path: Path to L2A_Process, L2A_PROCESS if None
+    :param poll_interval: Seconds between two scans of the output folder
+    :return: Path to L2A SAFE, the bands left are converted by
+     converter.finish
+    """
+    s2c_cmd = s2c_command(l1c_safe, l2a_out, only_scl, bin_path)
+    logger.debug("Launching command: %s", s2c_cmd)
+    watcher = BandWatcher(l2a_out, converter.bands)
+    with subprocess.Popen(s2c_cmd, shell=True) as process:
+        try:
+            while process.poll() is None:
+                time.sleep(poll_interval)
+                for band, band_path in watcher.poll():
+                    logger.info("%s completed by Sen2Cor", band_path.name)
+                    converter.add(band, band_path)
+        except BaseException:
+            process.kill()
+            raise
+    if process.returncode != 0:
+        # Same outcome as run_s2c
+        logger.error("Sen2cor execution error")
+        sys.exit(1)
+    return s2c_output(l2a_out)
@@ -0,0 +1,284 @@
+""" EWoC Sen2Cor ARD upload module"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+import posixpath
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    from nptyping import NDArray
+
+logger = logging.getLogger(__name__)
+
+# ARD GeoTIFFs embed their write time (TIFFTAG_DATETIME), so identical
+# reprocessings never give identical bytes nor ETags. The checksum of what
+# is written (pixels, georeferencing, tags, creation options) is computed
+# from the arrays when the file is written, and recorded with the ETag of the
+# uploaded object in a manifest per ARD folder: one listing and one manifest
+# read tell which objects are unchanged.
+CONTENT_HASH_KEY = "ewoc-content-sha256"
+CONTENT_MANIFEST_PREFIX = ".content"
+_CONTENT_HASHES: Dict[Path, str] = {}
+
+
+class UploadReport(NamedTuple):
+    """Result of an ARD upload"""
+
+    uploaded: int
+    skipped: int
+    bytes_uploaded: int
+    bytes_saved: int
+    up_dir: str
+
+
+def content_hash(raster_array: "NDArray[int]", **write_args: Any) -> str:
+    """
+    Compute the checksum of a raster content
+    :param raster_array: Array written
+    :param write_args: Everything else defining the file content
+     (metadata, tags, creation options...)
+    :return: SHA-256 hex digest
+    """
+    import numpy as np
+
+    digest = hashlib.sha256()
+    digest.update(f"{raster_array.dtype}{raster_array.shape}".encode())
+    digest.update(np.ascontiguousarray(raster_array).data)
+    digest.update(repr(sorted((k, str(v)) for k, v in write_args.items())).encode())
+    return digest.hexdigest()
+
+
+def register_content_hash(raster_fn: Path, digest: str) -> None:
+    """
+    Record the content checksum of a file written by this process
+    :param raster_fn: Raster path
+    :param digest: Content checksum
+    """
+    _CONTENT_HASHES[Path(raster_fn).resolve()] = digest
+
+
+def get_content_hash(raster_fn: Path) -> Optional[str]:
+    """
+    Get the content checksum of a file written by this process
+    :param raster_fn: Raster path
+    :return: Content checksum, None if unknown
+    """
+    return _CONTENT_HASHES.get(Path(raster_fn).resolve())
+
+
+def clear_content_hashes() -> None:
+    """Forget the content checksums of the files written so far"""
+    _CONTENT_HASHES.clear()
+
+
+def ard_bucket_client() -> Tuple[Any, str]:
+    """
+    Get the S3 client and the name of the ARD bucket from the ewoc_dag
+    EWOCARDBucket, so that the ARD goes where ewoc_dag puts it
+    :return: boto3 S3 client and bucket name
+    """
+    from ewoc_dag.bucket.ewoc import EWOCARDBucket
+
+    ard_bucket = EWOCARDBucket()
+    # pylint: disable=protected-access
+    return ard_bucket._s3_client, ard_bucket._bucket_name
+
+
+def ard_key(local_path: Path, path: Path, ard_prd_prefix: str) -> str:
+    """
+    Get the object key of an ARD file, same keys as EWOCARDBucket.upload_ard_prd
+    :param local_path: ARD root folder
+    :param path: ARD file
+    :param ard_prd_prefix: Bucket prefix where store data
+    :return: Object key
+    """
+    return f"{ard_prd_prefix.rstrip('/')}/{Path(path).relative_to(local_path)}"
+
+
+def list_objects(
+    s3_client: Any, bucket_name: str, prefix: str
+) -> Dict[str, Tuple[int, str]]:
+    """
+    List the objects under a prefix with one paginated listing
+    :param s3_client: boto3 S3 client
+    :param bucket_name: Bucket name
+    :param prefix: Key prefix
+    :return: Object key to size and ETag
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    return {
+        obj["Key"]: (obj["Size"], obj["ETag"])
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+        for obj in page.get("Contents", [])
+    }
+
+
+def manifest_key(key: str) -> str:
+    """
+    Get the key of the content manifest of an ARD object folder
+    :param key: ARD object key
+    :return: Manifest key, outside of the ARD prefixes
+    """
+    return f"{CONTENT_MANIFEST_PREFIX}/{posixpath.dirname(key)}.json"
+
+
+def read_manifest(
+    s3_client: Any, bucket_name: str, key: str
+) -> Dict[str, Dict[str, str]]:
+    """
+    Read the content manifest of an ARD object folder
+    :param s3_client: boto3 S3 client
+    :param bucket_name: Bucket name
+    :param key: ARD object key
+    :return: Object key to ETag (etag) and content checksum (sha256), empty
+     if the folder has no manifest
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        body = s3_client.get_object(Bucket=bucket_name, Key=manifest_key(key))["Body"]
+    except ClientError as err:
+        if err.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            return {}
+        raise
+    return json.loads(body.read())
+
+
+class ArdFolderState:
+    """
+    Objects of the ARD folders in the bucket, each folder is listed and its
+    manifest read once
+    """
+
+    def __init__(self, s3_client: Any, bucket_name: str) -> None:
+        """
+        :param s3_client: boto3 S3 client
+        :param bucket_name: Bucket name
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        # Folder prefix to listing and manifest
+        self._folders: Dict[
+            str, Tuple[Dict[str, Tuple[int, str]], Dict[str, Dict[str, str]]]
+        ] = {}
+        # Key to content checksum of the objects uploaded
+        self.uploaded: Dict[str, str] = {}
+
+    def _folder(
+        self, key: str
+    ) -> Tuple[Dict[str, Tuple[int, str]], Dict[str, Dict[str, str]]]:
+        """
+        Get the listing and manifest of the folder of an object
+        :param key: Object key
+        :return: Object key to size and ETag, manifest
+        """
+        folder = posixpath.dirname(key)
+        if folder not in self._folders:
+            self._folders[folder] = (
+                list_objects(self.s3_client, self.bucket_name, f"{folder}/"),
+                read_manifest(self.s3_client, self.bucket_name, key),
+            )
+        return self._folders[folder]
+
+    def is_unchanged(self, key: str, size: int, digest: Optional[str]) -> bool:
+        """
+        Check if an object is the upload of a file of the same size and
+        content checksum: its listed ETag is the one of the manifest
+        :param key: Object key
+        :param size: Size of the local file
+        :param digest: Content checksum of the local file
+        :return: True if the object does not need to be uploaded
+        """
+        if digest is None:
+            return False
+        listing, manifest = self._folder(key)
+        if key not in listing or key not in manifest:
+            return False
+        listed_size, etag = listing[key]
+        return (
+            listed_size == size
+            and manifest[key]["etag"] == etag
+            and manifest[key]["sha256"] == digest
+        )
+
+    def record(self, key: str, digest: Optional[str]) -> None:
+        """
+        Record the upload of an object
+        :param key: Object key
+        :param digest: Content checksum of the uploaded file
+        """
+        if digest is not None:
+            self.uploaded[key] = digest
+
+    def write_manifests(self) -> None:
+        """
+        Add the uploaded objects to the manifests of their folders, with
+        their ETag from one listing per folder
+        """
+        folders: Dict[str, List[str]] = {}
+        for key in self.uploaded:
+            folders.setdefault(posixpath.dirname(key), []).append(key)
+        for folder, keys in folders.items():
+            listing = list_objects(self.s3_client, self.bucket_name, f"{folder}/")
+            _, manifest = self._folder(keys[0])
+            manifest.update(
+                {
+                    key: {"etag": listing[key][1], "sha256": self.uploaded[key]}
+                    for key in keys
+                    if key in listing
+                }
+            )
+            self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=manifest_key(keys[0]),
+                Body=json.dumps(manifest, indent=1).encode(),
+                ContentType="application/json",
+            )
+            self._folders[folder] = (listing, manifest)
+        self.uploaded.clear()
+
+
+def upload_ard(local_path: Path, ard_prd_prefix: str) -> UploadReport:
+    """
+    Upload the ARD tif files of a folder, skipping the objects recorded with
+    the content checksum of the local file
+    :param local_path: ARD root folder
+    :param ard_prd_prefix: Bucket prefix where store data
+    :return: Upload report
+    """
+    s3_client, bucket_name = ard_bucket_client()
+    state = ArdFolderState(s3_client, bucket_name)
+    files = {
+        path: ard_key(local_path, path, ard_prd_prefix)
+        for path in sorted(Path(local_path).rglob("*.tif"))
+    }
+    uploaded, skipped, bytes_uploaded, bytes_saved = 0, 0, 0, 0
+    for path, key in files.items():
+        size = path.stat().st_size
+        digest = get_content_hash(path)
+        if state.is_unchanged(key, size, digest):
+            logger.debug("%s is unchanged", key)
+            skipped += 1
+            bytes_saved += size
+            continue
+        extra_args = {"Metadata": {CONTENT_HASH_KEY: digest}} if digest else None
+        s3_client.upload_file(str(path), bucket_name, key, ExtraArgs=extra_args)
+        state.record(key, digest)
+        uploaded += 1
+        bytes_uploaded += size
+    state.write_manifests()
+    logger.info(
+        "Uploaded %s files (%.1f MB), skipped %s unchanged files (%.1f MB saved)",
+        uploaded,
+        bytes_uploaded / 1e6,
+        skipped,
+        bytes_saved / 1e6,
+    )
+    return UploadReport(
+        uploaded,
+        skipped,
+        bytes_uploaded,
+        bytes_saved,
+        f"s3://{bucket_name}/{ard_prd_prefix}",
+    )
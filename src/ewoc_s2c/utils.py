@@ -1,72 +1,265 @@
 """ EWoC Sen2Cor utils module"""
+from __future__ import annotations
+
 from datetime import datetime
-import glob
 import logging
 import os
 from pathlib import Path
 import shutil
-import subprocess
 import sys
-from typing import List, Tuple, Generator
-import uuid
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Generator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 import xml.etree.ElementTree as ET
 
-import boto3.exceptions
-from ewoc_dag.bucket.ewoc import EWOCARDBucket
-from ewoc_dag.cli_dem import get_dem_data
-from ewoc_dag.eo_prd_id.s2_prd_id import S2PrdIdInfo
-from ewoc_dag.srtm_dag import get_srtm3s_ids
-from nptyping import NDArray
-import numpy as np
-import rasterio
-from rasterio.merge import merge
-
 from ewoc_s2c import __version__
+from ewoc_s2c.gdal_env import apply_gdal_profile
+from ewoc_s2c.memory import get_buffer
+from ewoc_s2c.qa import band_stats, scl_class_counts
+from ewoc_s2c.sinks import get_sink
+from ewoc_s2c.sources import get_source
+from ewoc_s2c.upload import content_hash, register_content_hash, upload_ard
+
+# Heavy dependencies (numpy, rasterio, boto3, ewoc_dag) are imported by the
+# functions which need them to keep the CLI start-up fast
+if TYPE_CHECKING:
+    from nptyping import NDArray
 
 logger = logging.getLogger(__name__)
 
+BANDS_10M = ["B02", "B03", "B04", "B08"]
+# SCL values masked in the ARD cloud mask and SCL nodata value
+SCL_MASK_VALUES = [0, 1, 3, 8, 9, 10, 11]
+SCL_NODATA_VALUE = 0
+# Sen2Cor installation and work folders of the container, they can be moved
+# to run outside of it
+SEN2COR_ROOT = Path(os.getenv("EWOC_S2C_SEN2COR_ROOT", "/root/sen2cor/2.9"))
+SEN2COR_VERSION = os.getenv("EWOC_S2C_SEN2COR_VERSION", "02.09.00")
+WORK_ROOT = Path(os.getenv("EWOC_S2C_WORK_ROOT", "/work/SEN2TEST"))
 
-def binary_scl(scl_file: Path, raster_fn: Path) -> None:
+
+def get_ard_bands(only_scl: bool = False) -> Dict[str, int]:
     """
-    Convert L2A SCL file to binary cloud mask
-    :param scl_file: Path to SCL file
-    :param raster_fn: Output binary mask path
+    Get the L2A bands used to build the EWoC ARD and their resolution
+    :param only_scl: True to keep the SCL only
+    :return: Band id to resolution (in meters)
     """
-    with rasterio.open(scl_file, "r") as src:
-        scl = src.read(1)
+    if only_scl:
+        return {
+            "SCL": 20,
+        }
+    return {
+        "B02": 10,
+        "B03": 10,
+        "B04": 10,
+        "B08": 10,
+        "B05": 20,
+        "B06": 20,
+        "B07": 20,
+        "B11": 20,
+        "B12": 20,
+        "SCL": 20,
+    }
 
-    # Set the to-be-masked SCL values
-    scl_mask_values = [0, 1, 3, 8, 9, 10, 11]
 
-    # Set the nodata value in SCL
-    scl_nodata_value = 0
+def needs_boa_offset(pid: str, data_source: str) -> bool:
+    """
+    Check if the BOA_ADD_OFFSET of the product metadata has to be applied
+    :param pid: Sentinel-2 product id
+    :param data_source: source of the Sentinel-2 data
+    :return: True if the offset has to be applied to the bands
+    """
+    return get_source(data_source).needs_offset(pid)
 
-    # Contruct the final binary 0-1-255 mask
-    mask = np.zeros_like(scl)
-    mask[scl == scl_nodata_value] = 255
-    mask[~np.isin(scl, scl_mask_values)] = 1
 
-    meta = src.meta.copy()
+def scl_to_mask(scl: NDArray[int], out: Optional[NDArray[int]] = None) -> NDArray[int]:
+    """
+    Convert a SCL array to a binary 0-1-255 cloud mask
+    :param scl: SCL array (uint8)
+    :param out: uint8 array of the SCL shape to write the mask to
+    :return: Mask array
+    """
+    import numpy as np
+
+    # Look-up table of the binary 0-1-255 mask, one pass without temporaries
+    lut = np.ones(256, dtype=np.uint8)
+    lut[SCL_MASK_VALUES] = 0
+    lut[SCL_NODATA_VALUE] = 255
+    if out is None:
+        out = np.empty(scl.shape, dtype=np.uint8)
+    # By chunks of rows, np.take casts the indices to intp
+    for row in range(0, scl.shape[0], 64):
+        np.take(lut, scl[row : row + 64], out=out[row : row + 64], mode="clip")
+    return out
+
+
+def read_scl(scl_file: Path) -> Tuple[NDArray[int], Dict]:
+    """
+    Read L2A SCL file into the buffers of the process
+    :param scl_file: Path to SCL file
+    :return: SCL array (rows, cols) and the raster metadata of its binary
+     cloud mask, the array is reused by the next call
+    """
+    import rasterio
+
+    apply_gdal_profile()
+    with rasterio.open(scl_file, "r") as src:
+        shape = (src.height, src.width)
+        scl = src.read(1, out=get_buffer("scl", shape, src.dtypes[0]))
+        meta = src.meta.copy()
     meta["driver"] = "GTiff"
-    dtype = rasterio.uint8
-    meta["dtype"] = dtype
+    meta["dtype"] = "uint8"
     meta["nodata"] = 255
+    return scl, meta
+
+
+class SclMask(NamedTuple):
+    """SCL of a product and its binary cloud mask"""
+
+    scl: NDArray[int]
+    # Mask array (1 band)
+    mask: NDArray[int]
+    meta: Dict
+
 
-    with rasterio.open(
+def read_scl_mask(scl_file: Path) -> SclMask:
+    """
+    Read L2A SCL file as binary cloud mask, into the buffers of the process
+    :param scl_file: Path to SCL file
+    :return: SCL, mask and the raster metadata of the mask, the arrays are
+     reused by the next call
+    """
+    scl, meta = read_scl(scl_file)
+    mask = get_buffer("mask", (1,) + scl.shape, "uint8")
+    scl_to_mask(scl, out=mask[0])
+    return SclMask(scl, mask, meta)
+
+
+def mask_footprint(
+    mask: NDArray[int], transform: Any
+) -> Tuple[float, Optional[Tuple[float, float, float, float]]]:
+    """
+    Compute the valid data footprint of a binary cloud mask
+    :param mask: Mask array (rows, cols), 255 where there is no data
+    :param transform: Affine transform of the mask
+    :return: Fraction of valid pixels and bounding box (xmin, ymin, xmax, ymax)
+     of the valid pixels, None if there is none
+    """
+    import numpy as np
+
+    valid = mask != 255
+    fraction = np.count_nonzero(valid) / valid.size
+    rows = np.flatnonzero(valid.any(axis=1))
+    cols = np.flatnonzero(valid.any(axis=0))
+    if rows.size == 0:
+        return fraction, None
+    xmin, ymax = transform * (cols[0], rows[0])
+    xmax, ymin = transform * (cols[-1] + 1, rows[-1] + 1)
+    return fraction, (xmin, ymin, xmax, ymax)
+
+
+def footprint_tags(mask: NDArray[int], transform: Any) -> Dict[str, str]:
+    """
+    Get the ARD tags of the valid data footprint of a binary cloud mask
+    :param mask: Mask array (rows, cols), 255 where there is no data
+    :param transform: Affine transform of the mask
+    :return: VALID_FRACTION and VALID_BBOX tags
+    """
+    fraction, bbox = mask_footprint(mask, transform)
+    tags = {"VALID_FRACTION": f"{fraction:.4f}"}
+    if bbox is not None:
+        tags["VALID_BBOX"] = ",".join(f"{coord:.0f}" for coord in bbox)
+    return tags
+
+
+def write_ard_raster(
+    raster_fn: Path,
+    raster_array: NDArray[int],
+    meta: Dict,
+    blocksize: int,
+    tags: Optional[Dict[str, str]] = None,
+    band_descriptions: Optional[List[str]] = None,
+    band_tags: Optional[List[Dict[str, str]]] = None,
+    **creation_options: str,
+) -> None:
+    """
+    Write an array as EWoC ARD GeoTIFF through the ARD sink in use
+    :param raster_fn: Output raster path
+    :param raster_array: Array to write (bands, rows, cols)
+    :param meta: Raster metadata
+    :param blocksize: Tile size
+    :param tags: Additional dataset tags
+    :param band_descriptions: Description of each band
+    :param band_tags: Tags of each band
+    :param creation_options: Additional GTiff creation options
+    """
+    # Blocks with nodata only are not written (sparse GeoTIFF), edge tiles
+    # are mostly empty
+    creation_options.setdefault("sparse_ok", "TRUE")
+    # The checksum is computed from what is written, the file is not read back
+    register_content_hash(
+        raster_fn,
+        content_hash(
+            raster_array,
+            meta=meta,
+            blocksize=blocksize,
+            tags=tags,
+            band_descriptions=band_descriptions,
+            band_tags=band_tags,
+            version=__version__,
+            **creation_options,
+        ),
+    )
+    with get_sink().open(
         raster_fn,
-        "w+",
         **meta,
         compress="deflate",
         tiled=True,
-        blockxsize=512,
-        blockysize=512,
+        blockxsize=blocksize,
+        blockysize=blocksize,
+        **creation_options,
     ) as out:
         # Modify output metadata
         out.update_tags(TIFFTAG_DATETIME=str(datetime.now()))
         out.update_tags(TIFFTAG_IMAGEDESCRIPTION="EWoC Sentinel-2 ARD")
         out.update_tags(TIFFTAG_SOFTWARE="EWoC S2 Processor " + str(__version__))
+        if tags:
+            out.update_tags(**tags)
+        for bidx, description in enumerate(band_descriptions or [], start=1):
+            out.set_band_description(bidx, description)
+        for bidx, btags in enumerate(band_tags or [], start=1):
+            out.update_tags(bidx, **btags)
+
+        out.write(raster_array)
 
-        out.write(mask.astype(rasterio.uint8), 1)
+
+def binary_scl(
+    scl_file: Path, raster_fn: Path, scl_mask: Optional[SclMask] = None
+) -> None:
+    """
+    Convert L2A SCL file to binary cloud mask
+    :param scl_file: Path to SCL file
+    :param raster_fn: Output binary mask path
+    :param scl_mask: SCL file already read, read again if None
+    """
+    scl, mask, meta = scl_mask or read_scl_mask(scl_file)
+    tags = footprint_tags(mask[0], meta["transform"])
+    tags.update(scl_class_counts(scl))
+    write_ard_raster(
+        raster_fn,
+        mask,
+        meta,
+        blocksize=512,
+        tags=tags,
+        band_tags=[band_stats(mask[0], meta["nodata"])],
+    )
 
 
 def scl_to_ard(work_dir: Path, prod_name: str) -> None:
@@ -109,107 +302,98 @@ def scl_to_ard(work_dir: Path, prod_name: str) -> None:
 
 
 def retrieve_offset_from_meta(meta_xml_file: str, band_id: str) -> int:
+    """
+    Read the BOA offset of a band from the L2A product metadata
+    :param meta_xml_file: Metadata file of the L2A product
+    :param band_id: Band index in the metadata
+    :return: BOA_ADD_OFFSET of the band, ValueError is raised if missing
+    """
     tree = ET.parse(meta_xml_file)
     root = tree.getroot()
-    #offset_band = root.find(f'.//BOA_ADD_OFFSET[@band_id="{band_id}"]').text
     offset_band_elt = root.find(f'.//BOA_ADD_OFFSET[@band_id="{band_id}"]')
-    if offset_band_elt:
-        offset_band_str=str(offset_band_elt.text)
-        offset_band = int(offset_band_str)
-    #offset_band = int(offset_band)
-    return offset_band
+    # An element without children is falsy, compare to None
+    if offset_band_elt is None:
+        raise ValueError(f"No BOA_ADD_OFFSET for band {band_id} in {meta_xml_file}")
+    return int(str(offset_band_elt.text))
 
 
 def apply_offset(
     raster_band: NDArray[int], meta_xml_file: str, band_id: str
 ) -> NDArray[int]:
+    """
+    Apply the BOA offset of a band in place, the results are clamped to the
+    range of the band dtype: nodata (0) pixels stay 0 and the valid pixels at
+    or below a negative offset are set to 1, so that they stay valid
+    :param raster_band: Band array, modified in place
+    :param meta_xml_file: Metadata file of the L2A product
+    :param band_id: Band index in the metadata
+    :return: The band array
+    """
+    import numpy as np
+
     # Read metadata
     offset_band = retrieve_offset_from_meta(meta_xml_file, band_id)
-    # Apply offset
+    # Apply offset in place, nodata (0) is kept so that empty blocks stay sparse
     logger.info("For band %s, offset is %s", band_id, offset_band)
-    raster_band = raster_band + offset_band
+    offset = raster_band.dtype.type(abs(offset_band))
+    top = np.iinfo(raster_band.dtype).max - offset
+    # Valid pixels stay valid: the ones at or below the negative offset are
+    # set to 1, not to the nodata value
+    bottom = raster_band.dtype.type(offset + 1)
+    # By chunks of rows, the valid mask of a chunk stays small
+    nb_chunks = max(raster_band.shape[-2] // 64, 1)
+    for rows in np.array_split(raster_band, nb_chunks, axis=-2):
+        valid = rows != 0
+        # Results are clamped to the range of the band dtype, as GDAL does
+        if offset_band < 0:
+            np.maximum(rows, bottom, out=rows, where=valid)
+            np.subtract(rows, offset, out=rows, where=valid)
+        else:
+            np.minimum(rows, top, out=rows, where=valid)
+            np.add(rows, offset, out=rows, where=valid)
     return raster_band
 
 
 def l2a_to_ard(
-    l2a_folder: Path, work_dir: Path, pid: str, provider: str, only_scl: bool = False
-) -> Path:
+    l2a_folder: Path,
+    work_dir: Path,
+    pid: str,
+    provider: str,
+    only_scl: bool = False,
+    layout: str = "band",
+    interleave: str = "pixel",
+    min_valid_fraction: float = 0.0,
+) -> Optional[Path]:
     """
     Convert an L2A product into EWoC ARD format
     :param only_scl:
     :param pid:
     :param l2a_folder: L2A SAFE folder
     :param work_dir: Output directory
+    :param layout: band for one file per band, stacked for one file per
+     resolution (the MASK is in its own file)
+    :param interleave: pixel or band interleaving of the stacked files
+    :param min_valid_fraction: Minimum fraction of valid pixels to write the ARD
+    :return: ARD product folder, None if the product has too few valid pixels
     """
-    if only_scl:
-        bands = {
-            "SCL": 20,
-        }
-    else:
-        bands = {
-            "B02": 10,
-            "B03": 10,
-            "B04": 10,
-            "B08": 10,
-            "B05": 20,
-            "B06": 20,
-            "B07": 20,
-            "B11": 20,
-            "B12": 20,
-            "SCL": 20,
-        }
+    bands = get_ard_bands(only_scl)
     # Prepare ewoc folder name
     prod_name = pid.replace(".SAFE", "")
-    product_id = prod_name
-    platform = product_id.split("_")[0]
-    date = product_id.split("_")[2]
-    year = date[:4]
-    # Get tile id , remove the T in the beginning
-    tile_id = product_id.split("_")[5][1:]
-    atcor_algo = "L2A"
-    unique_id = "".join(product_id.split("_")[3:6])
-    folder_st = (
-        work_dir
-        / "OPTICAL"
-        / tile_id[:2]
-        / tile_id[2]
-        / tile_id[3:]
-        / year
-        / date.split("T")[0]
+    source = get_source(provider)
+    band_paths = {
+        band: source.find_band(l2a_folder, band, res, pid)
+        for band, res in bands.items()
+    }
+    return bands_to_ard(
+        band_paths,
+        bands,
+        work_dir,
+        prod_name,
+        provider,
+        layout,
+        interleave,
+        min_valid_fraction,
     )
-    dir_name = f"{platform}_MSIL2A_{date}_{unique_id}_{tile_id}"
-    tmp_dir = folder_st / dir_name
-    ard_folder = folder_st / dir_name
-    tmp_dir.mkdir(exist_ok=False, parents=True)
-
-    # Convert bands and SCL
-    for band in bands:
-        res = bands[band]
-        if provider == "aws_sng" and S2PrdIdInfo.is_l2a(pid):
-            band_path = find_l2a_band_sng(l2a_folder, band, res)
-        else:
-            band_path = find_l2a_band(l2a_folder, band, res)
-        band_name = band_path.parts[-1]
-        band_name = band_name.replace(".jp2", ".tif").replace(f"_{str(res)}m", "")
-        logger.info("Processing band %s", band_name)
-        out_name = f"{platform}_{atcor_algo}_{date}_{unique_id}_{tile_id}_{band}.tif"
-        raster_fn = folder_st / dir_name / out_name
-        if band == "SCL":
-            out_cld = f"{platform}_{atcor_algo}_{date}_{unique_id}_{tile_id}_MASK.tif"
-            raster_cld = folder_st / dir_name / out_cld
-            binary_scl(band_path, raster_cld)
-            logger.info("Done --> %s", str(raster_cld))
-            try:
-                (raster_cld.with_suffix(".aux.xml")).unlink()
-            except FileNotFoundError:
-                logger.info("Clean")
-
-        else:
-            raster_to_ard(
-                band_path, band, raster_fn, pid=product_id, data_source=provider
-            )
-            logger.info("Done --> %s", str(raster_fn))
-    return ard_folder
 
 
 def l2a_to_ard_aws_cog(
@@ -217,78 +401,178 @@ def l2a_to_ard_aws_cog(
     work_dir: Path,
     provider: str,
     only_scl: bool = False,
-) -> Path:
+    layout: str = "band",
+    interleave: str = "pixel",
+    min_valid_fraction: float = 0.0,
+) -> Optional[Path]:
     """
     Convert an L2A product into EWoC ARD format
     :param l2a_folder: L2A SAFE folder
     :param work_dir: Output directory
+    :param layout: band for one file per band, stacked for one file per
+     resolution (the MASK is in its own file)
+    :param interleave: pixel or band interleaving of the stacked files
+    :param min_valid_fraction: Minimum fraction of valid pixels to write the ARD
+    :return: ARD product folder, None if the product has too few valid pixels
+    """
+    bands = get_ard_bands(only_scl)
+    band_paths = {band: l2a_folder / f"{band}.tif" for band in bands}
+    return bands_to_ard(
+        band_paths,
+        bands,
+        work_dir,
+        l2a_folder.name,
+        provider,
+        layout,
+        interleave,
+        min_valid_fraction,
+    )
+
+
+def ard_product_folder(work_dir: Path, product_id: str) -> Path:
+    """
+    Get the ARD folder of a product
+    :param work_dir: ARD root directory
+    :param product_id: Sentinel-2 product id (without .SAFE)
+    :return: OPTICAL/<zone>/<band>/<square>/<year>/<day>/<ARD product> folder
     """
-    if only_scl:
-        bands = {
-            "SCL": 20,
-        }
-    else:
-        bands = {
-            "B02": 10,
-            "B03": 10,
-            "B04": 10,
-            "B08": 10,
-            "B05": 20,
-            "B06": 20,
-            "B07": 20,
-            "B11": 20,
-            "B12": 20,
-            "SCL": 20,
-        }
-    # Prepare ewoc folder name
-    prod_name = l2a_folder.name
-    product_id = prod_name
     platform = product_id.split("_")[0]
     date = product_id.split("_")[2]
-    year = date[:4]
     # Get tile id , remove the T in the beginning
     tile_id = product_id.split("_")[5][1:]
-    atcor_algo = "L2A"
     unique_id = "".join(product_id.split("_")[3:6])
-    folder_st = (
+    return (
         work_dir
         / "OPTICAL"
         / tile_id[:2]
         / tile_id[2]
         / tile_id[3:]
-        / year
+        / date[:4]
         / date.split("T")[0]
+        / f"{platform}_MSIL2A_{date}_{unique_id}_{tile_id}"
     )
-    dir_name = f"{platform}_MSIL2A_{date}_{unique_id}_{tile_id}"
-    tmp_dir = folder_st / dir_name
-    ard_folder = folder_st / dir_name
-    tmp_dir.mkdir(exist_ok=False, parents=True)
 
-    # Convert bands and SCL
-    for band in bands:
-        band_path = l2a_folder / f"{band}.tif"
-        band_name = band_path.name
-        logger.info("Processing band %s", band_name)
-        out_name = f"{platform}_{atcor_algo}_{date}_{unique_id}_{tile_id}_{band}.tif"
-        raster_fn = folder_st / dir_name / out_name
-        if band == "SCL":
-            out_cld = f"{platform}_{atcor_algo}_{date}_{unique_id}_{tile_id}_MASK.tif"
-            raster_cld = folder_st / dir_name / out_cld
-            binary_scl(band_path, raster_cld)
-            logger.info("Done --> %s", str(raster_cld))
-            try:
-                (raster_cld.with_suffix(".aux.xml")).unlink()
-            except FileNotFoundError:
-                logger.info("Clean")
 
-        else:
-            raster_to_ard(
-                band_path, band, raster_fn, pid=product_id, data_source=provider
+def bands_to_ard(
+    band_paths: Dict[str, Path],
+    bands: Dict[str, int],
+    work_dir: Path,
+    product_id: str,
+    provider: str,
+    layout: str = "band",
+    interleave: str = "pixel",
+    min_valid_fraction: float = 0.0,
+) -> Optional[Path]:
+    """
+    Convert the L2A band files of a product into EWoC ARD format
+    :param band_paths: Band id to L2A band file
+    :param bands: Band id to resolution
+    :param work_dir: Output directory
+    :param product_id: Sentinel-2 product id (without .SAFE)
+    :param provider: Sentinel-2 product data source
+    :param layout: band for one file per band, stacked for one file per
+     resolution (the MASK is in its own file)
+    :param interleave: pixel or band interleaving of the stacked files
+    :param min_valid_fraction: Minimum fraction of valid pixels (from the SCL)
+     to write the ARD
+    :return: ARD product folder, None if the product has too few valid pixels
+    """
+    scl_mask = None
+    if min_valid_fraction > 0 and "SCL" in band_paths:
+        # Read once for the check and the MASK file
+        scl_mask = read_scl_mask(band_paths["SCL"])
+        fraction, _ = mask_footprint(scl_mask.mask[0], scl_mask.meta["transform"])
+        if fraction < min_valid_fraction:
+            logger.warning(
+                "%s has %.2f%% valid pixels (minimum %.2f%%), no ARD written",
+                product_id,
+                fraction * 100,
+                min_valid_fraction * 100,
             )
-            logger.info("Done --> %s", str(raster_fn))
+            return None
+    ard_folder = ard_product_folder(work_dir, product_id)
+    ard_folder.mkdir(exist_ok=False, parents=True)
+    ard_prefix = ard_file_prefix(product_id)
+
+    band_paths = dict(band_paths)
+    if layout == "stacked":
+        for res in sorted(set(bands.values())):
+            res_paths = {
+                band: band_paths[band]
+                for band in bands
+                if bands[band] == res and band != "SCL"
+            }
+            if len(res_paths) > 1:
+                raster_fn = ard_folder / f"{ard_prefix}_{res}M.tif"
+                stack_to_ard(
+                    res_paths,
+                    raster_fn,
+                    data_source=provider,
+                    pid=product_id,
+                    interleave=interleave,
+                )
+                logger.info("Done --> %s", str(raster_fn))
+                for band in res_paths:
+                    del band_paths[band]
+    elif layout != "band":
+        raise ValueError(f"ARD layout must be band or stacked, not {layout}")
+
+    # Convert bands and SCL
+    for band, band_path in band_paths.items():
+        band_to_ard(band, band_path, ard_folder, product_id, provider, scl_mask)
     return ard_folder
 
 
+def ard_file_prefix(product_id: str) -> str:
+    """
+    Get the prefix of the ARD files of a product
+    :param product_id: Sentinel-2 product id (without .SAFE)
+    :return: <platform>_L2A_<date>_<unique id>_<tile>
+    """
+    platform = product_id.split("_")[0]
+    date = product_id.split("_")[2]
+    # Get tile id , remove the T in the beginning
+    tile_id = product_id.split("_")[5][1:]
+    atcor_algo = "L2A"
+    unique_id = "".join(product_id.split("_")[3:6])
+    return f"{platform}_{atcor_algo}_{date}_{unique_id}_{tile_id}"
+
+
+def band_to_ard(
+    band: str,
+    band_path: Path,
+    ard_folder: Path,
+    product_id: str,
+    provider: str,
+    scl_mask: Optional[SclMask] = None,
+) -> Path:
+    """
+    Convert a L2A band file into an EWoC ARD file, the SCL to the cloud mask
+    :param band: Band id
+    :param band_path: L2A band file
+    :param ard_folder: ARD product folder
+    :param product_id: Sentinel-2 product id (without .SAFE)
+    :param provider: Sentinel-2 product data source
+    :param scl_mask: SCL file already read, used for the SCL band
+    :return: ARD file
+    """
+    ard_prefix = ard_file_prefix(product_id)
+    logger.info("Processing band %s", band_path.name)
+    if band == "SCL":
+        raster_cld = ard_folder / f"{ard_prefix}_MASK.tif"
+        binary_scl(band_path, raster_cld, scl_mask)
+        logger.info("Done --> %s", str(raster_cld))
+        try:
+            (raster_cld.with_suffix(".aux.xml")).unlink()
+        except FileNotFoundError:
+            logger.info("Clean")
+        return raster_cld
+    raster_fn = ard_folder / f"{ard_prefix}_{band}.tif"
+    raster_to_ard(band_path, band, raster_fn, pid=product_id, data_source=provider)
+    logger.info("Done --> %s", str(raster_fn))
+    return raster_fn
+
+
 def get_s2_prodname(safe_path: Path) -> str:
     """
     Get Sentinel-2 product name
@@ -303,17 +587,27 @@ def get_s2_prodname(safe_path: Path) -> str:
     return prodname
 
 
-def raster_to_ard(
-    raster_path: Path, band_num: str, raster_fn: Path, data_source: str, pid: str
-) -> None:
+def read_ard_band(
+    raster_path: Path,
+    band_num: str,
+    data_source: str,
+    pid: str,
+    out: Optional[NDArray[int]] = None,
+) -> Tuple[NDArray[int], Dict]:
     """
-    Read raster and update internals to fit ewoc ard specs
+    Read raster and update internals to fit ewoc ard specs, the offset is
+    applied in place
     :param raster_path: Path to raster file
     :param band_num: Band number, B02 for example
-    :param raster_fn: Output raster path
     :param data_source: source of the Sentinel-2 data
     :param pid: Sentinel-2 product id
+    :param out: Array (1 band) to read the band into, a buffer of the process
+     if None
+    :return: Band array (1 band) and its raster metadata, the buffer is reused
+     by the next call
     """
+    from ewoc_dag.eo_prd_id.s2_prd_id import S2PrdIdInfo
+    import rasterio
 
     band_id = {
         "B01": 0,
@@ -331,55 +625,113 @@ def raster_to_ard(
         "B12": 12,
     }
 
-    with rasterio.Env(GDAL_CACHEMAX=2048):
-        with rasterio.open(raster_path, "r") as src:
-            raster_array = src.read()
-
-            if (
-                S2PrdIdInfo(pid).datatake_sensing_start_time.date()
-                > datetime(2022, 1, 25).date()
-                and S2PrdIdInfo(pid).pdgs_processing_baseline_number != "0400"
-            ):
-                logger.warning(
-                    "Need to handle processing baselines after 0400 and check if an offset has to be applied"
-                )
+    apply_gdal_profile()
+    with rasterio.open(raster_path, "r") as src:
+        if out is None:
+            shape = (src.count, src.height, src.width)
+            out = get_buffer("band", shape, src.dtypes[0])
+        raster_array = src.read(out=out)
+
+        if (
+            S2PrdIdInfo(pid).datatake_sensing_start_time.date()
+            > datetime(2022, 1, 25).date()
+            and S2PrdIdInfo(pid).pdgs_processing_baseline_number != "0400"
+        ):
+            logger.warning(
+                "Need to handle processing baselines after 0400 and check if an offset has to be applied"
+            )
 
-            if (
-                S2PrdIdInfo(pid).pdgs_processing_baseline_number == "0400"
-                and data_source == "aws_sng"
-            ):
-                logger.info(
-                    f"Baseline is {S2PrdIdInfo(pid).pdgs_processing_baseline_number} and provider is {data_source}"
-                )
-                meta_xml_file = raster_path.parents[2] / "product/metadata.xml"
-                raster_array = apply_offset(
-                    raster_array, str(meta_xml_file), str(band_id[band_num])
-                )
+        if needs_boa_offset(pid, data_source):
+            logger.info(
+                f"Baseline is {S2PrdIdInfo(pid).pdgs_processing_baseline_number} and provider is {data_source}"
+            )
+            meta_xml_file = raster_path.parents[2] / "product/metadata.xml"
+            raster_array = apply_offset(
+                raster_array, str(meta_xml_file), str(band_id[band_num])
+            )
 
-            meta = src.meta.copy()
+        meta = src.meta.copy()
     meta["driver"] = "GTiff"
     meta["nodata"] = 0
-    bands_10m = ["B02", "B03", "B04", "B08"]
+    return raster_array, meta
+
+
+def raster_to_ard(
+    raster_path: Path, band_num: str, raster_fn: Path, data_source: str, pid: str
+) -> None:
+    """
+    Read raster and update internals to fit ewoc ard specs
+    :param raster_path: Path to raster file
+    :param band_num: Band number, B02 for example
+    :param raster_fn: Output raster path
+    :param data_source: source of the Sentinel-2 data
+    :param pid: Sentinel-2 product id
+    """
+    raster_array, meta = read_ard_band(raster_path, band_num, data_source, pid)
     blocksize = 512
-    if band_num in bands_10m:
+    if band_num in BANDS_10M:
         blocksize = 1024
-    with rasterio.open(
+    write_ard_raster(
         raster_fn,
-        "w+",
-        **meta,
-        tiled=True,
-        compress="deflate",
-        blockxsize=blocksize,
-        blockysize=blocksize,
-    ) as out:
-        # Modify output metadata
-        out.update_tags(TIFFTAG_DATETIME=str(datetime.now()))
-        out.update_tags(TIFFTAG_IMAGEDESCRIPTION="EWoC Sentinel-2 ARD")
-        out.update_tags(TIFFTAG_SOFTWARE="EWoC S2 Processor " + str(__version__))
-        out.update_tags(DATASOURCE=f"S2 data source: {data_source}")
-        out.update_tags(PRODUCTID=f"S2 product id: {pid}")
+        raster_array,
+        meta,
+        blocksize,
+        tags={
+            "DATASOURCE": f"S2 data source: {data_source}",
+            "PRODUCTID": f"S2 product id: {pid}",
+        },
+        band_tags=[band_stats(raster_array[0], meta["nodata"])],
+    )
 
-        out.write(raster_array)
+
+def stack_to_ard(
+    band_paths: Dict[str, Path],
+    raster_fn: Path,
+    data_source: str,
+    pid: str,
+    interleave: str = "pixel",
+) -> None:
+    """
+    Read the bands of one resolution and write them as a multi-band ARD
+    :param band_paths: Band id to raster file, all at the same resolution,
+     without the SCL
+    :param raster_fn: Output raster path
+    :param data_source: source of the Sentinel-2 data
+    :param pid: Sentinel-2 product id
+    :param interleave: pixel or band interleaving
+    """
+    import numpy as np
+    import rasterio
+
+    with rasterio.open(next(iter(band_paths.values())), "r") as src:
+        shape = (len(band_paths), src.height, src.width)
+    # The bands are read into their place in the stack
+    stack = get_buffer("stack", shape, np.uint16)
+    meta: Dict = {}
+    band_tags = []
+    tags = {
+        "DATASOURCE": f"S2 data source: {data_source}",
+        "PRODUCTID": f"S2 product id: {pid}",
+    }
+    for bidx, (band_num, band_path) in enumerate(band_paths.items()):
+        _, meta = read_ard_band(
+            band_path, band_num, data_source, pid, out=stack[bidx : bidx + 1]
+        )
+        band_tags.append(band_stats(stack[bidx], meta["nodata"]))
+    meta.update(count=len(band_paths), dtype="uint16")
+    blocksize = 512
+    if set(band_paths).issubset(BANDS_10M):
+        blocksize = 1024
+    write_ard_raster(
+        raster_fn,
+        stack,
+        meta,
+        blocksize,
+        tags=tags,
+        band_descriptions=list(band_paths),
+        band_tags=band_tags,
+        interleave=interleave,
+    )
 
 
 def find_l2a_band(l2a_folder: Path, band_num: str, res: int) -> Path:
@@ -390,11 +742,13 @@ def find_l2a_band(l2a_folder: Path, band_num: str, res: int) -> Path:
     :param res: resolution (10/20/60)
     :return: path to band
     """
-    # band_path = None
+    band_path = None
     id_img = f"{band_num}_{str(res)}m.jp2"
     for file in walk(l2a_folder):
         if str(file).endswith(id_img):
             band_path = file
+    if band_path is None:
+        raise FileNotFoundError(f"No {id_img} in {l2a_folder}")
     return band_path
 
 
@@ -406,13 +760,15 @@ def find_l2a_band_sng(l2a_folder: Path, band_num: str, res: int) -> Path:
     :param res: resolution (10/20/60)
     :return: path to band
     """
-    # band_path = None
+    band_path = None
     id_img = f"{band_num}.jp2"
     res_img = f"R{res}m"
     for file in walk(l2a_folder):
         fold_img = file.parts[-2]
         if str(file).endswith(id_img) and res_img == fold_img:
             band_path = file
+    if band_path is None:
+        raise FileNotFoundError(f"No {id_img} in {l2a_folder}")
     return band_path
 
 
@@ -444,39 +800,6 @@ def set_logger(verbose_v: str) -> None:
         set_sen2cor_log(loglevel)
 
 
-def run_s2c(
-    l1c_safe: Path,
-    l2a_out: Path,
-    only_scl: bool = False,
-    bin_path: str = "./Sen2Cor-02.09.00-Linux64/bin/L2A_Process",
-) -> Path:
-    """
-    Run sen2cor subprocess
-    :param l1c_safe: Path to SAFE folder
-    :param l2a_out: Path to output directory for generated L2A products
-    :return: Path to L2A SAFE
-    """
-    # L2A_Process is expected to be added to /bin/
-    # After installing sen2cor run source Sen2Cor-02.09.00-Linux64/L2A_Bashrc
-    # This should work in container and local env
-    if only_scl:
-        s2c_cmd = f"{bin_path} {l1c_safe} --output_dir {l2a_out} --sc_only"
-    else:
-        s2c_cmd = (
-            f"{bin_path} {l1c_safe} --output_dir {l2a_out} --resolution 10 --debug"
-        )
-    try:
-        execute_cmd(s2c_cmd)
-    except RuntimeError:
-        logger.error("Sen2cor execution error")
-        sys.exit(1)
-    # TODO: select folder using date and tile id from l1 id
-    l2a_safe_folder = [
-        l2a_out / fold for fold in os.listdir(l2a_out) if fold.endswith("SAFE")
-    ][0]
-    return l2a_safe_folder
-
-
 def clean(folder: Path) -> None:
     """
     Delete folder recursively
@@ -502,20 +825,25 @@ def last_safe(safe_folder) -> str:
 
 def ewoc_s3_upload(local_path: Path, ard_prd_prefix: str) -> None:
     """
-    Upload file to the Cloud (S3 bucket)
+    Upload file to the Cloud (S3 bucket), files already uploaded with the
+    same content are skipped
     :param local_path: Path to the file to be uploaded
     :param ard_prd_prefix: Bucket prefix where store data
     :return: None
     """
+    import boto3.exceptions
+
     try:
         # Try to upload to s3 bucket,
         # you'll need to define some env vars needed for the s3 client
         # and destination path
-        nb_prd_pr, __unused, up_dir_pr = EWOCARDBucket().upload_ard_prd(
-            local_path, ard_prd_prefix
-        )
+        report = upload_ard(local_path, ard_prd_prefix)
         # This print is made on purpose (not debug) :)
-        print(f"Uploaded {nb_prd_pr} tif files to bucket | {up_dir_pr}")
+        print(
+            f"Uploaded {report.uploaded} tif files to bucket | {report.up_dir} | "
+            f"{report.skipped} unchanged files skipped "
+            f"({report.bytes_saved / 1e6:.1f} MB saved)"
+        )
         # <!> Delete output folder after upload
         clean(local_path)
         logger.info("%s cleared", local_path)
@@ -553,124 +881,12 @@ def make_tmp_dirs(work_dir: Path) -> Tuple[Path, Path]:
     return out_dir_in, out_dir_proc
 
 
-def custom_s2c_dem(dem_type: str, tile_id: str) -> Tuple[Path, List]:
-    """
-    Download and create a DEM mosaïc
-    :param dem_type: DEM type (srtm or copdem)
-    :param tile_id: MGRS tile id (ex 31TCJ Toulouse)
-    :return: DEM temporary directory and list of links to the downloaded DEM files
-    """
-    # Generate temporary folder
-    dem_tmp_dir = Path("/work/SEN2TEST/DEM/")
-    if dem_tmp_dir.exists():
-        shutil.rmtree(dem_tmp_dir)
-    dem_tmp_dir.mkdir(exist_ok=False, parents=True)
-    # Clear the folder from tiles remaining from previous runs
-    s2c_docker_dem_folder = f"/root/sen2cor/2.9/dem/{dem_type}"
-    s2c_docker_dem_path = Path(f"/root/sen2cor/2.9/dem/{dem_type}")
-    if s2c_docker_dem_path.exists():
-        clean(s2c_docker_dem_path)
-        logger.info("/root/sen2cor/2.9/dem/%s --> clean (deleted)", dem_type)
-    # Create (back) the dem folder
-    s2c_docker_dem_path.mkdir(parents=True)
-    logger.info("/root/sen2cor/2.9/dem/%s --> created", dem_type)
-    # Download the dem files
-    if dem_type == "srtm":
-        get_dem_data(
-            tile_id,
-            Path(dem_tmp_dir),
-            dem_source="ewoc",
-            dem_type=dem_type,
-            dem_resolution="3s",
-        )
-        raster_list = glob.glob(os.path.join(dem_tmp_dir, "srtm3s", "*.tif"))
-    elif dem_type == "copdem":
-        get_dem_data(
-            tile_id,
-            Path(dem_tmp_dir),
-            dem_source="aws",
-            dem_type=dem_type,
-            dem_resolution="3s",
-        )
-        raster_list = glob.glob(os.path.join(dem_tmp_dir, "*.tif"))
-    else:
-        raise AttributeError("Attribute dem_type must be srtm or copdem")
-
-    sources = []
-    uid = uuid.uuid4()
-    output_fn = os.path.join(dem_tmp_dir, f"mosaic_{uid}.tif")
-
-    for raster_name in raster_list:
-        src = rasterio.open(raster_name)
-        sources.append(src)
-    merge(sources, dst_path=output_fn, method="max")
-    logger.info("Created mosaic %s", output_fn)
-    for src in sources:
-        src.close()
-    links = []
-
-    # Artificially change copdem filenames to srtm filenames
-    # to run sen2cor 2.9 with copdem
-    if dem_type == "copdem":
-        raster_list = get_srtm3s_ids(tile_id)
-
-    for raster_name in raster_list:
-        try:
-            if dem_type == "copdem":
-                raster_name = raster_name + ".tif"
-            # raster_name = os.path.basename(raster_name).replace("_COG_", "_")
-            if dem_type == "srtm":
-                raster_name = os.path.basename(raster_name)
-            os.symlink(output_fn, os.path.join(s2c_docker_dem_folder, raster_name))
-            links.append(Path(os.path.join(s2c_docker_dem_folder, raster_name)))
-        except OSError:
-            logger.info("Symlink error: probably already exists")
-    return dem_tmp_dir, links
-
-
-def unlink(links: List) -> None:
-    """
-    Remove symlinks created
-    :param links: List of links
-    :return: None
-    """
-    for symlink in links:
-        try:
-            symlink.unlink()
-            logger.info(" -- [Ok] Unlinked %s", symlink)
-        except FileNotFoundError:
-            logger.info("Cannot unlink %s", symlink)
-
-
-def edit_xml_config_file(dem_type):
-    """
-    Edit xml config file depending on DEM used
-    :param dem_type: DEM type
-    """
-    s2c_docker_cfg_file = "/root/sen2cor/2.9/cfg/L2A_GIPP.xml"
-    tree = ET.parse(s2c_docker_cfg_file)
-    root = tree.getroot()
-    for name in root.iter("DEM_Directory"):
-        name.text = f"dem/{dem_type}"
-    for name in root.iter("DEM_Reference"):
-        if dem_type == "srtm":
-            name.text = (
-                "http://srtm.csi.cgiar.org/wp-content/uploads/files/srtm_5x5/TIFF/"
-            )
-        elif dem_type == "copdem":
-            name.text = "NONE"
-        else:
-            raise AttributeError("Attribute dem_type must be srtm or copdem")
-    tree.write(s2c_docker_cfg_file, encoding="utf-8", xml_declaration=True)
-    logger.info("%s --> edited with DEM infos", s2c_docker_cfg_file)
-
-
 def set_sen2cor_log(loglevel: str) -> None:
     """
     Edit xml config file depending on DEM used
     :param dem_type: DEM type
     """
-    s2c_docker_cfg_file = "/root/sen2cor/2.9/cfg/L2A_GIPP.xml"
+    s2c_docker_cfg_file = SEN2COR_ROOT / "cfg" / "L2A_GIPP.xml"
     tree = ET.parse(s2c_docker_cfg_file)
     root = tree.getroot()
     for name in root.iter("Log_Level"):
@@ -689,24 +905,3 @@ def walk(path: Path) -> Generator:
             yield from walk(cur_path)
             continue
         yield cur_path.resolve()
-
-
-def execute_cmd(cmd: str) -> None:
-    """
-    Execute the given cmd.
-    :param cmd: The command and its parameters to execute
-    """
-    logger.debug("Launching command: %s", cmd)
-    try:
-        subprocess.run(cmd, shell=True, check=True)
-    except subprocess.CalledProcessError as err:
-        logger.error(
-            "Following error code %s \
-            occurred while running command %s with following output:\
-            %s / %s",
-            err.returncode,
-            err.cmd,
-            err.stdout,
-            err.stderr,
-        )
-        raise
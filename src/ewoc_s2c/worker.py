@@ -0,0 +1,190 @@
+""" EWoC Sen2Cor long-lived worker module"""
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import signal
+import time
+from typing import Any, Dict, Optional
+
+from ewoc_s2c.gdal_env import apply_gdal_profile
+from ewoc_s2c.jobqueue import Job
+from ewoc_s2c.utils import WORK_ROOT, set_logger
+
+logger = logging.getLogger(__name__)
+
+WORKERS_DIR = WORK_ROOT / "WORKERS"
+
+
+def init_worker(verbose: Optional[str], concurrency: int) -> None:
+    """
+    Initialize a worker process: logging, GDAL profile, and load the heavy
+    dependencies once for all the jobs of the process
+    :param verbose: verbose level
+    :param concurrency: Number of worker processes sharing the host
+    """
+    # The main process handles the interruption and drains the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_logger(verbose)
+    apply_gdal_profile(concurrency)
+    import numpy  # noqa: F401 pylint: disable=unused-import
+    import rasterio
+
+    with rasterio.Env():
+        pass
+
+
+def worker_pool(concurrency: int, verbose: Optional[str]) -> ProcessPoolExecutor:
+    """
+    Create a pool of warm worker processes, spawned rather than forked from
+    the main process and its threads
+    :param concurrency: Number of worker processes
+    :param verbose: verbose level of the workers
+    :return: Process pool
+    """
+    return ProcessPoolExecutor(
+        max_workers=concurrency,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(verbose, concurrency),
+    )
+
+
+def abandon_file(work_root: Path, job: Job) -> Path:
+    """
+    Get the file telling a worker process to abandon a job
+    :param work_root: Root of the worker work folders
+    :param job: Claimed job
+    :return: Marker file, created when the job is claimed again elsewhere
+    """
+    return work_root / "abandoned" / f"{job.job_id}.{job.attempts}"
+
+
+def run_job(
+    pid: str, params: Dict[str, Any], work_root: Path, abandoned: Path
+) -> float:
+    """
+    Process a product in a worker process
+    :param pid: Sentinel-2 product id
+    :param params: Job parameters: production id, predicted time and
+     processing options
+    :param work_root: Root of the worker work folders
+    :param abandoned: Marker file of the job, the product is not uploaded
+     if it exists
+    :return: Processing time in seconds
+    """
+    from ewoc_s2c.pipeline import ProcessingOptions, process_product
+
+    start = time.perf_counter()
+    params = dict(params)
+    production_id = params.pop("production_id", "0000")
+    predicted_seconds = params.pop("predicted_seconds", None)
+    process_product(
+        pid,
+        production_id,
+        ProcessingOptions.from_params(params),
+        predicted_seconds=predicted_seconds,
+        owned=lambda: not abandoned.exists(),
+        l2a_dir=work_root / f"worker_{os.getpid()}",
+    )
+    return time.perf_counter() - start
+
+
+def has_pending_jobs(queue: Any) -> bool:
+    """
+    Check if a queue has jobs which are not finished
+    :param queue: Job queue (see ewoc_s2c.jobqueue)
+    :return: True if jobs are queued or being processed
+    """
+    counts = queue.stats()
+    return counts.get("queued", 0) + counts.get("running", 0) > 0
+
+
+def serve(
+    queue: Any,
+    concurrency: int = 1,
+    visibility_timeout: float = 3600,
+    drain: bool = False,
+    max_attempts: int = 3,
+    poll_interval: float = 10,
+    verbose: Optional[str] = None,
+    work_root: Path = WORKERS_DIR,
+) -> Dict[str, int]:
+    """
+    Process the products of a job queue with warm worker processes.
+    SIGTERM or SIGINT stop the claims, the jobs in progress are finished.
+    :param queue: Job queue (see ewoc_s2c.jobqueue)
+    :param concurrency: Number of worker processes
+    :param visibility_timeout: Seconds before a claimed job is visible again,
+     the claims are extended while the jobs are processed
+    :param drain: True to stop when all the jobs of the queue are finished
+    :param max_attempts: Number of attempts before a job is marked as failed
+    :param poll_interval: Seconds between two polls of an empty queue
+    :param verbose: verbose level of the workers
+    :param work_root: Root of the worker work folders
+    :return: Number of done, failed and abandoned jobs
+    """
+    stopping = False
+
+    def _stop(signum: int, _frame: Any) -> None:
+        nonlocal stopping
+        logger.warning("Received signal %s, draining the workers", signum)
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    counts = {"done": 0, "failed": 0, "abandoned": 0}
+    in_flight: Dict[Future, Job] = {}
+    (work_root / "abandoned").mkdir(parents=True, exist_ok=True)
+    with worker_pool(concurrency, verbose) as executor:
+        while True:
+            while not stopping and len(in_flight) < concurrency:
+                job = queue.claim(visibility_timeout)
+                if job is None:
+                    break
+                logger.info("Claimed %s (attempt %s)", job.pid, job.attempts)
+                future = executor.submit(
+                    run_job,
+                    job.pid,
+                    job.params,
+                    work_root,
+                    abandon_file(work_root, job),
+                )
+                in_flight[future] = job
+            if not in_flight:
+                # Jobs leased by other workers are claimed again if they die
+                if stopping or (drain and not has_pending_jobs(queue)):
+                    break
+                time.sleep(poll_interval)
+                continue
+            done, _ = wait(
+                list(in_flight), timeout=poll_interval, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                job = in_flight.pop(future)
+                abandoned = abandon_file(work_root, job)
+                # Claimed again by another worker: neither acked nor released
+                if abandoned.exists() or not queue.extend(job, visibility_timeout):
+                    logger.warning("%s abandoned, its lease was lost", job.pid)
+                    abandoned.unlink(missing_ok=True)
+                    counts["abandoned"] += 1
+                    continue
+                try:
+                    duration = future.result()
+                except (Exception, SystemExit) as err:  # pylint: disable=broad-except
+                    retry = job.attempts < max_attempts
+                    logger.error("%s failed: %r (retry: %s)", job.pid, err, retry)
+                    queue.nack(job, repr(err), retry=retry)
+                    counts["failed"] += not retry
+                else:
+                    logger.info("%s done in %.1fs", job.pid, duration)
+                    queue.ack(job)
+                    counts["done"] += 1
+            for future, job in in_flight.items():
+                if not queue.extend(job, visibility_timeout):
+                    # Not started yet or stopped before its upload
+                    future.cancel()
+                    abandon_file(work_root, job).touch()
+    logger.info("Worker stopped: %s", counts)
+    return counts
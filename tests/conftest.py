@@ -7,4 +7,31 @@
     - https://docs.pytest.org/en/stable/writing_plugins.html
 """
 
-# import pytest
+import pytest
+
+
+@pytest.fixture
+def ard_bucket():
+    """Name of the mocked ARD bucket"""
+    return "ewoc-ard-test"
+
+
+@pytest.fixture
+def s3_client(monkeypatch, ard_bucket):
+    """
+    S3 client of a mocked S3 service, with an empty ARD bucket used by the
+    ARD uploads
+    """
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=ard_bucket)
+        for module in ("ewoc_s2c.upload", "ewoc_s2c.sinks"):
+            monkeypatch.setattr(
+                f"{module}.ard_bucket_client", lambda: (client, ard_bucket)
+            )
+        yield client
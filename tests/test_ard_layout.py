@@ -0,0 +1,111 @@
+""" Tests of the ARD file layouts"""
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from ewoc_s2c import utils
+from ewoc_s2c.utils import bands_to_ard, get_ard_bands
+
+pytest.importorskip("ewoc_dag")
+
+PRODUCT_ID = "S2B_MSIL2A_20220322T105629_N0400_R094_T31UFQ_20220322T122423"
+ARD_PREFIX = "S2B_L2A_20220322T105629_N0400R094T31UFQ_31UFQ"
+
+
+def _l2a_bands(tmp_path, scl_value=4):
+    """L2A band files of a small product, the SCL with a nodata row"""
+    band_paths = {}
+    for band, res in get_ard_bands().items():
+        size = 40 // res
+        if band == "SCL":
+            data = np.full((size, size), scl_value, np.uint8)
+            data[0] = 0
+        else:
+            data = np.full((size, size), 1000 + res, np.uint16)
+        band_paths[band] = tmp_path / "l2a" / f"T31UFQ_{band}_{res}m.tif"
+        band_paths[band].parent.mkdir(exist_ok=True)
+        with rasterio.open(
+            band_paths[band],
+            "w",
+            driver="GTiff",
+            height=size,
+            width=size,
+            count=1,
+            dtype=data.dtype,
+            crs="EPSG:32631",
+            transform=from_origin(600000, 5700000, res, res),
+        ) as dst:
+            dst.write(data, 1)
+    return band_paths
+
+
+def test_stacked_layout(tmp_path):
+    """The stacked files hold the bands, the MASK has its own file"""
+    ard_folder = bands_to_ard(
+        _l2a_bands(tmp_path),
+        get_ard_bands(),
+        tmp_path / "ard",
+        PRODUCT_ID,
+        "creodias",
+        layout="stacked",
+    )
+
+    assert sorted(path.name for path in ard_folder.glob("*.tif")) == [
+        f"{ARD_PREFIX}_10M.tif",
+        f"{ARD_PREFIX}_20M.tif",
+        f"{ARD_PREFIX}_MASK.tif",
+    ]
+    stacks = {
+        "10M": ["B02", "B03", "B04", "B08"],
+        "20M": ["B05", "B06", "B07", "B11", "B12"],
+    }
+    for res, bands in stacks.items():
+        with rasterio.open(ard_folder / f"{ARD_PREFIX}_{res}.tif") as src:
+            assert src.dtypes[0] == "uint16"
+            assert src.nodata == 0
+            assert list(src.descriptions) == bands
+    with rasterio.open(ard_folder / f"{ARD_PREFIX}_MASK.tif") as src:
+        assert src.dtypes[0] == "uint8"
+        assert src.nodata == 255
+        assert src.tags()["VALID_FRACTION"] == "0.5000"
+        assert (src.read(1)[0] == 255).all()
+
+
+def test_scl_read_once(tmp_path, monkeypatch):
+    """The SCL read for the valid fraction check is used for the MASK"""
+    calls = []
+    read_scl = utils.read_scl
+
+    def _read_scl(scl_file):
+        calls.append(scl_file)
+        return read_scl(scl_file)
+
+    monkeypatch.setattr(utils, "read_scl", _read_scl)
+    ard_folder = bands_to_ard(
+        _l2a_bands(tmp_path),
+        get_ard_bands(),
+        tmp_path / "ard",
+        PRODUCT_ID,
+        "creodias",
+        min_valid_fraction=0.25,
+    )
+
+    assert (ard_folder / f"{ARD_PREFIX}_MASK.tif").exists()
+    assert len(calls) == 1
+
+
+def test_too_few_valid_pixels(tmp_path):
+    """No ARD is written below the minimum valid fraction"""
+    assert (
+        bands_to_ard(
+            _l2a_bands(tmp_path),
+            get_ard_bands(),
+            tmp_path / "ard",
+            PRODUCT_ID,
+            "creodias",
+            min_valid_fraction=0.75,
+        )
+        is None
+    )
+    assert not (tmp_path / "ard").exists()
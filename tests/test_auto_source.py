@@ -0,0 +1,105 @@
+""" Tests of the fastest source selection"""
+import threading
+import time
+
+import pytest
+
+from ewoc_s2c import auto_source
+from ewoc_s2c.auto_source import AutoSource, rank_sources
+from ewoc_s2c.sources import DataSource
+
+PID = "S2B_MSIL1C_20220322T105629_N0400_R094_T30SWF_20220322T131655.SAFE"
+
+
+@pytest.fixture(name="sources")
+def fixture_sources(monkeypatch):
+    """Plain data sources, no fetch statistics recorded"""
+    sources = {name: DataSource(name) for name in ("fast", "slow", "other")}
+    monkeypatch.setattr(auto_source, "get_source", sources.__getitem__)
+    monkeypatch.setattr(auto_source, "source_health", dict)
+    monkeypatch.setattr(auto_source, "record_source_fetch", lambda *args: None)
+    return sources
+
+
+def test_rank_unknown_source_neutral(monkeypatch):
+    """A source without latency ranks as the mean, failing sources last"""
+    health = {
+        "fast:MSIL1C": {"latency": 10.0},
+        "slow:MSIL1C": {"latency": 50.0},
+        "broken:MSIL1C": {"latency": 1.0, "failures": 5, "failed_at": 1e12},
+        "new:MSIL1C": {"latency": None, "failures": 1},
+    }
+    monkeypatch.setattr(auto_source, "source_health", lambda: health)
+
+    assert rank_sources(["broken", "slow", "new", "unseen", "fast"], "MSIL1C") == [
+        "fast",
+        "new",
+        "unseen",
+        "slow",
+        "broken",
+    ]
+    assert rank_sources(["b", "a"], "MSIL1C") == ["b", "a"]
+
+
+def test_race_returns_winner(tmp_path, sources):
+    """The winner is returned before the loser ends, which removes its folder"""
+    release = threading.Event()
+    loser_done = threading.Event()
+
+    def _fetch(source, race_dir):
+        prd_path = race_dir / PID
+        prd_path.mkdir()
+        if source.name == "slow":
+            release.wait(10)
+            loser_done.set()
+        return prd_path
+
+    race = AutoSource("auto", ["slow", "fast"], hedge_delay=0.01)
+    prd_path = race._race(  # pylint: disable=protected-access
+        PID, tmp_path, [sources["slow"], sources["fast"]], _fetch
+    )
+
+    assert prd_path == tmp_path / "auto_fast" / PID
+    assert race.provider(prd_path) is sources["fast"]
+    assert not loser_done.is_set()
+    assert (tmp_path / "auto_slow").exists()
+    release.set()
+    assert loser_done.wait(10)
+    for _ in range(100):
+        if not (tmp_path / "auto_slow").exists():
+            break
+        time.sleep(0.05)
+    assert not (tmp_path / "auto_slow").exists()
+    assert prd_path.exists()
+
+
+def test_race_next_source_on_failure(tmp_path, sources):
+    """A failed source is replaced by the next one, its folder removed"""
+
+    def _fetch(source, race_dir):
+        if source.name == "fast":
+            raise ValueError("Connection reset")
+        prd_path = race_dir / PID
+        prd_path.mkdir()
+        return prd_path
+
+    race = AutoSource("auto", ["fast", "other"], hedge_delay=None)
+    prd_path = race._race(  # pylint: disable=protected-access
+        PID, tmp_path, [sources["fast"], sources["other"]], _fetch
+    )
+
+    assert prd_path == tmp_path / "auto_other" / PID
+    assert not (tmp_path / "auto_fast").exists()
+
+
+def test_race_all_failed(tmp_path, sources):
+    """The errors of all the sources are raised"""
+
+    def _fetch(source, race_dir):
+        raise ValueError(f"{source.name} down")
+
+    race = AutoSource("auto", ["fast", "other"], hedge_delay=None)
+    with pytest.raises(ValueError, match="fast down.*other down"):
+        race._race(  # pylint: disable=protected-access
+            PID, tmp_path, [sources["fast"], sources["other"]], _fetch
+        )
@@ -0,0 +1,67 @@
+""" Tests of the per-tile datacube"""
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from ewoc_s2c.datacube import ARD_BAND_GROUPS, append_ard_to_datacube
+
+zarr = pytest.importorskip("zarr")
+
+PRD_NAME = "S2B_MSIL2A_{date}T105629_N0400_R094_31UFQ"
+
+
+def _ard_folder(tmp_path, date, value):
+    """ARD product with constant bands (and mask) of a date"""
+    ard_folder = tmp_path / "ard" / PRD_NAME.format(date=date)
+    ard_folder.mkdir(parents=True)
+    bands = {band: (4, 4) for band in ARD_BAND_GROUPS["10m"]}
+    bands.update({band: (2, 2) for band in ARD_BAND_GROUPS["20m"] + ["MASK"]})
+    for band, shape in bands.items():
+        dtype = "uint8" if band == "MASK" else "uint16"
+        with rasterio.open(
+            ard_folder / f"{ard_folder.name}_{band}.tif",
+            "w",
+            driver="GTiff",
+            height=shape[0],
+            width=shape[1],
+            count=1,
+            dtype=dtype,
+            crs="EPSG:32631",
+            transform=from_origin(600000, 5700000, 40 / shape[0], 40 / shape[0]),
+        ) as dst:
+            dst.write(np.full(shape, 1 if band == "MASK" else value, dtype), 1)
+    return ard_folder
+
+
+def test_append_dates(tmp_path):
+    """Each date is a time step of the tile arrays"""
+    cube_dir = tmp_path / "cube"
+    for date, value in (("20220322", 100), ("20220401", 200)):
+        cube_path = append_ard_to_datacube(
+            _ard_folder(tmp_path, date, value), cube_dir, time_chunk=2
+        )
+
+    assert cube_path == cube_dir / "31UFQ.zarr"
+    root = zarr.open_group(str(cube_path), mode="r")
+    assert root.attrs["dates"] == ["20220322T105629", "20220401T105629"]
+    assert root["10m/data"].shape == (2, 4, 4, 4)
+    assert root["20m/data"].shape == (2, 5, 2, 2)
+    assert root["20m/mask"].shape == (2, 1, 2, 2)
+    assert root["10m"].attrs["bands"] == ARD_BAND_GROUPS["10m"]
+    assert root["20m"].attrs["crs"] == "EPSG:32631"
+    assert (root["10m/data"][1] == 200).all()
+    assert (root["20m/mask"][0] == 1).all()
+
+
+def test_append_same_date_overwrites(tmp_path):
+    """An ARD product appended twice keeps a single time step"""
+    cube_dir = tmp_path / "cube"
+    append_ard_to_datacube(_ard_folder(tmp_path / "a", "20220322", 100), cube_dir)
+    cube_path = append_ard_to_datacube(
+        _ard_folder(tmp_path / "b", "20220322", 300), cube_dir
+    )
+
+    root = zarr.open_group(str(cube_path), mode="r")
+    assert root.attrs["dates"] == ["20220322T105629"]
+    assert (root["20m/data"][:] == 300).all()
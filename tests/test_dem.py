@@ -0,0 +1,135 @@
+""" Tests of the DEM tile acquisition"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+from ewoc_s2c.dem import DemCache, copdem_tile_ids, download_url, s2_tile_bounds
+
+DEM_ID = "Copernicus_DSM_COG_30_N43_00_E001_00_DEM"
+
+
+class _SlowHandler(SimpleHTTPRequestHandler):
+    """File server handler counting the requests, slow enough to overlap"""
+
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        time.sleep(0.2)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def dem_server(tmp_path):
+    """HTTP server of a folder of DEM tiles, with its URL and requests"""
+    tiles_dir = tmp_path / "tiles"
+    tiles_dir.mkdir()
+    (tiles_dir / f"{DEM_ID}.tif").write_bytes(b"DEM" * 1000)
+    _SlowHandler.requests = []
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(_SlowHandler, directory=str(tiles_dir))
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/{{tile}}.tif", _SlowHandler.requests
+    server.shutdown()
+    server.server_close()
+
+
+def _get_tiles(cache_dir, url, dem_ids):
+    """Get DEM tiles from a new cache instance, as a concurrent run would"""
+    return DemCache(cache_dir).get(
+        "copdem",
+        dem_ids,
+        lambda dem_id, out_file: download_url(url.format(tile=dem_id), out_file),
+    )
+
+
+def test_dem_tile_downloaded_once(tmp_path, dem_server):
+    """Concurrent runs needing the same tile download it once"""
+    url, requests = dem_server
+    cache_dir = tmp_path / "cache"
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(lambda _: _get_tiles(cache_dir, url, [DEM_ID]), range(4))
+        )
+    tile_file = cache_dir / "copdem" / f"{DEM_ID}.tif"
+    assert results == [[tile_file]] * 4
+    assert tile_file.read_bytes() == b"DEM" * 1000
+    assert requests == [f"/{DEM_ID}.tif"]
+    assert not list(tile_file.parent.glob(".tmp-*"))
+
+
+def test_dem_tile_absent(tmp_path, dem_server):
+    """A tile over the sea is recorded and not requested again"""
+    url, requests = dem_server
+    cache_dir = tmp_path / "cache"
+    sea_id = DEM_ID.replace("N43", "N44")
+    assert _get_tiles(cache_dir, url, [DEM_ID, sea_id]) == [
+        cache_dir / "copdem" / f"{DEM_ID}.tif"
+    ]
+    assert (cache_dir / "copdem" / f"{sea_id}.absent").exists()
+    _get_tiles(cache_dir, url, [DEM_ID, sea_id])
+    assert sorted(requests) == [f"/{DEM_ID}.tif", f"/{sea_id}.tif"]
+
+
+def test_s2_tile_downloaded_once(tmp_path):
+    """Concurrent runs on a Sentinel-2 tile download its DEM once"""
+    calls = []
+
+    def _download(out_dir):
+        calls.append(out_dir)
+        time.sleep(0.2)
+        (out_dir / "srtm3s").mkdir()
+        dem_file = out_dir / "srtm3s" / "srtm_37_04.tif"
+        dem_file.write_bytes(b"DEM")
+        return [dem_file]
+
+    cache_dir = tmp_path / "cache"
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(
+                lambda _: DemCache(cache_dir).get_s2_tile("srtm", "31TCJ", _download),
+                range(4),
+            )
+        )
+    tile_file = cache_dir / "srtm" / "s2_tiles" / "31TCJ" / "srtm_37_04.tif"
+    assert results == [[tile_file]] * 4
+    assert len(calls) == 1
+    assert not list(tile_file.parents[1].glob(".tmp-*"))
+
+
+def test_s2_tile_bounds():
+    """Extent of a Sentinel-2 tile and its Copernicus DEM tiles"""
+    bounds = s2_tile_bounds("31TCJ")
+    assert bounds == pytest.approx((0.4959, 43.2383, 1.8887, 44.2478), abs=1e-3)
+    assert copdem_tile_ids("31TCJ") == [
+        f"Copernicus_DSM_COG_30_{lat}_00_{lon}_00_DEM"
+        for lat in ("N43", "N44")
+        for lon in ("E000", "E001")
+    ]
+
+
+@pytest.mark.parametrize("tile_id", ["01UBS", "60VXL"])
+def test_antimeridian_tiles(tile_id):
+    """The tiles across the antimeridian have DEM tiles on both sides"""
+    lon_min, _, lon_max, _ = s2_tile_bounds(tile_id)
+    assert lon_min > 178 and lon_max < -179
+    dem_lons = {dem_id.split("_")[6] for dem_id in copdem_tile_ids(tile_id)}
+    assert dem_lons == {"E178", "E179", "W180"}
+
+
+def test_polar_bands():
+    """The band X is 12° tall, the band C starts at 80°S"""
+    _, lat_min, _, lat_max = s2_tile_bounds("33XVJ")
+    assert 79 < lat_min < lat_max < 81
+    dem_ids = copdem_tile_ids("01CDH")
+    assert {dem_id.split("_")[4] for dem_id in dem_ids} == {"S84", "S83"}
+    assert "Copernicus_DSM_COG_30_S84_00_W180_00_DEM" in dem_ids
@@ -0,0 +1,65 @@
+""" Tests of the product duration model"""
+import pytest
+
+from ewoc_s2c.durations import DurationModel, longest_first, pack
+from ewoc_s2c.report import append_run_report
+
+L1C = "S2B_MSIL1C_20220322T105629_N0400_R094_T31UFQ_20220322T122423"
+L1C_OTHER = L1C.replace("T31UFQ", "T31UFP")
+L1C_NEW = L1C.replace("T31UFQ", "T31UFR")
+L2A = "S2B_MSIL2A_20220322T105629_N0400_R094_T31UFR_20220322T131655"
+
+RECORDS = [
+    {"pid": L1C, "data_source": "creodias", "status": "done", "seconds": 600},
+    {"pid": L1C_OTHER, "data_source": "creodias", "status": "empty", "seconds": 1000},
+    # Not the cost of a product
+    {"pid": L1C, "data_source": "creodias", "status": "failed", "seconds": 5},
+    {"pid": L1C, "data_source": "creodias", "status": "done", "seconds": 0},
+]
+
+
+def test_default_durations():
+    """Without history the durations depend on the level and scl option"""
+    model = DurationModel([])
+    assert model.predict(L1C) == 900.0
+    assert model.predict(L1C, only_scl=True) == pytest.approx(270.0)
+    assert model.predict(L2A) == 120.0
+    assert model.predict(L2A, only_scl=True) == pytest.approx(36.0)
+
+
+def test_group_and_tile():
+    """Mean of the group, scaled by the factor learnt for the tile"""
+    model = DurationModel(RECORDS)
+
+    assert model.means[("MSIL1C", False, "creodias")] == 800.0
+    # Seen once: halfway between 1 and the observed ratio
+    assert model.tile_factors == {"T31UFQ": 0.875, "T31UFP": 1.125}
+    assert model.predict(L1C) == pytest.approx(700.0)
+    assert model.predict(L1C_OTHER) == pytest.approx(900.0)
+    # Level history without the source, unknown tile
+    assert model.predict(L1C_NEW, data_source="aws") == 800.0
+    # Scaled history of the other scl option
+    assert model.predict(L1C_NEW, only_scl=True) == pytest.approx(240.0)
+    assert model.predict(L2A) == 120.0
+
+
+def test_from_reports(tmp_path):
+    """The run reports are read, the missing ones ignored"""
+    report_file = tmp_path / "run_report.jsonl"
+    for record in RECORDS:
+        append_run_report(report_file, record)
+
+    model = DurationModel.from_reports([report_file, tmp_path / "missing.jsonl"])
+
+    assert model.predict(L1C) == pytest.approx(700.0)
+
+
+def test_longest_first_makespan():
+    """Longest first shortens the makespan of the workers pulling in order"""
+    jobs = [("a", 1.0), ("b", 1.0), ("c", 4.0)]
+
+    assert pack(jobs, 2) == ([["a", "c"], ["b"]], 5.0)
+    ordered = longest_first(jobs)
+    assert ordered == [("c", 4.0), ("a", 1.0), ("b", 1.0)]
+    assert pack(ordered, 2) == ([["c"], ["a", "b"]], 4.0)
+    assert pack(jobs, 0) == ([["a", "b", "c"]], 6.0)
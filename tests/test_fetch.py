@@ -0,0 +1,103 @@
+""" Tests of the band-selective L2A fetch"""
+from pathlib import Path
+
+import pytest
+
+from ewoc_s2c.fetch import (
+    AWS_SNG_L2A_BUCKET,
+    CREODIAS_EODATA_BUCKET,
+    aws_sng_prd_prefix,
+    creodias_prd_prefix,
+    plan_aws_sng_fetch,
+    plan_creodias_fetch,
+)
+
+PID = "S2B_MSIL2A_20220302T171859_N0400_R012_T14RPV_20220302T214453.SAFE"
+TILE_PATH = "tiles/14/R/PV/2022/3/2/0"
+ARD_KEYS = {
+    "B02": 10,
+    "B03": 10,
+    "B04": 10,
+    "B08": 10,
+    "B05": 20,
+    "B06": 20,
+    "B07": 20,
+    "B11": 20,
+    "B12": 20,
+    "SCL": 20,
+}
+
+
+def _safe_keys(bands):
+    """Object keys of a L2A SAFE product on Creodias"""
+    img_data = f"{creodias_prd_prefix(PID)}/GRANULE/L2A_T14RPV/IMG_DATA"
+    keys = [
+        f"{creodias_prd_prefix(PID)}/MTD_MSIL2A.xml",
+        f"{creodias_prd_prefix(PID)}/GRANULE/L2A_T14RPV/QI_DATA/T14RPV_B02_10m.jp2",
+    ]
+    for res in (10, 20, 60):
+        keys += [
+            f"{img_data}/R{res}m/T14RPV_20220302T171859_{band}_{res}m.jp2"
+            for band in bands
+        ]
+    return keys
+
+
+def test_prd_prefixes():
+    """The date prefixes are zero padded on Creodias only"""
+    assert creodias_prd_prefix(PID) == f"Sentinel-2/MSI/L2A/2022/03/02/{PID}"
+    assert aws_sng_prd_prefix(PID) == f"products/2022/3/2/{PID[:-5]}"
+
+
+def test_creodias_fetch_keeps_ard_bands(tmp_path):
+    """Only the ARD bands at their ARD resolution are fetched"""
+    plan = plan_creodias_fetch(PID, tmp_path, _safe_keys(list(ARD_KEYS) + ["AOT"]))
+
+    assert plan.l2a_folder == tmp_path / PID
+    assert plan.extra_args == {}
+    assert len(plan.items) == len(ARD_KEYS)
+    for item in plan.items:
+        band, res = Path(item.key).stem.split("_")[-2:]
+        assert item.bucket == CREODIAS_EODATA_BUCKET
+        assert f"{ARD_KEYS[band]}m" == res
+        assert (
+            item.out_path
+            == tmp_path / PID / item.key[len(creodias_prd_prefix(PID)) + 1 :]
+        )
+
+
+def test_creodias_fetch_only_scl(tmp_path):
+    """Only the 20m SCL is fetched for the scl only ARD"""
+    plan = plan_creodias_fetch(PID, tmp_path, _safe_keys(ARD_KEYS), only_scl=True)
+
+    assert [Path(item.key).name for item in plan.items] == [
+        "T14RPV_20220302T171859_SCL_20m.jp2"
+    ]
+
+
+def test_creodias_fetch_missing_band(tmp_path):
+    """A SAFE listing without all the ARD bands is rejected"""
+    with pytest.raises(ValueError):
+        plan_creodias_fetch(PID, tmp_path, _safe_keys(["B02", "SCL"]))
+
+
+def test_aws_sng_fetch_only_scl(tmp_path):
+    """The Sinergise band keys are built from the tile path"""
+    plan = plan_aws_sng_fetch(PID, tmp_path, TILE_PATH, only_scl=True)
+
+    assert plan.extra_args == {"RequestPayer": "requester"}
+    assert [(item.bucket, item.key) for item in plan.items] == [
+        (AWS_SNG_L2A_BUCKET, f"{TILE_PATH}/R20m/SCL.jp2")
+    ]
+    assert plan.items[0].out_path == tmp_path / PID / "tile" / "R20m" / "SCL.jp2"
+
+
+def test_aws_sng_fetch_offset_metadata(tmp_path):
+    """The product metadata is fetched for the baseline 04.00 offsets"""
+    pytest.importorskip("ewoc_dag")
+    plan = plan_aws_sng_fetch(PID, tmp_path, TILE_PATH)
+
+    keys = [item.key for item in plan.items]
+    assert len(keys) == len(ARD_KEYS) + 1
+    assert keys[-1] == f"{aws_sng_prd_prefix(PID)}/metadata.xml"
+    assert plan.items[-1].out_path == tmp_path / PID / "product" / "metadata.xml"
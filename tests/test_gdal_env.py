@@ -0,0 +1,42 @@
+""" Tests of the GDAL execution profile"""
+from ewoc_s2c import gdal_env
+from ewoc_s2c.gdal_env import (
+    GDAL_CACHE_MAX_MB,
+    GDAL_CACHE_MIN_MB,
+    apply_gdal_profile,
+    gdal_profile,
+)
+
+GB = 1024**3
+
+
+def test_profile_shared_by_processes():
+    """The CPUs and the cache are split between the processes"""
+    profile = gdal_profile(processes=4, cpus=8, mem_limit=16 * GB)
+    assert profile["GDAL_NUM_THREADS"] == "2"
+    assert profile["OPJ_NUM_THREADS"] == "2"
+    assert profile["JP2KAK_THREADS"] == "2"
+    assert profile["GDAL_CACHEMAX"] == "1024"
+
+
+def test_profile_bounds():
+    """At least a thread per process and a bounded cache"""
+    small = gdal_profile(processes=4, cpus=2, mem_limit=GB // 4)
+    assert small["GDAL_NUM_THREADS"] == "1"
+    assert small["GDAL_CACHEMAX"] == str(GDAL_CACHE_MIN_MB)
+    large = gdal_profile(cpus=64, mem_limit=256 * GB)
+    assert large["GDAL_CACHEMAX"] == str(GDAL_CACHE_MAX_MB)
+
+
+def test_apply_keeps_environment(monkeypatch):
+    """The options set in the environment take precedence, applied once"""
+    monkeypatch.setattr(gdal_env, "_APPLIED", None)
+    # Restored after the test
+    for key in gdal_profile():
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setenv("GDAL_NUM_THREADS", "ALL_CPUS")
+    applied = apply_gdal_profile()
+    assert applied["GDAL_NUM_THREADS"] == "ALL_CPUS"
+    assert applied["GDAL_CACHEMAX"] == gdal_profile()["GDAL_CACHEMAX"]
+    monkeypatch.setenv("GDAL_NUM_THREADS", "1")
+    assert apply_gdal_profile() is applied
@@ -0,0 +1,53 @@
+""" Tests of the Sen2Cor stub of the pipeline harness"""
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+from ewoc_s2c.streaming import jp2_complete
+from ewoc_s2c.utils import find_l2a_band, get_ard_bands
+
+BENCHMARKS_DIR = Path(__file__).resolve().parents[1] / "benchmarks"
+L1C_PID = "S2B_MSIL1C_20220322T105629_N0400_R094_T30SWF_20220322T131655.SAFE"
+
+sys.path.insert(0, str(BENCHMARKS_DIR))
+stub = pytest.importorskip("stub_l2a_process")
+
+
+def _run_stub(tmp_path, *options):
+    """Run the stub on a synthetic L1C product"""
+    l1c_safe = stub.make_l1c_safe(tmp_path / "l1c", L1C_PID, 64)
+    subprocess.run(
+        [
+            sys.executable,
+            str(BENCHMARKS_DIR / "stub_l2a_process.py"),
+            str(l1c_safe),
+            "--output_dir",
+            str(tmp_path / "l2a"),
+            *options,
+        ],
+        check=True,
+    )
+    return next((tmp_path / "l2a").glob("*.SAFE"))
+
+
+def test_stub_l2a_layout(tmp_path):
+    """The stub writes complete ARD bands with the Sen2Cor layout"""
+    l2a_safe = _run_stub(tmp_path)
+
+    assert l2a_safe.name.startswith("S2B_MSIL2A_20220322T105629_N9999_R094_T30SWF_")
+    for band, res in get_ard_bands().items():
+        band_path = find_l2a_band(l2a_safe, band, res)
+        assert band_path.parent.name == f"R{res}m"
+        assert jp2_complete(band_path)
+
+
+def test_stub_sc_only(tmp_path):
+    """Only the SCL is written with --sc_only"""
+    l2a_safe = _run_stub(tmp_path, "--sc_only")
+
+    assert sorted(path.name for path in l2a_safe.rglob("*.jp2")) == [
+        "T30SWF_20220322T105629_SCL_20m.jp2",
+        "T30SWF_20220322T105629_SCL_60m.jp2",
+    ]
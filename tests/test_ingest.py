@@ -0,0 +1,97 @@
+""" Tests of the local SAFE collection ingest"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ewoc_s2c import ingest
+from ewoc_s2c.ingest import LocalProduct, find_safe_products, ingest_dir
+from ewoc_s2c.report import append_run_report
+from ewoc_s2c.utils import ard_product_folder
+
+pytest.importorskip("ewoc_dag")
+
+L1C = "S2B_MSIL1C_20220322T105629_N0400_R094_T31UFQ_20220322T122423"
+L2A = "S2B_MSIL2A_20220322T105629_N0400_R094_T31UFQ_20220322T131655"
+L1C_OTHER = L1C.replace("T31UFQ", "T31UFP")
+L1C_BAD = L1C.replace("T31UFQ", "T31UFR")
+
+
+def _tree(tmp_path):
+    """Folder tree of SAFE products, one of them nested in a product"""
+    root = tmp_path / "products"
+    for folder in (f"a/{L1C}", f"b/{L2A}", f"b/{L1C_OTHER}", L1C_BAD):
+        (root / f"{folder}.SAFE").mkdir(parents=True)
+    (root / "b" / f"{L2A}.SAFE" / f"{L1C_OTHER}.SAFE").mkdir()
+    (root / "c" / "S1A_IW_GRDH.SAFE").mkdir(parents=True)
+    return root
+
+
+def test_find_safe_products(tmp_path):
+    """L1C products first, then L2A, by path and without the nested ones"""
+    root = _tree(tmp_path)
+    assert find_safe_products(root) == [
+        LocalProduct(root / f"{L1C_BAD}.SAFE", "L1C"),
+        LocalProduct(root / "a" / f"{L1C}.SAFE", "L1C"),
+        LocalProduct(root / "b" / f"{L1C_OTHER}.SAFE", "L1C"),
+        LocalProduct(root / "b" / f"{L2A}.SAFE", "L2A"),
+    ]
+
+
+def test_ingest_counts(tmp_path, monkeypatch):
+    """Each ARD is converted once, the existing ones are skipped"""
+    root = _tree(tmp_path)
+    out_dir = tmp_path / "ard"
+    ard_product_folder(out_dir, L1C_OTHER).mkdir(parents=True)
+    converted = []
+
+    def _run(safe_dir, product_out, options, work_root):
+        converted.append(safe_dir)
+        if L1C_BAD in safe_dir:
+            raise ValueError("Damaged product")
+        return "done", 1.0
+
+    monkeypatch.setattr(
+        ingest, "worker_pool", lambda concurrency, verbose: ThreadPoolExecutor(2)
+    )
+    monkeypatch.setattr(ingest, "run_local_product", _run)
+    counts = ingest_dir(root, out_dir, concurrency=2, work_root=tmp_path / "work")
+
+    assert counts == {"done": 1, "empty": 0, "exists": 1, "duplicate": 1, "failed": 1}
+    # The L2A rather than its L1C
+    assert sorted(converted) == sorted(
+        [str(root / "b" / f"{L2A}.SAFE"), str(root / f"{L1C_BAD}.SAFE")]
+    )
+
+
+def test_ingest_longest_first(tmp_path, monkeypatch):
+    """The products predicted to be the longest are submitted first"""
+    root = _tree(tmp_path)
+    submitted = []
+
+    def _run(safe_dir, product_out, options, work_root):
+        submitted.append(safe_dir)
+        return "done", 1.0
+
+    monkeypatch.setattr(
+        ingest, "worker_pool", lambda concurrency, verbose: ThreadPoolExecutor(1)
+    )
+    monkeypatch.setattr(ingest, "run_local_product", _run)
+    ingest_dir(root, tmp_path / "ard", concurrency=1, work_root=tmp_path / "work")
+    # Sen2Cor first by default
+    assert submitted[-1] == str(root / "b" / f"{L2A}.SAFE")
+
+    # Slow L2A conversions in the history
+    report_file = tmp_path / "run_report.jsonl"
+    append_run_report(
+        report_file,
+        {"pid": L2A, "data_source": "creodias", "status": "done", "seconds": 5000},
+    )
+    submitted.clear()
+    ingest_dir(
+        root,
+        tmp_path / "ard_history",
+        concurrency=1,
+        work_root=tmp_path / "work",
+        duration_history=[report_file],
+    )
+    assert submitted[0] == str(root / "b" / f"{L2A}.SAFE")
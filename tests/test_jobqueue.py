@@ -0,0 +1,202 @@
+""" Tests of the job queues"""
+import json
+import threading
+import time
+
+import pytest
+
+from ewoc_s2c.jobqueue import FileJobQueue, RedisJobQueue, SqliteJobQueue
+
+PID = "S2B_MSIL1C_20220322T105629_N0400_R094_T30SWF_20220322T131655"
+
+
+def test_sqlite_claim_by_priority(tmp_path):
+    """Jobs are claimed by priority, a claimed job is invisible"""
+    queue = SqliteJobQueue(tmp_path / "queue.db")
+    queue.put("low", priority=1)
+    queue.put("high", priority=10)
+    first = queue.claim(60)
+    second = queue.claim(60)
+    assert (first.pid, second.pid) == ("high", "low")
+    assert first.attempts == 1
+    assert queue.claim(60) is None
+
+
+def test_sqlite_extend_ack(tmp_path):
+    """An extended job stays invisible, an acked job is done"""
+    queue = SqliteJobQueue(tmp_path / "queue.db")
+    queue.put(PID, {"only_scl": True})
+    job = queue.claim(0.2)
+    assert job.params == {"only_scl": True}
+    assert queue.extend(job, 60)
+    time.sleep(0.3)
+    assert queue.claim(60) is None
+    queue.ack(job)
+    assert queue.stats() == {"done": 1}
+    assert queue.claim(0) is None
+
+
+def test_sqlite_lease_expiry(tmp_path):
+    """An expired job is claimed again, the first claim is lost"""
+    queue = SqliteJobQueue(tmp_path / "queue.db")
+    queue.put(PID)
+    job = queue.claim(0.05)
+    time.sleep(0.1)
+    again = queue.claim(60)
+    assert again.job_id == job.job_id
+    assert again.attempts == 2
+    assert not queue.extend(job, 60)
+    assert queue.extend(again, 60)
+    # The late outcome of the first claim is ignored
+    queue.ack(job)
+    queue.nack(job, "error", retry=False)
+    assert queue.stats() == {"queued": 1}
+    queue.ack(again)
+    assert queue.stats() == {"done": 1}
+
+
+def test_sqlite_nack(tmp_path):
+    """A released job is retried, or failed without retry"""
+    queue = SqliteJobQueue(tmp_path / "queue.db")
+    queue.put(PID)
+    job = queue.claim(60)
+    queue.nack(job, "error")
+    job = queue.claim(60)
+    assert job.attempts == 2
+    queue.nack(job, "error", retry=False)
+    assert queue.claim(0) is None
+    assert queue.jobs()[0]["status"] == "failed"
+
+
+@pytest.fixture
+def redis_queue():
+    """Redis job queue on an in-memory server"""
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisJobQueue(fakeredis.FakeRedis(), "test")
+
+
+def test_redis_claim_by_priority(redis_queue):
+    """Jobs are claimed by priority, a claimed job is invisible"""
+    redis_queue.put("low", priority=1)
+    redis_queue.put("high", priority=10)
+    first = redis_queue.claim(60)
+    second = redis_queue.claim(60)
+    assert (first.pid, second.pid) == ("high", "low")
+    assert first.attempts == 1
+    assert redis_queue.claim(60) is None
+
+
+def test_redis_extend_ack(redis_queue):
+    """An extended job stays invisible, an acked job is done"""
+    redis_queue.put(PID, {"only_scl": True})
+    job = redis_queue.claim(0.2)
+    assert job.params == {"only_scl": True}
+    assert redis_queue.extend(job, 60)
+    time.sleep(0.3)
+    assert redis_queue.claim(60) is None
+    redis_queue.ack(job)
+    assert redis_queue.stats() == {"done": 1}
+    assert redis_queue.claim(0) is None
+
+
+def test_redis_lease_expiry(redis_queue):
+    """An expired job is claimed again, the first claim is lost"""
+    redis_queue.put(PID)
+    job = redis_queue.claim(0.05)
+    time.sleep(0.1)
+    again = redis_queue.claim(60)
+    assert again.job_id == job.job_id
+    assert again.attempts == 2
+    assert not redis_queue.extend(job, 60)
+    assert redis_queue.extend(again, 60)
+    # The late outcome of the first claim is ignored
+    redis_queue.ack(job)
+    redis_queue.nack(job, "error", retry=False)
+    assert redis_queue.stats() == {"queued": 1}
+    assert redis_queue.claim(0) is None
+
+
+def test_redis_nack(redis_queue):
+    """A released job is retried, or failed without retry"""
+    redis_queue.put(PID)
+    job = redis_queue.claim(60)
+    redis_queue.nack(job, "error")
+    job = redis_queue.claim(60)
+    assert job.attempts == 2
+    redis_queue.nack(job, "error", retry=False)
+    assert redis_queue.claim(0) is None
+    assert redis_queue.jobs()[0]["status"] == "failed"
+
+
+def _worker(root, name):
+    """File queue of a worker"""
+    queue = FileJobQueue(root)
+    queue.worker = name
+    return queue
+
+
+def test_file_claim_extend_ack(tmp_path):
+    """A leased job is not claimed by the other workers until it is acked"""
+    node_a, node_b = _worker(tmp_path, "a"), _worker(tmp_path, "b")
+    node_a.put(PID, {"only_scl": True})
+    job = node_a.claim(60)
+    assert job.params == {"only_scl": True}
+    assert node_b.claim(60) is None
+    assert node_a.extend(job, 60)
+    node_a.ack(job)
+    assert node_b.claim(0) is None
+    assert node_a.stats() == {"done": 1}
+
+
+def test_file_lease_expiry(tmp_path):
+    """An expired lease is taken over, the first worker loses the job"""
+    node_a, node_b = _worker(tmp_path, "a"), _worker(tmp_path, "b")
+    node_a.put(PID)
+    job = node_a.claim(0.05)
+    time.sleep(0.1)
+    again = node_b.claim(60)
+    assert again.job_id == job.job_id
+    assert again.attempts == 2
+    assert not node_a.extend(job, 60)
+    assert node_b.extend(again, 60)
+    # The late outcome of the first claim is ignored
+    node_a.ack(job)
+    node_a.nack(job, "error")
+    assert node_a.jobs()[0]["status"] == "running"
+    assert node_a.jobs()[0]["worker"] == "b"
+    node_b.ack(again)
+    assert node_a.stats() == {"done": 1}
+
+
+def test_file_stale_lease_taken_once(tmp_path):
+    """A lease read expired but renewed meanwhile is put back"""
+    node_a, node_b = _worker(tmp_path, "a"), _worker(tmp_path, "b")
+    node_a.put(PID)
+    job = node_a.claim(0.05)
+    time.sleep(0.1)
+    lease_file = next((tmp_path / "leases").glob("*.json"))
+    expired = json.loads(lease_file.read_text(encoding="utf-8"))
+    again = node_b.claim(60)
+    # Take over of the lease read before the claim of node_b
+    assert not node_a._take_stale_lease(  # pylint: disable=protected-access
+        job.job_id, expired["token"]
+    )
+    assert node_b.extend(again, 60)
+    assert node_a.claim(60) is None
+
+
+def test_file_extend_locked(tmp_path):
+    """A lease is not renewed while a claim checks it"""
+    node_a = _worker(tmp_path, "a")
+    node_a.put(PID)
+    job = node_a.claim(60)
+    renewed = []
+    with node_a._lease_lock(job.job_id):  # pylint: disable=protected-access
+        thread = threading.Thread(
+            target=lambda: renewed.append(node_a.extend(job, 60)), daemon=True
+        )
+        thread.start()
+        thread.join(0.2)
+        assert not renewed
+    thread.join(5)
+    assert renewed == [True]
@@ -0,0 +1,79 @@
+""" Tests of the shared L1C product cache"""
+import os
+
+import pytest
+
+from ewoc_s2c.l1c_cache import PARTIAL_PREFIX, L1CCache
+
+PID = "S2B_MSIL1C_20220322T105629_N0400_R094_T31UFQ_20220322T122423.SAFE"
+
+
+def _downloader(calls, pid=PID, fail=False):
+    """Download function writing a SAFE with a granule file"""
+
+    def _download(out_dir):
+        calls.append(out_dir)
+        safe_dir = out_dir / pid
+        (safe_dir / "GRANULE").mkdir(parents=True, exist_ok=True)
+        (safe_dir / "GRANULE" / "B02.jp2").write_bytes(b"\0" * 10)
+        if fail:
+            raise ConnectionError("Connection reset")
+        return safe_dir
+
+    return _download
+
+
+def test_hit_and_miss(tmp_path):
+    """A product is downloaded once, then copied from the cache"""
+    cache = L1CCache(tmp_path / "cache")
+    calls = []
+
+    l1c = cache.get(PID, _downloader(calls), tmp_path / "run1")
+    assert l1c == tmp_path / "run1" / PID
+    assert (l1c / "GRANULE" / "B02.jp2").stat().st_size == 10
+    assert cache.get(PID, _downloader(calls), tmp_path / "run2").exists()
+    assert len(calls) == 1
+
+
+def test_damaged_entry_downloaded(tmp_path):
+    """An entry whose files changed size is downloaded again"""
+    cache = L1CCache(tmp_path / "cache")
+    calls = []
+    cache.get(PID, _downloader(calls), tmp_path / "run1")
+    cached = tmp_path / "cache" / PID.replace(".SAFE", "") / PID
+    os.unlink(cached / "GRANULE" / "B02.jp2")
+
+    l1c = cache.get(PID, _downloader(calls), tmp_path / "run2")
+    assert (l1c / "GRANULE" / "B02.jp2").stat().st_size == 10
+    assert len(calls) == 2
+
+
+def test_interrupted_download_resumed(tmp_path):
+    """An interrupted download is resumed in the same folder"""
+    cache = L1CCache(tmp_path / "cache")
+    calls = []
+    with pytest.raises(ConnectionError):
+        cache.get(PID, _downloader(calls, fail=True), tmp_path / "run1")
+    assert list((tmp_path / "cache").glob(f"{PARTIAL_PREFIX}*"))
+
+    cache.get(PID, _downloader(calls), tmp_path / "run2")
+    assert calls[0] == calls[1]
+    assert not list((tmp_path / "cache").glob(f"{PARTIAL_PREFIX}*"))
+
+
+def test_lru_eviction(tmp_path):
+    """The least recently used products are evicted, not their copies"""
+    cache = L1CCache(tmp_path / "cache", max_size_gb=25e-9)
+    pids = [PID.replace("T31UFQ", tile) for tile in ("T31UFP", "T31UFR", "T31UFS")]
+    copies = []
+    for i, pid in enumerate(pids):
+        copies.append(cache.get(pid, _downloader([], pid), tmp_path / f"run{i}"))
+        # Distinct last use times
+        entry_dir = tmp_path / "cache" / pid.replace(".SAFE", "")
+        os.utime(entry_dir, (i, i))
+        cache.evict()
+
+    assert sorted(path.name for path in (tmp_path / "cache").glob("S2*")) == [
+        pid.replace(".SAFE", "") for pid in sorted(pids[1:])
+    ]
+    assert (copies[0] / "GRANULE" / "B02.jp2").stat().st_size == 10
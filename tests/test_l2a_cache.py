@@ -0,0 +1,78 @@
+""" Tests of the Sen2Cor L2A result cache"""
+from pathlib import Path
+import shutil
+
+from ewoc_s2c import l2a_cache
+from ewoc_s2c.l2a_cache import L2ACache, l2a_cache_key
+
+GIPP_FILE = Path(__file__).resolve().parents[1] / "L2A_GIPP.xml"
+PID = "S2B_MSIL1C_20220322T105629_N0400_R094_T31UFQ_20220322T122423.SAFE"
+
+
+def _l2a_safe(folder, name, size):
+    """L2A SAFE folder holding a file of a size"""
+    l2a_safe = folder / name
+    l2a_safe.mkdir(parents=True)
+    (l2a_safe / "band.jp2").write_bytes(b"\0" * size)
+    return l2a_safe
+
+
+def test_cache_key(tmp_path, monkeypatch):
+    """The key depends on the product, the DEM and the SCL only runs"""
+    (tmp_path / "cfg").mkdir()
+    shutil.copy(GIPP_FILE, tmp_path / "cfg" / "L2A_GIPP.xml")
+    monkeypatch.setattr(l2a_cache, "SEN2COR_ROOT", tmp_path)
+
+    key = l2a_cache_key(PID, "srtm")
+    assert key == l2a_cache_key(PID.replace(".SAFE", ""), "srtm")
+    assert key != l2a_cache_key(PID, "copdem")
+    assert key != l2a_cache_key(PID, "srtm", only_scl=True)
+    assert key != l2a_cache_key(PID.replace("T31UFQ", "T31UFP"), "srtm")
+
+
+def test_hit_and_miss(tmp_path):
+    """A put entry is returned by get with its L2A folder"""
+    cache = L2ACache(tmp_path / "cache")
+    assert cache.get("ab01") is None
+
+    cached = cache.put("ab01", _l2a_safe(tmp_path / "out", "L2A.SAFE", 10), PID)
+    assert cached == tmp_path / "cache" / "ab" / "ab01" / "L2A.SAFE"
+    assert not (tmp_path / "out" / "L2A.SAFE").exists()
+    assert cache.get("ab01") == cached
+    assert (cached / "band.jp2").stat().st_size == 10
+    cache.release()
+
+
+def test_lru_eviction(tmp_path):
+    """The least recently used entries are evicted above the size limit"""
+    cache = L2ACache(tmp_path / "cache", max_size_gb=25e-9)
+    for key in ("aa01", "bb01"):
+        cache.put(key, _l2a_safe(tmp_path / key, "L2A.SAFE", 10), PID)
+    cache.release()
+    assert cache.get("aa01") is not None
+    cache.release()
+
+    cache.put("cc01", _l2a_safe(tmp_path / "cc01", "L2A.SAFE", 10), PID)
+    cache.release()
+    assert cache.get("bb01") is None
+    assert cache.get("aa01") is not None
+    assert cache.get("cc01") is not None
+    cache.release()
+
+
+def test_pinned_not_evicted(tmp_path):
+    """An entry in use is kept until released"""
+    reader = L2ACache(tmp_path / "cache", max_size_gb=15e-9)
+    writer = L2ACache(tmp_path / "cache", max_size_gb=15e-9)
+    writer.put("aa01", _l2a_safe(tmp_path / "aa01", "L2A.SAFE", 10), PID)
+    writer.release()
+    pinned = reader.get("aa01")
+
+    writer.put("bb01", _l2a_safe(tmp_path / "bb01", "L2A.SAFE", 10), PID)
+    writer.release()
+    assert (pinned / "band.jp2").exists()
+
+    reader.release()
+    writer.put("cc01", _l2a_safe(tmp_path / "cc01", "L2A.SAFE", 10), PID)
+    writer.release()
+    assert not pinned.exists()
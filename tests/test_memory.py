@@ -0,0 +1,22 @@
+""" Tests of the band buffer pool"""
+import numpy as np
+
+from ewoc_s2c.memory import buffer_pool, get_buffer
+
+
+def test_buffers_reused_in_pool():
+    """A role has one backing array, grown when a larger one is needed"""
+    with buffer_pool():
+        band_20m = get_buffer("band", (1, 5, 5), np.uint16)
+        band_10m = get_buffer("band", (1, 10, 10), np.uint16)
+        assert not np.shares_memory(band_20m, band_10m)
+        assert np.shares_memory(get_buffer("band", (1, 5, 5), np.uint16), band_10m)
+        assert not np.shares_memory(get_buffer("scl", (5, 5), np.uint8), band_10m)
+
+
+def test_buffers_without_pool():
+    """Each call allocates a new array outside of a pool"""
+    band = get_buffer("band", (1, 5, 5), np.uint16)
+    assert band.shape == (1, 5, 5)
+    assert band.dtype == np.uint16
+    assert not np.shares_memory(get_buffer("band", (1, 5, 5), np.uint16), band)
@@ -0,0 +1,41 @@
+""" Tests of the BOA offset of the L2A bands"""
+import numpy as np
+import pytest
+
+from ewoc_s2c.utils import apply_offset, retrieve_offset_from_meta
+
+METADATA = (
+    "<Level-2A_User_Product><BOA_ADD_OFFSET_VALUES_LIST>"
+    '<BOA_ADD_OFFSET band_id="1">{offset}</BOA_ADD_OFFSET>'
+    "</BOA_ADD_OFFSET_VALUES_LIST></Level-2A_User_Product>"
+)
+
+
+def _meta_file(tmp_path, offset):
+    """Product metadata with the BOA offset of band 1"""
+    meta_file = tmp_path / "metadata.xml"
+    meta_file.write_text(METADATA.format(offset=offset), encoding="utf-8")
+    return str(meta_file)
+
+
+def test_retrieve_offset(tmp_path):
+    """The offset of a band is read, a missing band is an error"""
+    meta_file = _meta_file(tmp_path, -1000)
+    assert retrieve_offset_from_meta(meta_file, "1") == -1000
+    with pytest.raises(ValueError, match="band 2"):
+        retrieve_offset_from_meta(meta_file, "2")
+
+
+def test_negative_offset_clamped(tmp_path):
+    """Nodata stays 0, the dark valid pixels are clamped to 1"""
+    band = np.array([[0, 500, 1000, 1001, 3000]], np.uint16)
+    result = apply_offset(band, _meta_file(tmp_path, -1000), "1")
+    assert result is band
+    assert band.tolist() == [[0, 1, 1, 1, 2000]]
+
+
+def test_positive_offset_clamped(tmp_path):
+    """Nodata stays 0, the bright pixels are clamped to the dtype maximum"""
+    band = np.array([[0, 1, 65000]], np.uint16)
+    apply_offset(band, _meta_file(tmp_path, 1000), "1")
+    assert band.tolist() == [[0, 1001, 65535]]
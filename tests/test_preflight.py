@@ -0,0 +1,79 @@
+""" Tests of the pre-flight metadata check"""
+from ewoc_s2c.preflight import (
+    ProductMetadata,
+    check_thresholds,
+    parse_metadata,
+    preflight,
+)
+from ewoc_s2c.resolver import ProductNotFoundError
+from ewoc_s2c.sources import DataSource
+
+PID = "S2B_MSIL1C_20220321T171859_N0400_R012_T14RPV_20220322T214453.SAFE"
+PRODUCT_XML = (
+    b"<Level-1C_User_Product><General_Info><Product_Info>"
+    b"<PROCESSING_BASELINE>05.09</PROCESSING_BASELINE></Product_Info>"
+    b"</General_Info><Quality_Indicators_Info>"
+    b"<Cloud_Coverage_Assessment>42.5</Cloud_Coverage_Assessment>"
+    b"</Quality_Indicators_Info></Level-1C_User_Product>"
+)
+TILE_XML = (
+    b'<n1:Level-1C_Tile_ID xmlns:n1="https://psd-14.sentinel2.eo.esa.int">'
+    b"<n1:Quality_Indicators_Info><Image_Content_QI>"
+    b"<NODATA_PIXEL_PERCENTAGE>12.0</NODATA_PIXEL_PERCENTAGE>"
+    b"</Image_Content_QI></n1:Quality_Indicators_Info></n1:Level-1C_Tile_ID>"
+)
+
+
+class MetadataSource(DataSource):
+    """Data source with the metadata files of the products it holds"""
+
+    def __init__(self, pids):
+        super().__init__("stub")
+        self.pids = pids
+        self.calls = []
+
+    def fetch_metadata(self, pid):
+        self.calls.append(pid)
+        if pid not in self.pids:
+            raise ProductNotFoundError(pid)
+        return {"MTD_MSIL1C.xml": PRODUCT_XML, "MTD_TL.xml": TILE_XML}
+
+
+def test_parse_metadata():
+    """Product and namespaced tile metadata, baseline of the id if missing"""
+    assert parse_metadata(PID, [PRODUCT_XML, TILE_XML]) == ProductMetadata(
+        42.5, 12.0, "0509"
+    )
+    assert parse_metadata(PID, []) == ProductMetadata(None, None, "0400")
+
+
+def test_check_thresholds():
+    """Only the known values above the thresholds are reported"""
+    metadata = ProductMetadata(42.5, None, "0400")
+    assert check_thresholds(metadata, 50, 10, "04.00") == []
+    assert check_thresholds(metadata, 40, 10, "0500") == [
+        "cloud cover 42.5% > 40%",
+        "baseline 0400 < 0500",
+    ]
+
+
+def test_preflight():
+    """The metadata of the id variant found is checked"""
+    prod_pid = PID.replace("20220321T", "20220322T", 1)
+    source = MetadataSource([prod_pid])
+
+    result = preflight(PID, source, max_cloud_cover=40)
+    assert result.metadata == ProductMetadata(42.5, 12.0, "0509")
+    assert result.reasons == ["cloud cover 42.5% > 40%"]
+    assert prod_pid in source.calls
+
+
+def test_preflight_without_metadata():
+    """Only the baseline of the id is checked without metadata"""
+    source = MetadataSource([])
+    assert preflight(PID, source, min_baseline="0400").reasons == []
+    assert not source.calls
+
+    result = preflight(PID, source, max_nodata=5, min_baseline="0500")
+    assert result.metadata == ProductMetadata(None, None, "0400")
+    assert result.reasons == ["baseline 0400 < 0500"]
@@ -0,0 +1,41 @@
+""" Tests of the stage profiler"""
+import subprocess
+import sys
+import time
+
+from ewoc_s2c.profiling import SUMMARY_FILE, StageProfiler, profile_stage, use_profiler
+
+
+def _busy_stage(seconds):
+    """Keep the thread busy in Python code"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_stage_samples(tmp_path):
+    """The samples of a stage are written as collapsed stacks and summed up"""
+    with use_profiler(StageProfiler(tmp_path, interval=0.001)) as profiler:
+        with profile_stage("ard"):
+            _busy_stage(0.2)
+        with profile_stage("sen2cor", subprocess=True):
+            subprocess.run([sys.executable, "-c", "sum(range(3000000))"], check=True)
+
+    assert profiler.wall_times["ard"] >= 0.2
+    assert profiler.subprocess_cpu["sen2cor"] > 0
+    assert any("_busy_stage" in stack for stack in profiler.stacks["ard"])
+    assert "_busy_stage" in profiler.top_functions("ard")[1]
+    collapsed = (tmp_path / "ard.collapsed").read_text(encoding="utf-8")
+    assert "test_stage_samples" in collapsed.splitlines()[0]
+    summary = (tmp_path / SUMMARY_FILE).read_text(encoding="utf-8")
+    assert summary.index("ard:") < summary.index("sen2cor:")
+    assert "subprocess CPU" in summary
+
+
+def test_stage_without_profiler(tmp_path):
+    """The stages are not counted once the profiler is not in use"""
+    with use_profiler(StageProfiler(tmp_path)) as profiler:
+        pass
+    with profile_stage("ard"):
+        _busy_stage(0.01)
+    assert "ard" not in profiler.wall_times
@@ -0,0 +1,43 @@
+""" Tests of the ARD quality statistics"""
+import numpy as np
+
+from ewoc_s2c.qa import HISTOGRAM_BINS, band_stats, scl_class_counts
+
+
+def test_band_stats_match_numpy():
+    """The statistics of the valid pixels are the ones of numpy"""
+    rng = np.random.default_rng(0)
+    band = rng.integers(1, 20000, size=(150, 70), dtype=np.uint16)
+    band[:10] = 0
+    valid = band[band != 0]
+
+    tags = band_stats(band, nodata=0)
+    assert int(tags["VALID_COUNT"]) == valid.size
+    assert float(tags["STATISTICS_VALID_PERCENT"]) == round(
+        100 * valid.size / band.size, 4
+    )
+    assert int(tags["STATISTICS_MINIMUM"]) == valid.min()
+    assert int(tags["STATISTICS_MAXIMUM"]) == valid.max()
+    assert abs(float(tags["STATISTICS_MEAN"]) - valid.mean()) < 1e-3
+    assert abs(float(tags["STATISTICS_STDDEV"]) - valid.std()) < 1e-3
+    histogram = [int(nb) for nb in tags["HISTOGRAM"].split(",")]
+    assert len(histogram) == HISTOGRAM_BINS
+    assert tags["HISTOGRAM_BIN_WIDTH"] == "512"
+    assert histogram[0] == np.count_nonzero(valid < 512)
+    # Everything above the last bin start is in the last bin
+    assert histogram[-1] == np.count_nonzero(valid >= 31 * 512)
+    assert sum(histogram) == valid.size
+
+
+def test_band_stats_nodata_only():
+    """A band without valid pixels has counts only"""
+    tags = band_stats(np.full((3, 3), 255, np.uint8), nodata=255)
+    assert tags["VALID_COUNT"] == "0"
+    assert tags["HISTOGRAM_BIN_WIDTH"] == "8"
+    assert "STATISTICS_MEAN" not in tags
+
+
+def test_scl_class_counts():
+    """Only the classes present are listed"""
+    scl = np.array([[0, 4, 4], [8, 4, 9]], np.uint8)
+    assert scl_class_counts(scl) == {"SCL_CLASS_COUNTS": "0:1,4:3,8:1,9:1"}
@@ -0,0 +1,101 @@
+""" Tests of the ranged downloads"""
+import os
+
+from ewoc_s2c.ranged import CHUNK_SIZE, PartialFile, RangedDownloader, local_etags
+
+KEY = "L1C/B02.jp2"
+PART_SIZE = 256 * 1024
+
+
+def _put(s3_client, bucket, size=5 * PART_SIZE + 1000):
+    """Put an object of random bytes"""
+    data = os.urandom(size)
+    s3_client.put_object(Bucket=bucket, Key=KEY, Body=data)
+    return data
+
+
+def _ranges(s3_client):
+    """Record the byte ranges requested by a client"""
+    ranges = []
+    s3_client.meta.events.register(
+        "provide-client-params.s3.GetObject",
+        lambda params, **_: ranges.append(params.get("Range")),
+    )
+    return ranges
+
+
+def test_resume_missing_parts(tmp_path, s3_client, ard_bucket):
+    """An interrupted download gets only its missing parts"""
+    data = _put(s3_client, ard_bucket)
+    out_file = tmp_path / "B02.jp2"
+    etag = s3_client.head_object(Bucket=ard_bucket, Key=KEY)["ETag"]
+    partial = PartialFile(out_file, len(data), etag, PART_SIZE)
+    for index in (0, 2):
+        start, end = partial.part_range(index)
+        partial.write(start, data[start : end + 1])
+        partial.part_done(index)
+    partial.close()
+    ranges = _ranges(s3_client)
+    downloader = RangedDownloader(s3_client, max_workers=2, part_size=PART_SIZE)
+    assert downloader.download([(ard_bucket, KEY, out_file)]) == len(data)
+    assert out_file.read_bytes() == data
+    assert sorted(ranges) == sorted(
+        f"bytes={start}-{end}" for start, end in map(partial.part_range, (1, 3, 4, 5))
+    )
+    assert not list(tmp_path.glob("*.part*"))
+
+
+def test_resume_all_parts_done(tmp_path, s3_client, ard_bucket):
+    """A download interrupted after its last part is finished without request"""
+    data = _put(s3_client, ard_bucket)
+    out_file = tmp_path / "B02.jp2"
+    etag = s3_client.head_object(Bucket=ard_bucket, Key=KEY)["ETag"]
+    partial = PartialFile(out_file, len(data), etag, PART_SIZE)
+    partial.write(0, data)
+    for index in partial.missing_parts():
+        partial.part_done(index)
+    partial.close()
+    ranges = _ranges(s3_client)
+    RangedDownloader(s3_client, part_size=PART_SIZE).download(
+        [(ard_bucket, KEY, out_file)]
+    )
+    assert ranges == []
+    assert out_file.read_bytes() == data
+
+
+def test_existing_file_checked(tmp_path, s3_client, ard_bucket):
+    """An existing file is kept if it matches its object, else downloaded"""
+    data = _put(s3_client, ard_bucket)
+    out_file = tmp_path / "B02.jp2"
+    out_file.write_bytes(data)
+    ranges = _ranges(s3_client)
+    downloader = RangedDownloader(s3_client, part_size=PART_SIZE)
+    downloader.download([(ard_bucket, KEY, out_file)])
+    assert ranges == []
+    out_file.write_bytes(bytes(len(data)))
+    downloader.download([(ard_bucket, KEY, out_file)])
+    assert len(ranges) == 6
+    assert out_file.read_bytes() == data
+
+
+def test_local_etags_multipart(tmp_path, s3_client, ard_bucket):
+    """The ETag of a multipart upload is among the local ETags"""
+    from boto3.s3.transfer import TransferConfig
+
+    local_file = tmp_path / "B02.jp2"
+    local_file.write_bytes(os.urandom(11 * CHUNK_SIZE))
+    for part_mib in (5, 8):
+        s3_client.upload_file(
+            str(local_file),
+            ard_bucket,
+            KEY,
+            Config=TransferConfig(
+                multipart_threshold=part_mib * CHUNK_SIZE,
+                multipart_chunksize=part_mib * CHUNK_SIZE,
+            ),
+        )
+        etag = s3_client.head_object(Bucket=ard_bucket, Key=KEY)["ETag"]
+        assert "-" in etag
+        assert etag.strip('"') in local_etags(local_file, etag)
+    local_file.write_bytes(b"")
+    assert "d41d8cd98f00b204e9800998ecf8427e" in local_etags(local_file, '"x"')
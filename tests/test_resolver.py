@@ -0,0 +1,90 @@
+""" Tests of the product id resolution"""
+from pathlib import Path
+
+import pytest
+
+from ewoc_s2c.resolver import (
+    ProductNotFoundError,
+    is_not_found,
+    ordered_variants,
+    resolution_stats,
+    resolve_s2_product,
+)
+
+PID = "S2B_MSIL1C_20220321T171859_N0400_R012_T14RPV_20220322T214453.SAFE"
+PID_PROD = PID.replace("20220321T", "20220322T", 1)
+
+
+def _client_error(code):
+    """botocore error with an S3 error code"""
+    botocore = pytest.importorskip("botocore.exceptions")
+    return botocore.ClientError({"Error": {"Code": code}}, "GetObject")
+
+
+def _fetch_only(found_pid, calls):
+    """Download function finding a single product id"""
+
+    def _fetch(prd_id):
+        calls.append(prd_id)
+        if prd_id != found_pid:
+            raise ProductNotFoundError(prd_id)
+        return Path(prd_id)
+
+    return _fetch
+
+
+def test_not_found_errors():
+    """Only the explicit not found errors are a miss"""
+    assert is_not_found(ProductNotFoundError(PID))
+    assert is_not_found(_client_error("NoSuchKey"))
+    assert is_not_found(_client_error("404"))
+    assert not is_not_found(_client_error("AccessDenied"))
+    assert not is_not_found(ValueError(PID))
+    assert not is_not_found(FileNotFoundError(PID))
+
+
+def test_known_variant_first(tmp_path):
+    """The variant a product resolved to is tried first next time"""
+    cache_file = tmp_path / "pid_cache.json"
+    calls = []
+
+    resolve_s2_product(PID, _fetch_only(PID_PROD, calls), "aws", cache_file)
+    assert calls == [PID, PID_PROD]
+    assert ordered_variants(PID, "aws:MSIL1C", cache_file)[0] == (
+        "production",
+        PID_PROD,
+    )
+
+    calls.clear()
+    assert resolve_s2_product(
+        PID, _fetch_only(PID_PROD, calls), "aws", cache_file
+    ) == Path(PID_PROD)
+    assert calls == [PID_PROD]
+    # Not recorded for the other products of the source
+    other = PID.replace("T14RPV", "T14RPU")
+    assert ordered_variants(other, "aws:MSIL1C", cache_file)[0][0] == "acquisition"
+    assert resolution_stats(cache_file)["aws:MSIL1C"]["known"] == 1
+
+
+def test_other_errors_raised(tmp_path):
+    """A failed download is not retried with the other variant"""
+    calls = []
+
+    def _fetch(prd_id):
+        calls.append(prd_id)
+        raise ValueError("Connection reset")
+
+    with pytest.raises(ValueError, match="Connection reset"):
+        resolve_s2_product(PID, _fetch, "aws", tmp_path / "pid_cache.json")
+    assert calls == [PID]
+
+
+def test_resolution_latency(tmp_path, monkeypatch):
+    """The download time of the product is not in the resolution latency"""
+    cache_file = tmp_path / "pid_cache.json"
+    clock = iter([0.0, 0.0, 2.0, 30.0, 31.0])
+    monkeypatch.setattr("ewoc_s2c.resolver.time.perf_counter", lambda: next(clock))
+
+    resolve_s2_product(PID, _fetch_only(PID_PROD, []), "aws", cache_file)
+
+    assert resolution_stats(cache_file)["aws:MSIL1C"]["mean_latency"] == 2.0
@@ -0,0 +1,99 @@
+""" Tests of the SAFE product integrity check"""
+import hashlib
+import os
+
+from ewoc_s2c.safe_check import check_links, check_safe, read_manifest
+
+MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1">
+<dataObjectSection>{objects}</dataObjectSection>
+</xfdu:XFDU>"""
+DATA_OBJECT = """
+<dataObject ID="{name}"><byteStream mimeType="application/octet-stream"
+ size="{size}"><fileLocation locatorType="URL" href="./{path}"/>
+<checksum checksumName="{checksum_name}">{checksum}</checksum>
+</byteStream></dataObject>"""
+FILES = {
+    "GRANULE/L1C_T31UFQ/IMG_DATA/T31UFQ_B02.jp2": b"B02" * 100,
+    "GRANULE/L1C_T31UFQ/MTD_TL.xml": b"<Tile/>",
+    "HTML/UserProduct_index.html": b"<html/>",
+}
+
+
+def _safe(tmp_path, checksum_name="SHA-256"):
+    """SAFE product with its files listed in its manifest"""
+    safe_dir = tmp_path / "S2B_MSIL1C.SAFE"
+    objects = []
+    for path, content in FILES.items():
+        (safe_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (safe_dir / path).write_bytes(content)
+        algorithm = "md5" if checksum_name == "MD5" else "sha256"
+        objects.append(
+            DATA_OBJECT.format(
+                name=os.path.basename(path),
+                size=len(content),
+                path=path,
+                checksum_name=checksum_name,
+                checksum=hashlib.new(algorithm, content).hexdigest().upper(),
+            )
+        )
+    (safe_dir / "manifest.safe").write_text(
+        MANIFEST.format(objects="".join(objects)), encoding="utf-8"
+    )
+    return safe_dir
+
+
+def test_read_manifest(tmp_path):
+    """The files are listed with their size and lower case checksum"""
+    entries = read_manifest(_safe(tmp_path, "MD5"))
+    assert [entry.path for entry in entries] == list(FILES)
+    assert entries[0].size == 300
+    assert entries[0].checksum_name == "MD5"
+    assert entries[0].checksum == hashlib.md5(b"B02" * 100).hexdigest()
+
+
+def test_valid_product(tmp_path):
+    """A complete product has no problem, the HTML folder is optional"""
+    safe_dir = _safe(tmp_path)
+    assert check_safe(safe_dir) == []
+    (safe_dir / "HTML" / "UserProduct_index.html").unlink()
+    assert check_safe(safe_dir) == []
+
+
+def test_damaged_product(tmp_path):
+    """Missing, truncated and corrupted files are reported"""
+    safe_dir = _safe(tmp_path)
+    granule = safe_dir / "GRANULE" / "L1C_T31UFQ"
+    (granule / "MTD_TL.xml").unlink()
+    (granule / "IMG_DATA" / "T31UFQ_B02.jp2").write_bytes(b"B02" * 99)
+    assert sorted(check_safe(safe_dir)) == [
+        "GRANULE/L1C_T31UFQ/IMG_DATA/T31UFQ_B02.jp2 has 297 bytes instead of 300",
+        "GRANULE/L1C_T31UFQ/MTD_TL.xml is missing",
+    ]
+    (granule / "IMG_DATA" / "T31UFQ_B02.jp2").write_bytes(b"B03" * 100)
+    assert check_safe(safe_dir, max_workers=1)[0] == (
+        "GRANULE/L1C_T31UFQ/IMG_DATA/T31UFQ_B02.jp2 has a wrong SHA-256 checksum"
+    )
+
+
+def test_unreadable_manifest(tmp_path):
+    """A product without manifest is not checked, a broken one is damaged"""
+    safe_dir = _safe(tmp_path)
+    (safe_dir / "manifest.safe").write_text("<XFDU", encoding="utf-8")
+    assert check_safe(safe_dir)[0].startswith("manifest.safe cannot be read")
+    (safe_dir / "manifest.safe").unlink()
+    assert check_safe(safe_dir) == []
+
+
+def test_check_links(tmp_path):
+    """The links must resolve to non-empty files"""
+    (tmp_path / "mosaic.tif").write_bytes(b"DEM")
+    (tmp_path / "empty.tif").touch()
+    for name, target in (("ok", "mosaic.tif"), ("empty", "empty.tif"), ("gone", "x")):
+        (tmp_path / f"{name}.lnk").symlink_to(tmp_path / target)
+    assert check_links(
+        [tmp_path / f"{name}.lnk" for name in ("ok", "empty", "gone")]
+    ) == [
+        f"{tmp_path / 'empty.lnk'} points to an empty file",
+        f"{tmp_path / 'gone.lnk'} does not resolve",
+    ]
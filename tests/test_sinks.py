@@ -0,0 +1,69 @@
+""" Tests of the ARD output sinks"""
+import pytest
+
+from ewoc_s2c.sinks import STAGING_PREFIX, S3Sink, abort_on_failure
+from ewoc_s2c.upload import clear_content_hashes, register_content_hash
+
+PREFIX = "c728b264-5c97-4f4c-81fe-1500d4c4dfbd_32614_20220322"
+
+
+def _keys(s3_client, bucket, prefix=""):
+    """Keys of a bucket under a prefix"""
+    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    return sorted(obj["Key"] for obj in response.get("Contents", []))
+
+
+def _write(sink, tmp_path, band, digest):
+    """Write a band through a sink"""
+    band_fn = tmp_path / "OPTICAL" / f"{band}.tif"
+    register_content_hash(band_fn, digest)
+    # pylint: disable=protected-access
+    sink._put(band_fn, memoryview(band.encode() * 1000))
+
+
+def test_s3_sink_commit(tmp_path, s3_client, ard_bucket):
+    """The staged files are copied to their keys when committed"""
+    clear_content_hashes()
+    sink = S3Sink(tmp_path, PREFIX)
+    _write(sink, tmp_path, "B02", "sha-B02")
+    _write(sink, tmp_path, "B03", "sha-B03")
+    assert _keys(s3_client, ard_bucket, PREFIX) == []
+    assert len(_keys(s3_client, ard_bucket, STAGING_PREFIX)) == 2
+    sink.commit()
+    assert _keys(s3_client, ard_bucket, PREFIX) == [
+        f"{PREFIX}/OPTICAL/B02.tif",
+        f"{PREFIX}/OPTICAL/B03.tif",
+    ]
+    assert _keys(s3_client, ard_bucket, STAGING_PREFIX) == []
+    # Written again with the same content: skipped
+    sink = S3Sink(tmp_path, PREFIX)
+    _write(sink, tmp_path, "B02", "sha-B02")
+    sink.commit()
+    assert (sink.report().uploaded, sink.report().skipped) == (0, 1)
+
+
+def test_s3_sink_abort(tmp_path, s3_client, ard_bucket):
+    """A failed product leaves no file in the bucket"""
+    clear_content_hashes()
+    sink = S3Sink(tmp_path, PREFIX)
+    with pytest.raises(RuntimeError):
+        with abort_on_failure(sink):
+            _write(sink, tmp_path, "B02", "sha-B02")
+            raise RuntimeError("Processing failed")
+    assert _keys(s3_client, ard_bucket) == []
+    # Not recorded in the manifests: uploaded by the next processing
+    sink = S3Sink(tmp_path, PREFIX)
+    _write(sink, tmp_path, "B02", "sha-B02")
+    sink.commit()
+    assert sink.report().uploaded == 1
+    assert _keys(s3_client, ard_bucket, PREFIX) == [f"{PREFIX}/OPTICAL/B02.tif"]
+
+
+def test_s3_sink_without_staging(tmp_path, s3_client, ard_bucket):
+    """Without staging, the files are uploaded to their keys"""
+    clear_content_hashes()
+    sink = S3Sink(tmp_path, PREFIX, staging=False)
+    _write(sink, tmp_path, "B02", "sha-B02")
+    assert _keys(s3_client, ard_bucket, PREFIX) == [f"{PREFIX}/OPTICAL/B02.tif"]
+    sink.commit()
+    assert _keys(s3_client, ard_bucket, STAGING_PREFIX) == []
@@ -0,0 +1,148 @@
+""" Tests of the streaming ARD conversion"""
+import os
+from pathlib import Path
+import struct
+import sys
+
+import pytest
+
+from ewoc_s2c import streaming
+from ewoc_s2c.streaming import (
+    J2K_EOC,
+    J2K_SOC,
+    JP2_SIGNATURE,
+    BandWatcher,
+    StreamingArd,
+    jp2_complete,
+)
+
+BENCHMARKS_DIR = Path(__file__).resolve().parents[1] / "benchmarks"
+L1C_PID = "S2B_MSIL1C_20220322T105629_N0400_R094_T30SWF_20220322T131655.SAFE"
+L2A_NAME = "S2B_MSIL2A_20220322T105629_N9999_R094_T30SWF_20220322T140000.SAFE"
+CODESTREAM = J2K_SOC + bytes(16) + J2K_EOC
+
+
+def _box(box_type, payload, length=None):
+    """JP2 box, its length from the payload by default"""
+    return (
+        struct.pack(">I4s", 8 + len(payload) if length is None else length, box_type)
+        + payload
+    )
+
+
+def _jp2(last_length=None):
+    """JP2 file content: signature, file type and codestream boxes"""
+    return (
+        JP2_SIGNATURE
+        + _box(b"ftyp", b"jp2 " + bytes(4) + b"jp2 ")
+        + _box(b"jp2c", CODESTREAM, last_length)
+    )
+
+
+@pytest.mark.parametrize(
+    "content,complete",
+    [
+        (_jp2(), True),
+        # Last box up to the end of the file
+        (_jp2(0), True),
+        (_jp2()[:-5], False),
+        (_jp2(0)[:-1], False),
+        (_jp2()[:30], False),
+        (_jp2() + b"\x00\x00", False),
+        (CODESTREAM, True),
+        (CODESTREAM[:-1], False),
+        (b"GIF89a", False),
+    ],
+)
+def test_jp2_complete(tmp_path, content, complete):
+    """Truncated JP2 and J2K files are not complete"""
+    path = tmp_path / "band.jp2"
+    path.write_bytes(content)
+    assert jp2_complete(path) is complete
+
+
+def _band_file(l2a_out, granule, band, res, content):
+    """Write a band file with the Sen2Cor layout"""
+    path = l2a_out / L2A_NAME / "GRANULE" / granule / "IMG_DATA" / f"R{res}m"
+    path.mkdir(parents=True, exist_ok=True)
+    path = path / f"T30SWF_20220322T105629_{band}_{res}m.jp2"
+    path.write_bytes(content)
+    return path
+
+
+def test_watcher_stable_files(tmp_path):
+    """A band is complete once its file is valid and did not change"""
+    watcher = BandWatcher(tmp_path, {"B02": 10, "SCL": 20})
+    b02 = _band_file(tmp_path, "L2A_A", "B02", 10, _jp2())
+    scl = _band_file(tmp_path, "L2A_A", "SCL", 20, _jp2()[:-5])
+
+    assert not watcher.poll()
+    assert watcher.poll() == [("B02", b02)]
+    # Completed later
+    scl.write_bytes(_jp2())
+    assert not watcher.poll()
+    assert watcher.poll() == [("SCL", scl)]
+    assert not watcher.pending
+    assert not watcher.poll()
+
+
+def test_watcher_one_file_per_band(tmp_path):
+    """A band matching several files is completed once"""
+    watcher = BandWatcher(tmp_path, {"B02": 10})
+    for granule in ("L2A_A", "L2A_B"):
+        _band_file(tmp_path, granule, "B02", 10, _jp2())
+
+    watcher.poll()
+    completed = watcher.poll()
+
+    assert [band for band, _ in completed] == ["B02"]
+    assert not watcher.pending
+
+
+@pytest.mark.parametrize("layout", ["band", "stacked"])
+def test_finish_converts_changed_bands(tmp_path, monkeypatch, layout):
+    """The bands changed after their conversion are converted again"""
+    pytest.importorskip("ewoc_dag")
+    sys.path.insert(0, str(BENCHMARKS_DIR))
+    stub = pytest.importorskip("stub_l2a_process")
+    band = stub.synthetic_band(64)
+    l2a_safe = stub.make_l2a_safe(tmp_path / "l2a", L2A_NAME, band)
+    converted = []
+
+    def _recorder(convert, bands_of):
+        def _convert(*args, **kwargs):
+            converted.extend(bands_of(*args))
+            return convert(*args, **kwargs)
+
+        return _convert
+
+    monkeypatch.setattr(
+        streaming,
+        "band_to_ard",
+        _recorder(streaming.band_to_ard, lambda band_id, *args: [band_id]),
+    )
+    monkeypatch.setattr(
+        streaming,
+        "stack_to_ard",
+        _recorder(streaming.stack_to_ard, lambda band_paths, *args: list(band_paths)),
+    )
+    converter = StreamingArd(tmp_path / "ard", L1C_PID, "creodias", layout=layout)
+    watcher = BandWatcher(tmp_path / "l2a", converter.bands)
+    watcher.poll()
+    for band_id, band_path in watcher.poll():
+        converter.add(band_id, band_path)
+    assert sorted(converted) == sorted(converter.bands)
+
+    # Written again by Sen2Cor after its conversion
+    b02 = next(l2a_safe.rglob("*_B02_10m.jp2"))
+    stub.write_band(b02, band[::-1], 10)
+    stat = b02.stat()
+    os.utime(b02, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    converted.clear()
+    ard_folder = converter.finish(l2a_safe)
+
+    assert ard_folder == converter.ard_folder
+    if layout == "band":
+        assert converted == ["B02"]
+    else:
+        assert sorted(converted) == ["B02", "B03", "B04", "B08"]
@@ -0,0 +1,78 @@
+""" Tests of the ARD upload"""
+import pytest
+
+from ewoc_s2c.upload import (
+    ard_bucket_client,
+    clear_content_hashes,
+    manifest_key,
+    register_content_hash,
+    upload_ard,
+)
+
+PREFIX = "c728b264-5c97-4f4c-81fe-1500d4c4dfbd_32614_20220322"
+
+
+def _ard_folder(tmp_path):
+    """ARD folder with two bands and their content checksums"""
+    ard_dir = tmp_path / "ard"
+    band_dir = ard_dir / "OPTICAL/31/U/FQ/2022/20220322"
+    band_dir.mkdir(parents=True)
+    for band in ("B02", "B03"):
+        band_fn = band_dir / f"{band}.tif"
+        band_fn.write_bytes(band.encode() * 1000)
+        register_content_hash(band_fn, f"sha-{band}")
+    return ard_dir, band_dir
+
+
+def test_upload_skips_unchanged(tmp_path, s3_client, ard_bucket):
+    """The files uploaded with the same content checksum are skipped"""
+    clear_content_hashes()
+    ard_dir, _ = _ard_folder(tmp_path)
+    report = upload_ard(ard_dir, PREFIX)
+    assert (report.uploaded, report.skipped) == (2, 0)
+    key = f"{PREFIX}/OPTICAL/31/U/FQ/2022/20220322/B02.tif"
+    assert s3_client.head_object(Bucket=ard_bucket, Key=manifest_key(key))
+    report = upload_ard(ard_dir, PREFIX)
+    assert (report.uploaded, report.skipped) == (0, 2)
+    assert report.bytes_saved == 6000
+
+
+@pytest.mark.usefixtures("s3_client")
+def test_upload_changed_content(tmp_path):
+    """A file with another content checksum is uploaded again"""
+    clear_content_hashes()
+    ard_dir, band_dir = _ard_folder(tmp_path)
+    upload_ard(ard_dir, PREFIX)
+    register_content_hash(band_dir / "B03.tif", "sha-B03-reprocessed")
+    report = upload_ard(ard_dir, PREFIX)
+    assert (report.uploaded, report.skipped) == (1, 1)
+    assert upload_ard(ard_dir, PREFIX).uploaded == 0
+
+
+def test_upload_without_checksum(tmp_path, s3_client, ard_bucket):
+    """The files without content checksum are always uploaded"""
+    clear_content_hashes()
+    ard_dir, _ = _ard_folder(tmp_path)
+    clear_content_hashes()
+    upload_ard(ard_dir, PREFIX)
+    report = upload_ard(ard_dir, PREFIX)
+    assert (report.uploaded, report.skipped) == (2, 0)
+    assert (
+        s3_client.list_objects_v2(Bucket=ard_bucket, Prefix=".content")["KeyCount"] == 0
+    )
+
+
+def test_ard_bucket_client(monkeypatch):
+    """The ARD bucket client is the one of the ewoc_dag ARD bucket"""
+    pytest.importorskip("ewoc_dag")
+    client = object()
+
+    class _ARDBucket:
+        """EWOCARDBucket configured by ewoc_dag"""
+
+        def __init__(self):
+            self._s3_client = client
+            self._bucket_name = "ewoc-ard-conf"
+
+    monkeypatch.setattr("ewoc_dag.bucket.ewoc.EWOCARDBucket", _ARDBucket)
+    assert ard_bucket_client() == (client, "ewoc-ard-conf")